@@ -1,21 +1,326 @@
-from flask import Flask, render_template, jsonify, request, send_from_directory
+from flask import Flask, render_template, jsonify, request, send_from_directory, g
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 import sqlite3
 import os
+import io
+import csv
+import json
+import time
+import base64
+import hashlib
+import queue
+import re
+import threading
+import click
+import numpy as np
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
 from datetime import datetime
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, LOCK_WAIT_BUCKETS, Registry
+from profiling import PROFILE_REQUESTS, ProfiledConnection, RequestProfiler
+from rules import Rule, evaluate_rules, rule_parameters
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 app = Flask(__name__)
-CORS(app)
+CORS(app, expose_headers=['X-Next-Cursor', 'X-Total-Count', 'ETag', 'X-Last-Event-ID',
+                          'X-Alert-Stream', 'Server-Timing'])
 
-DATABASE = 'hemodialysis.db'
+# Perfilado opcional por request (PROFILE_REQUESTS=1): header Server-Timing y
+# log de requests lentos con sus sentencias SQL
+if PROFILE_REQUESTS:
+    RequestProfiler(app)
 
-def init_db():
-    """Inicializar base de datos con datos de ejemplo"""
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
+# Métricas expuestas en /metrics (formato Prometheus)
+metrics = Registry()
+HTTP_REQUESTS = metrics.counter(
+    'http_requests_total', 'Requests atendidos por ruta', ('method', 'route', 'status'))
+HTTP_LATENCY = metrics.histogram(
+    'http_request_duration_seconds', 'Latencia hasta los headers de la respuesta', ('method', 'route'))
+SQLITE_LOCK_WAIT = metrics.histogram(
+    'sqlite_lock_wait_seconds', 'Espera del lock de escritura (BEGIN IMMEDIATE)', ('operation',),
+    LOCK_WAIT_BUCKETS)
+SQLITE_LOCK_WAITS = metrics.counter(
+    'sqlite_lock_waits_total', 'Transacciones que esperaron al menos 1 ms el lock de escritura',
+    ('operation',))
+SQLITE_BUSY_ERRORS = metrics.counter(
+    'sqlite_busy_errors_total', 'Transacciones que fallaron con database is locked', ('operation',))
+SQLITE_WRITE_TRANSACTION = metrics.histogram(
+    'sqlite_write_transaction_seconds', 'Duración de las transacciones de escritura (con el lock tomado)',
+    ('operation',), LOCK_WAIT_BUCKETS)
+# El primer reintento del busy handler de SQLite duerme 1 ms: una espera mayor
+# implica que el lock estaba tomado por otra conexión. Es una estimación por
+# tiempo; sqlite3 no expone cuántas veces se invocó el busy handler
+SQLITE_LOCK_WAIT_THRESHOLD = 0.001
+
+DATABASE = os.environ.get('DATABASE', 'hemodialysis.db')
+
+# Configuración del pool de conexiones (uno por worker de gunicorn)
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 8))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 10))
+
+# PRAGMAs aplicados a cada conexión nueva
+SQLITE_PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('busy_timeout', 5000),
+    ('cache_size', -16000),       # ~16 MB de caché de páginas
+    ('mmap_size', 134217728),     # 128 MB de lectura mapeada en memoria
+    ('temp_store', 'MEMORY'),
+    ('foreign_keys', 'ON'),
+)
+
+def configure_connection(conn):
+    """Aplicar los PRAGMAs de rendimiento a una conexión"""
+    for pragma, value in SQLITE_PRAGMAS:
+        conn.execute(f"PRAGMA {pragma} = {value}")
+    return conn
+
+class ConnectionPool:
+    """Pool de conexiones SQLite reutilizables dentro de un proceso"""
+
+    def __init__(self, database, size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT):
+        self.database = database
+        self.size = size
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        # Las conexiones heredadas por fork no se cierran ni reutilizan en el hijo
+        self._pid = os.getpid()
+        self._idle = queue.LifoQueue(maxsize=self.size)
+        self._created = 0
+        self._in_use = 0
+        self._checkouts = 0
+        self._reused = 0
+        self._waits = 0
+        self._timeouts = 0
+        self._discarded = 0
+
+    def _connect(self):
+        factory = ProfiledConnection if PROFILE_REQUESTS else sqlite3.Connection
+        conn = sqlite3.connect(self.database, check_same_thread=False, factory=factory)
+        conn.row_factory = sqlite3.Row
+        return configure_connection(conn)
+
+    def acquire(self):
+        """Obtener una conexión del pool, creándola si hay cupo"""
+        with self._lock:
+            if self._pid != os.getpid():
+                self._reset()
+            self._checkouts += 1
+            try:
+                conn = self._idle.get_nowait()
+                self._reused += 1
+                self._in_use += 1
+                return conn
+            except queue.Empty:
+                pass
+            if self._created < self.size:
+                self._created += 1
+                self._in_use += 1
+                create = True
+            else:
+                self._waits += 1
+                create = False
+
+        if create:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                    self._in_use -= 1
+                raise
+
+        try:
+            conn = self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            with self._lock:
+                self._timeouts += 1
+            raise RuntimeError('No hay conexiones disponibles en el pool de base de datos')
+        with self._lock:
+            self._reused += 1
+            self._in_use += 1
+        return conn
+
+    def release(self, conn, discard=False):
+        """Devolver una conexión al pool descartando transacciones abiertas"""
+        with self._lock:
+            if self._pid != os.getpid():
+                return
+            self._in_use -= 1
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            discard = True
+
+        if discard:
+            conn.close()
+            with self._lock:
+                self._created -= 1
+                self._discarded += 1
+            return
+        self._idle.put_nowait(conn)
+
+    def stats(self):
+        """Estadísticas del pool para monitoreo"""
+        with self._lock:
+            return {
+                'pid': self._pid,
+                'size': self.size,
+                'created': self._created,
+                'in_use': self._in_use,
+                'idle': self._idle.qsize(),
+                'checkouts': self._checkouts,
+                'reused': self._reused,
+                'waits': self._waits,
+                'timeouts': self._timeouts,
+                'discarded': self._discarded,
+            }
+
+db_pool = ConnectionPool(DATABASE)
+
+# Campos derivados persistidos en pacientes (misma fórmula que se usaba por fila)
+EDAD_SQL = "CAST((julianday('now') - julianday(fecha_nacimiento)) / 365.25 AS INTEGER)"
+TIEMPO_DIALISIS_SQL = "CAST((julianday('now') - julianday(fecha_inicio_hd)) / 30.44 AS INTEGER)"
+
+# Resúmenes mensuales de laboratorio por paciente y analito, mantenidos por
+# triggers (migración 8): un INSERT en laboratorios actualiza el mes en O(1);
+# UPDATE y DELETE, que no se pueden descontar de mínimo/máximo/último,
+# recalculan solo el mes afectado del paciente. La lista de analitos es fija
+# aquí para que la migración no cambie si cambia LAB_FIELDS.
+MONTHLY_ANALYTES = ('hemoglobina', 'ferritina', 'tsat', 'calcio', 'fosforo', 'pth')
+# Meses (hasta el último con datos) que entran en la pendiente de tendencia
+TREND_MONTHS = 12
+MONTH_INDEX_SQL = "(CAST(substr({mes}, 1, 4) AS INTEGER) * 12 + CAST(substr({mes}, 6, 2) AS INTEGER))"
 
-    # Crear tabla de pacientes
-    cursor.execute("""
+def monthly_rollup_sql(analito, where):
+    """INSERT ... SELECT que recalcula los meses de laboratorios que cumplen `where`"""
+    return f"""
+        INSERT INTO laboratorios_mensuales
+            (paciente_id, analito, mes, n, suma, minimo, maximo, ultimo, ultima_fecha)
+        SELECT paciente_id, '{analito}', mes, COUNT(*), SUM(valor), MIN(valor), MAX(valor),
+               MAX(CASE WHEN orden = 1 THEN valor END), MAX(fecha)
+        FROM (
+            SELECT paciente_id, substr(fecha, 1, 7) AS mes, fecha, {analito} AS valor,
+                   ROW_NUMBER() OVER (
+                       PARTITION BY paciente_id, substr(fecha, 1, 7) ORDER BY fecha DESC, id DESC
+                   ) AS orden
+            FROM laboratorios
+            WHERE {analito} IS NOT NULL AND {where}
+        )
+        GROUP BY paciente_id, mes
+    """
+
+def monthly_upsert_sql(analito):
+    """Sumar un laboratorio nuevo (NEW) al resumen de su mes"""
+    return f"""
+        INSERT INTO laboratorios_mensuales
+            (paciente_id, analito, mes, n, suma, minimo, maximo, ultimo, ultima_fecha)
+        SELECT NEW.paciente_id, '{analito}', substr(NEW.fecha, 1, 7), 1, NEW.{analito},
+               NEW.{analito}, NEW.{analito}, NEW.{analito}, NEW.fecha
+        WHERE NEW.{analito} IS NOT NULL
+        ON CONFLICT (paciente_id, analito, mes) DO UPDATE SET
+            n = n + 1,
+            suma = suma + excluded.suma,
+            minimo = min(minimo, excluded.minimo),
+            maximo = max(maximo, excluded.maximo),
+            ultimo = CASE WHEN excluded.ultima_fecha >= ultima_fecha
+                          THEN excluded.ultimo ELSE ultimo END,
+            ultima_fecha = max(ultima_fecha, excluded.ultima_fecha);
+    """
+
+def month_recompute_sql(row):
+    """Recalcular el mes del laboratorio `row` (OLD o NEW) para todos los analitos"""
+    month = f"substr({row}.fecha, 1, 7)"
+    where = (f"paciente_id = {row}.paciente_id AND fecha >= {month} || '-01' "
+             f"AND fecha < date({month} || '-01', '+1 month')")
+    return (f"DELETE FROM laboratorios_mensuales WHERE paciente_id = {row}.paciente_id "
+            f"AND mes = {month};\n"
+            + ''.join(monthly_rollup_sql(analito, where) + ';\n' for analito in MONTHLY_ANALYTES))
+
+def trend_select_sql(where):
+    """Pendiente por mínimos cuadrados de la media mensual en los últimos TREND_MONTHS meses
+
+    `where` filtra laboratorios_mensuales por (paciente_id, analito); la
+    pendiente queda en unidades del analito por mes.
+    """
+    x = f"({MONTH_INDEX_SQL.format(mes='m.mes')} - {MONTH_INDEX_SQL.format(mes='u.ultimo')})"
+    return f"""
+        SELECT paciente_id, analito,
+               CASE WHEN COUNT(*) > 1 THEN
+                   (COUNT(*) * SUM(x * y) - SUM(x) * SUM(y)) / (COUNT(*) * SUM(x * x) - SUM(x) * SUM(x))
+               END AS pendiente,
+               COUNT(*) AS meses, MIN(mes) AS mes_inicio, MAX(mes) AS mes_fin
+        FROM (
+            SELECT m.paciente_id, m.analito, m.mes, {x} AS x, m.suma / m.n AS y
+            FROM laboratorios_mensuales m
+            JOIN (
+                SELECT paciente_id, analito, MAX(mes) AS ultimo
+                FROM laboratorios_mensuales WHERE {where}
+                GROUP BY paciente_id, analito
+            ) u ON u.paciente_id = m.paciente_id AND u.analito = m.analito
+            WHERE m.mes >= substr(date(u.ultimo || '-01', '-{TREND_MONTHS - 1} months'), 1, 7)
+        )
+        GROUP BY paciente_id, analito
+    """
+
+def trend_insert_sql(where):
+    return ("INSERT OR REPLACE INTO tendencias_laboratorio "
+            "(paciente_id, analito, pendiente, meses, mes_inicio, mes_fin)" + trend_select_sql(where))
+
+# Indicadores de calidad de la clínica: porcentaje mensual de pacientes en
+# meta por analito (valor del último laboratorio del paciente en el mes), por
+# EPS. Los triggers de la migración 9 los mantienen a partir de
+# laboratorios_mensuales; cambiar una meta requiere una migración nueva que
+# recree esos triggers y recalcule indicadores_mensuales.
+KpiTarget = namedtuple('KpiTarget', ['analito', 'minimo', 'maximo'])
+
+KPI_TARGETS = [
+    KpiTarget('hemoglobina', 10, 12),
+    KpiTarget('ferritina', 200, None),
+    KpiTarget('tsat', 20, None),
+    KpiTarget('fosforo', 3.5, 5.5),
+    KpiTarget('pth', 150, 600),
+]
+KPI_NO_EPS = 'Sin EPS'
+
+def kpi_in_target_sql(row):
+    """1 si el último valor del resumen `row` está en la meta de su analito, si no 0"""
+    cases = []
+    for target in KPI_TARGETS:
+        conditions = [f"{row}.ultimo >= {target.minimo}" if target.minimo is not None else None,
+                      f"{row}.ultimo <= {target.maximo}" if target.maximo is not None else None]
+        cases.append(f"WHEN '{target.analito}' THEN ({' AND '.join(c for c in conditions if c)})")
+    return f"(CASE {row}.analito {' '.join(cases)} END)"
+
+KPI_ANALYTES_SQL = ', '.join(f"'{target.analito}'" for target in KPI_TARGETS)
+# Recalcula indicadores_mensuales completo (carga inicial de la migración)
+KPI_ROLLUP_SQL = f"""
+    INSERT INTO indicadores_mensuales (mes, eps, indicador, pacientes, en_meta)
+    SELECT m.mes, COALESCE(p.eps, '{KPI_NO_EPS}'), m.analito, COUNT(*), SUM({kpi_in_target_sql('m')})
+    FROM laboratorios_mensuales m
+    JOIN pacientes p ON p.id = m.paciente_id
+    WHERE m.analito IN ({KPI_ANALYTES_SQL})
+    GROUP BY 1, 2, 3
+"""
+
+# Turnos de las sesiones de diálisis (mismo CHECK que el esquema D1)
+SESSION_SHIFTS = ('LMV_MAÑANA', 'LMV_TARDE', 'LMV_NOCHE', 'MJS_MAÑANA', 'MJS_TARDE', 'MJS_NOCHE')
+
+# Migraciones de esquema versionadas con PRAGMA user_version.
+# Cada entrada es (versión, descripción, sentencias); nunca modificar una
+# migración ya publicada, solo agregar nuevas al final.
+MIGRATIONS = [
+    (1, 'Tablas base', [
+        """
         CREATE TABLE IF NOT EXISTS pacientes (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             documento TEXT UNIQUE NOT NULL,
@@ -32,10 +337,8 @@ def init_db():
             activo BOOLEAN DEFAULT 1,
             fecha_registro DATETIME DEFAULT CURRENT_TIMESTAMP
         )
-    """)
-
-    # Crear tabla de laboratorios
-    cursor.execute("""
+        """,
+        """
         CREATE TABLE IF NOT EXISTS laboratorios (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             paciente_id INTEGER NOT NULL,
@@ -48,10 +351,8 @@ def init_db():
             pth REAL,
             FOREIGN KEY (paciente_id) REFERENCES pacientes(id)
         )
-    """)
-
-    # Crear tabla de alertas
-    cursor.execute("""
+        """,
+        """
         CREATE TABLE IF NOT EXISTS alertas (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             paciente_id INTEGER NOT NULL,
@@ -63,65 +364,798 @@ def init_db():
             prioridad INTEGER DEFAULT 1,
             FOREIGN KEY (paciente_id) REFERENCES pacientes(id)
         )
-    """)
-
-    # Insertar datos de ejemplo si no existen
-    cursor.execute("SELECT COUNT(*) FROM pacientes")
-    if cursor.fetchone()[0] == 0:
-        # Pacientes de ejemplo
-        pacientes_ejemplo = [
-            ('12345678', 'CC', 'María Elena', 'González López', '1965-03-15', 
-             'F', '3001234567', 'Nueva EPS', '2022-06-10', 'Diabetes Mellitus tipo 2', 
-             'Hipertensión arterial, Diabetes tipo 2'),
-            ('87654321', 'CC', 'Carlos Andrés', 'Rodríguez Martín', '1958-08-22', 
-             'M', '3109876543', 'Sanitas EPS', '2021-11-05', 'Nefropatía hipertensiva', 
-             'Hipertensión arterial, Cardiopatía isquémica'),
-            ('45678912', 'CC', 'Ana Lucia', 'Pérez Silva', '1972-12-03', 
-             'F', '3156789012', 'SURA EPS', '2023-01-18', 'Glomerulonefritis crónica', 
-             'Anemia crónica')
-        ]
-
-        cursor.executemany("""
-            INSERT INTO pacientes (documento, tipo_documento, nombres, apellidos, 
-            fecha_nacimiento, genero, telefono, eps, fecha_inicio_hd, causa_erc, comorbilidades)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, pacientes_ejemplo)
-
-        # Laboratorios de ejemplo
-        laboratorios_ejemplo = [
-            (1, '2024-01-15', 10.2, 280, 22, 9.1, 4.8, 220),
-            (1, '2024-02-15', 9.8, 320, 25, 9.3, 5.2, 195),
-            (2, '2024-01-15', 11.1, 450, 28, 8.9, 4.5, 180),
-            (2, '2024-02-15', 10.9, 420, 26, 9.0, 4.7, 165),
-            (3, '2024-01-15', 9.5, 180, 18, 9.2, 5.1, 280),
-            (3, '2024-02-15', 10.1, 240, 21, 9.4, 4.9, 250)
-        ]
-
-        cursor.executemany("""
-            INSERT INTO laboratorios (paciente_id, fecha, hemoglobina, ferritina, 
-            tsat, calcio, fosforo, pth) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        """, laboratorios_ejemplo)
-
-        # Alertas de ejemplo
-        alertas_ejemplo = [
-            (1, 'MODERADA', 'ANEMIA', 'Hemoglobina: 10.2 g/dl. Evaluar incremento de AEE.', 3),
-            (2, 'PREVENTIVA', 'ACCESO_VASCULAR', 'Seguimiento rutinario programado.', 1),
-            (3, 'CRITICA', 'ANEMIA', 'Hemoglobina: 9.5 g/dl. Considerar ajuste urgente.', 4)
-        ]
-
-        cursor.executemany("""
-            INSERT INTO alertas (paciente_id, tipo, categoria, mensaje, prioridad)
-            VALUES (?, ?, ?, ?, ?)
-        """, alertas_ejemplo)
-
-    conn.commit()
-    conn.close()
+        """,
+    ]),
+    (2, 'Índices de consultas frecuentes', [
+        # Últimos laboratorios por paciente (get_patient)
+        """
+        CREATE INDEX IF NOT EXISTS idx_laboratorios_paciente_fecha
+        ON laboratorios(paciente_id, fecha)
+        """,
+        # Listado de pacientes activos ordenado por nombre (get_patients)
+        """
+        CREATE INDEX IF NOT EXISTS idx_pacientes_activo_nombre
+        ON pacientes(activo, nombres, apellidos)
+        """,
+        # Alertas pendientes por prioridad y fecha; índice parcial que cubre
+        # las columnas de get_alerts para evitar leer la tabla
+        """
+        CREATE INDEX IF NOT EXISTS idx_alertas_pendientes
+        ON alertas(prioridad DESC, fecha_creacion DESC, paciente_id, tipo, categoria, mensaje)
+        WHERE resuelta = 0
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_alertas_paciente
+        ON alertas(paciente_id, resuelta)
+        """,
+    ]),
+    (3, 'Índice para filtrar pacientes activos por EPS', [
+        """
+        CREATE INDEX IF NOT EXISTS idx_pacientes_activos_eps
+        ON pacientes(eps, nombres, apellidos) WHERE activo = 1
+        """,
+    ]),
+    (4, 'Versiones de tablas para GET condicionales', [
+        """
+        CREATE TABLE IF NOT EXISTS versiones_tablas (
+            tabla TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+        """,
+        """
+        INSERT OR IGNORE INTO versiones_tablas (tabla, version)
+        VALUES ('pacientes', 0), ('laboratorios', 0), ('alertas', 0)
+        """,
+    ] + [
+        # Cada escritura incrementa la versión de su tabla (compartida entre workers)
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_version_{tabla}_{evento.lower()}
+        AFTER {evento} ON {tabla}
+        BEGIN
+            UPDATE versiones_tablas SET version = version + 1 WHERE tabla = '{tabla}';
+        END
+        """
+        for tabla in ('pacientes', 'laboratorios', 'alertas')
+        for evento in ('INSERT', 'UPDATE', 'DELETE')
+    ]),
+    (5, 'Registro de eventos de alertas para el stream SSE', [
+        """
+        CREATE TABLE IF NOT EXISTS eventos_alertas (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            alerta_id INTEGER NOT NULL,
+            accion TEXT NOT NULL,
+            fecha DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_evento_alerta_creada
+        AFTER INSERT ON alertas
+        BEGIN
+            INSERT INTO eventos_alertas (alerta_id, accion) VALUES (NEW.id, 'CREADA');
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_evento_alerta_resuelta
+        AFTER UPDATE OF resuelta ON alertas
+        WHEN NEW.resuelta = 1 AND OLD.resuelta = 0
+        BEGIN
+            INSERT INTO eventos_alertas (alerta_id, accion) VALUES (NEW.id, 'RESUELTA');
+        END
+        """,
+    ]),
+    (6, 'Edad y tiempo en diálisis persistidos e indexados', [
+        "ALTER TABLE pacientes ADD COLUMN edad INTEGER",
+        "ALTER TABLE pacientes ADD COLUMN tiempo_dialisis_meses INTEGER",
+        f"UPDATE pacientes SET edad = {EDAD_SQL}, tiempo_dialisis_meses = {TIEMPO_DIALISIS_SQL}",
+        """
+        CREATE INDEX IF NOT EXISTS idx_pacientes_activos_edad
+        ON pacientes(edad, id) WHERE activo = 1
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_pacientes_activos_tiempo
+        ON pacientes(tiempo_dialisis_meses, id) WHERE activo = 1
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_pacientes_derivados_insert
+        AFTER INSERT ON pacientes
+        BEGIN
+            UPDATE pacientes SET edad = {EDAD_SQL}, tiempo_dialisis_meses = {TIEMPO_DIALISIS_SQL}
+            WHERE id = NEW.id;
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_pacientes_derivados_update
+        AFTER UPDATE OF fecha_nacimiento, fecha_inicio_hd ON pacientes
+        BEGIN
+            UPDATE pacientes SET edad = {EDAD_SQL}, tiempo_dialisis_meses = {TIEMPO_DIALISIS_SQL}
+            WHERE id = NEW.id;
+        END
+        """,
+        # Fecha (UTC, como date('now')) del último recálculo diario de derivados
+        """
+        CREATE TABLE IF NOT EXISTS tareas_diarias (
+            tarea TEXT PRIMARY KEY,
+            fecha DATE NOT NULL
+        ) WITHOUT ROWID
+        """,
+        "INSERT OR IGNORE INTO tareas_diarias (tarea, fecha) VALUES ('derivados_pacientes', date('now'))",
+    ]),
+    (7, 'Versiones por paciente para invalidar caché de /api/patients/<id>', [
+        """
+        CREATE TABLE IF NOT EXISTS versiones_pacientes (
+            paciente_id INTEGER PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+        """,
+    ] + [
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_version_paciente_{tabla}_{evento.lower()}
+        AFTER {evento} ON {tabla}
+        BEGIN
+            INSERT INTO versiones_pacientes (paciente_id, version) VALUES ({fila}.{columna}, 1)
+            ON CONFLICT(paciente_id) DO UPDATE SET version = version + 1;
+        END
+        """
+        for tabla, columna in (('pacientes', 'id'), ('laboratorios', 'paciente_id'))
+        for evento, fila in (('INSERT', 'NEW'), ('UPDATE', 'NEW'), ('DELETE', 'OLD'))
+    ]),
+    (8, 'Resúmenes mensuales y tendencias de laboratorio por paciente', [
+        """
+        CREATE TABLE IF NOT EXISTS laboratorios_mensuales (
+            paciente_id INTEGER NOT NULL,
+            analito TEXT NOT NULL,
+            mes TEXT NOT NULL,
+            n INTEGER NOT NULL,
+            suma REAL NOT NULL,
+            minimo REAL NOT NULL,
+            maximo REAL NOT NULL,
+            ultimo REAL NOT NULL,
+            ultima_fecha TEXT NOT NULL,
+            PRIMARY KEY (paciente_id, analito, mes)
+        ) WITHOUT ROWID
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS tendencias_laboratorio (
+            paciente_id INTEGER NOT NULL,
+            analito TEXT NOT NULL,
+            pendiente REAL,
+            meses INTEGER NOT NULL,
+            mes_inicio TEXT NOT NULL,
+            mes_fin TEXT NOT NULL,
+            PRIMARY KEY (paciente_id, analito)
+        ) WITHOUT ROWID
+        """,
+    ] + [
+        # Carga inicial desde los laboratorios existentes, antes de los triggers
+        monthly_rollup_sql(analito, '1') for analito in MONTHLY_ANALYTES
+    ] + [
+        trend_insert_sql('1'),
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_laboratorios_mensuales_insert
+        AFTER INSERT ON laboratorios
+        BEGIN
+            {''.join(monthly_upsert_sql(analito) for analito in MONTHLY_ANALYTES)}
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_laboratorios_mensuales_update
+        AFTER UPDATE OF paciente_id, fecha, {', '.join(MONTHLY_ANALYTES)} ON laboratorios
+        BEGIN
+            {month_recompute_sql('OLD')}
+            {month_recompute_sql('NEW')}
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_laboratorios_mensuales_delete
+        AFTER DELETE ON laboratorios
+        BEGIN
+            {month_recompute_sql('OLD')}
+        END
+        """,
+        # Recalcular la pendiente por cada fila sería la mayor parte del costo de
+        # la ingesta: los triggers solo marcan el par y refresh_lab_trends la
+        # recalcula una vez por lote de escritura
+        """
+        CREATE TABLE IF NOT EXISTS tendencias_pendientes (
+            paciente_id INTEGER NOT NULL,
+            analito TEXT NOT NULL,
+            PRIMARY KEY (paciente_id, analito)
+        ) WITHOUT ROWID
+        """,
+    ] + [
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_tendencias_pendientes_{evento.lower()}
+        AFTER {evento} ON laboratorios_mensuales
+        BEGIN
+            -- Sin OR IGNORE: dentro de un UPSERT el algoritmo de conflicto lo fija
+            -- la sentencia externa
+            INSERT INTO tendencias_pendientes (paciente_id, analito)
+            SELECT {fila}.paciente_id, {fila}.analito
+            WHERE NOT EXISTS (
+                SELECT 1 FROM tendencias_pendientes
+                WHERE paciente_id = {fila}.paciente_id AND analito = {fila}.analito
+            );
+        END
+        """
+        for evento, fila in (('INSERT', 'NEW'), ('UPDATE', 'NEW'), ('DELETE', 'OLD'))
+    ]),
+    (9, 'Indicadores mensuales de calidad por EPS', [
+        """
+        CREATE TABLE IF NOT EXISTS indicadores_mensuales (
+            mes TEXT NOT NULL,
+            eps TEXT NOT NULL,
+            indicador TEXT NOT NULL,
+            pacientes INTEGER NOT NULL,
+            en_meta INTEGER NOT NULL,
+            PRIMARY KEY (mes, eps, indicador)
+        ) WITHOUT ROWID
+        """,
+        KPI_ROLLUP_SQL,
+        # Cada paciente aporta un resumen por mes y analito: alta, cambio del
+        # último valor o baja del resumen mueven los contadores de su EPS
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_indicadores_insert
+        AFTER INSERT ON laboratorios_mensuales
+        WHEN NEW.analito IN ({KPI_ANALYTES_SQL})
+        BEGIN
+            INSERT INTO indicadores_mensuales (mes, eps, indicador, pacientes, en_meta)
+            SELECT NEW.mes, COALESCE(p.eps, '{KPI_NO_EPS}'), NEW.analito, 1, {kpi_in_target_sql('NEW')}
+            FROM pacientes p WHERE p.id = NEW.paciente_id
+            ON CONFLICT (mes, eps, indicador) DO UPDATE SET
+                pacientes = pacientes + 1,
+                en_meta = en_meta + excluded.en_meta;
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_indicadores_update
+        AFTER UPDATE OF ultimo ON laboratorios_mensuales
+        WHEN NEW.analito IN ({KPI_ANALYTES_SQL})
+         AND {kpi_in_target_sql('NEW')} != {kpi_in_target_sql('OLD')}
+        BEGIN
+            UPDATE indicadores_mensuales
+            SET en_meta = en_meta + {kpi_in_target_sql('NEW')} - {kpi_in_target_sql('OLD')}
+            WHERE mes = NEW.mes AND indicador = NEW.analito
+              AND eps = (SELECT COALESCE(eps, '{KPI_NO_EPS}') FROM pacientes WHERE id = NEW.paciente_id);
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_indicadores_delete
+        AFTER DELETE ON laboratorios_mensuales
+        WHEN OLD.analito IN ({KPI_ANALYTES_SQL})
+        BEGIN
+            UPDATE indicadores_mensuales
+            SET pacientes = pacientes - 1, en_meta = en_meta - {kpi_in_target_sql('OLD')}
+            WHERE mes = OLD.mes AND indicador = OLD.analito
+              AND eps = (SELECT COALESCE(eps, '{KPI_NO_EPS}') FROM pacientes WHERE id = OLD.paciente_id);
+        END
+        """,
+        # Un cambio de EPS traslada los aportes del paciente de una EPS a la otra
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_indicadores_eps
+        AFTER UPDATE OF eps ON pacientes
+        WHEN OLD.eps IS NOT NEW.eps
+        BEGIN
+            UPDATE indicadores_mensuales
+            SET pacientes = pacientes - 1, en_meta = en_meta - m.meta
+            FROM (
+                SELECT mes, analito, {kpi_in_target_sql('laboratorios_mensuales')} AS meta
+                FROM laboratorios_mensuales
+                WHERE paciente_id = NEW.id AND analito IN ({KPI_ANALYTES_SQL})
+            ) m
+            WHERE indicadores_mensuales.mes = m.mes AND indicadores_mensuales.indicador = m.analito
+              AND indicadores_mensuales.eps = COALESCE(OLD.eps, '{KPI_NO_EPS}');
+            INSERT INTO indicadores_mensuales (mes, eps, indicador, pacientes, en_meta)
+            SELECT mes, COALESCE(NEW.eps, '{KPI_NO_EPS}'), analito, 1,
+                   {kpi_in_target_sql('laboratorios_mensuales')}
+            FROM laboratorios_mensuales
+            WHERE paciente_id = NEW.id AND analito IN ({KPI_ANALYTES_SQL})
+            ON CONFLICT (mes, eps, indicador) DO UPDATE SET
+                pacientes = pacientes + 1,
+                en_meta = en_meta + excluded.en_meta;
+        END
+        """,
+    ]),
+    (10, 'Índice de texto completo de pacientes', [
+        # Índice de contenido externo: guarda solo los términos y lee las
+        # columnas de pacientes. remove_diacritics 2 hace que "Gomez" encuentre
+        # "Gómez"; los índices de prefijo aceleran las búsquedas parciales
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS pacientes_fts USING fts5(
+            nombres, apellidos, documento, eps,
+            content='pacientes', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )
+        """,
+        "INSERT INTO pacientes_fts (pacientes_fts) VALUES ('rebuild')",
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_pacientes_fts_insert
+        AFTER INSERT ON pacientes
+        BEGIN
+            INSERT INTO pacientes_fts (rowid, nombres, apellidos, documento, eps)
+            VALUES (NEW.id, NEW.nombres, NEW.apellidos, NEW.documento, NEW.eps);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_pacientes_fts_delete
+        AFTER DELETE ON pacientes
+        BEGIN
+            INSERT INTO pacientes_fts (pacientes_fts, rowid, nombres, apellidos, documento, eps)
+            VALUES ('delete', OLD.id, OLD.nombres, OLD.apellidos, OLD.documento, OLD.eps);
+        END
+        """,
+        # Solo las columnas indexadas: el recálculo diario de edad no toca el índice
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_pacientes_fts_update
+        AFTER UPDATE OF nombres, apellidos, documento, eps ON pacientes
+        BEGIN
+            INSERT INTO pacientes_fts (pacientes_fts, rowid, nombres, apellidos, documento, eps)
+            VALUES ('delete', OLD.id, OLD.nombres, OLD.apellidos, OLD.documento, OLD.eps);
+            INSERT INTO pacientes_fts (rowid, nombres, apellidos, documento, eps)
+            VALUES (NEW.id, NEW.nombres, NEW.apellidos, NEW.documento, NEW.eps);
+        END
+        """,
+    ]),
+    (11, 'Sesiones de diálisis con presión arterial numérica', [
+        # Mismas columnas que sesiones_dialisis del esquema D1 (hdm/schema.sql),
+        # con la presión arterial en sistólica/diastólica en lugar de texto "120/80"
+        f"""
+        CREATE TABLE IF NOT EXISTS sesiones_dialisis (
+            id INTEGER PRIMARY KEY,
+            paciente_id INTEGER NOT NULL,
+            fecha DATE NOT NULL,
+            turno TEXT NOT NULL CHECK (turno IN ({', '.join(f"'{turno}'" for turno in SESSION_SHIFTS)})),
+            peso_pre REAL,
+            peso_post REAL,
+            peso_seco REAL,
+            qb INTEGER,
+            tiempo_sesion INTEGER,
+            uf_programada REAL,
+            uf_real REAL,
+            kt_v REAL,
+            pru REAL,
+            pas_pre INTEGER,
+            pad_pre INTEGER,
+            pas_post INTEGER,
+            pad_post INTEGER,
+            medicamentos_iv TEXT,
+            complicaciones TEXT,
+            observaciones TEXT,
+            FOREIGN KEY (paciente_id) REFERENCES pacientes (id)
+        )
+        """,
+        # Historial por paciente en orden de fecha (el id va implícito en el índice)
+        "CREATE INDEX IF NOT EXISTS idx_sesiones_paciente_fecha ON sesiones_dialisis(paciente_id, fecha)",
+    ] + [
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_version_paciente_sesiones_dialisis_{evento.lower()}
+        AFTER {evento} ON sesiones_dialisis
+        BEGIN
+            INSERT INTO versiones_pacientes (paciente_id, version) VALUES ({fila}.paciente_id, 1)
+            ON CONFLICT(paciente_id) DO UPDATE SET version = version + 1;
+        END
+        """
+        for evento, fila in (('INSERT', 'NEW'), ('UPDATE', 'NEW'), ('DELETE', 'OLD'))
+    ]),
+    (12, 'Origen de las alertas generadas por reglas', [
+        # regla = parámetro de la regla de laboratorio que creó la alerta; NULL
+        # para las alertas registradas a mano, que las reglas nunca resuelven
+        "ALTER TABLE alertas ADD COLUMN regla TEXT",
+    ] + [
+        # Las alertas existentes con el texto de una regla (los mensajes de
+        # LAB_ALERT_RULES a la fecha de esta migración) vienen del motor de reglas
+        f"UPDATE alertas SET regla = '{parametro}' WHERE regla IS NULL AND mensaje LIKE '{patron}'"
+        for parametro, patron in (
+            ('hemoglobina', 'Hemoglobina: % g/dl. Considerar ajuste urgente.'),
+            ('hemoglobina', 'Hemoglobina: % g/dl. Evaluar reducción de AEE.'),
+            ('ferritina', 'Ferritina: % ng/ml. Evaluar suplencia de hierro IV.'),
+            ('tsat', 'TSAT: %. Evaluar suplencia de hierro.'),
+            ('fosforo', 'Fósforo: % mg/dl fuera de rango (3.5-5.5).'),
+            ('calcio', 'Calcio: % mg/dl fuera de rango (8.4-10.2).'),
+            ('pth', 'PTH: % pg/ml fuera de rango (150-600).'),
+        )
+    ]),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def run_migrations(conn):
+    """Aplicar las migraciones pendientes; devuelve la versión final del esquema"""
+    current = conn.execute("PRAGMA user_version").fetchone()[0]
+    for version, description, statements in MIGRATIONS:
+        if version <= current:
+            continue
+        # Una transacción corta por migración: los lectores en WAL no se bloquean
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Otro proceso pudo aplicarla mientras esperábamos el lock: releer la
+            # versión dentro de la transacción (user_version nunca retrocede)
+            current = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version <= current:
+                conn.execute("COMMIT")
+                continue
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {version}")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        app.logger.info('Migración %s aplicada: %s', version, description)
+        current = version
+    if current == SCHEMA_VERSION:
+        conn.execute("PRAGMA optimize")
+    return current
+
+def init_db():
+    """Inicializar base de datos con datos de ejemplo"""
+    conn = configure_connection(sqlite3.connect(DATABASE))
+    run_migrations(conn)
+    cursor = conn.cursor()
+
+    # Insertar datos de ejemplo si no existen; BEGIN IMMEDIATE evita que dos
+    # procesos que arrancan a la vez los inserten ambos
+    cursor.execute("BEGIN IMMEDIATE")
+    try:
+        cursor.execute("SELECT COUNT(*) FROM pacientes")
+        if cursor.fetchone()[0] == 0:
+            # Pacientes de ejemplo
+            pacientes_ejemplo = [
+                ('12345678', 'CC', 'María Elena', 'González López', '1965-03-15', 
+                 'F', '3001234567', 'Nueva EPS', '2022-06-10', 'Diabetes Mellitus tipo 2', 
+                 'Hipertensión arterial, Diabetes tipo 2'),
+                ('87654321', 'CC', 'Carlos Andrés', 'Rodríguez Martín', '1958-08-22', 
+                 'M', '3109876543', 'Sanitas EPS', '2021-11-05', 'Nefropatía hipertensiva', 
+                 'Hipertensión arterial, Cardiopatía isquémica'),
+                ('45678912', 'CC', 'Ana Lucia', 'Pérez Silva', '1972-12-03', 
+                 'F', '3156789012', 'SURA EPS', '2023-01-18', 'Glomerulonefritis crónica', 
+                 'Anemia crónica')
+            ]
+
+            cursor.executemany("""
+                INSERT INTO pacientes (documento, tipo_documento, nombres, apellidos, 
+                fecha_nacimiento, genero, telefono, eps, fecha_inicio_hd, causa_erc, comorbilidades)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, pacientes_ejemplo)
+
+            # Laboratorios de ejemplo
+            laboratorios_ejemplo = [
+                (1, '2024-01-15', 10.2, 280, 22, 9.1, 4.8, 220),
+                (1, '2024-02-15', 9.8, 320, 25, 9.3, 5.2, 195),
+                (2, '2024-01-15', 11.1, 450, 28, 8.9, 4.5, 180),
+                (2, '2024-02-15', 10.9, 420, 26, 9.0, 4.7, 165),
+                (3, '2024-01-15', 9.5, 180, 18, 9.2, 5.1, 280),
+                (3, '2024-02-15', 10.1, 240, 21, 9.4, 4.9, 250)
+            ]
+
+            cursor.executemany("""
+                INSERT INTO laboratorios (paciente_id, fecha, hemoglobina, ferritina, 
+                tsat, calcio, fosforo, pth) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, laboratorios_ejemplo)
+
+            # Alertas de ejemplo: dos manuales y una con el texto de la regla de Hb crítica
+            alertas_ejemplo = [
+                (1, 'MODERADA', 'ANEMIA', 'Hemoglobina: 10.2 g/dl. Evaluar incremento de AEE.', 3, None),
+                (2, 'PREVENTIVA', 'ACCESO_VASCULAR', 'Seguimiento rutinario programado.', 1, None),
+                (3, 'CRITICA', 'ANEMIA', 'Hemoglobina: 9.5 g/dl. Considerar ajuste urgente.', 4, 'hemoglobina')
+            ]
+
+            cursor.executemany("""
+                INSERT INTO alertas (paciente_id, tipo, categoria, mensaje, prioridad, regla)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, alertas_ejemplo)
+            refresh_lab_trends(conn)
+
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
 
 def get_db():
-    """Obtener conexión a base de datos"""
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
-    return conn
+    """Obtener la conexión del request actual desde el pool"""
+    if 'db' not in g:
+        g.db = db_pool.acquire()
+    return g.db
+
+@app.teardown_appcontext
+def close_db(exception=None):
+    """Devolver la conexión del request al pool"""
+    conn = g.pop('db', None)
+    if conn is not None:
+        db_pool.release(conn)
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    """Contar el request y su latencia por plantilla de ruta (cardinalidad acotada)"""
+    started = g.pop('request_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        HTTP_REQUESTS.inc(request.method, route, response.status_code)
+        HTTP_LATENCY.observe(time.perf_counter() - started, request.method, route)
+        metrics.flush()
+    return response
+
+def is_busy_error(error):
+    """El error es un 'database is locked' tras agotar busy_timeout"""
+    return isinstance(error, sqlite3.OperationalError) and 'locked' in str(error)
+
+def record_lock_wait(operation, waited):
+    """Registrar la espera del lock de escritura de una transacción"""
+    SQLITE_LOCK_WAIT.observe(waited, operation)
+    if waited >= SQLITE_LOCK_WAIT_THRESHOLD:
+        SQLITE_LOCK_WAITS.inc(operation)
+
+@contextmanager
+def write_transaction(conn, operation):
+    """Transacción de escritura BEGIN IMMEDIATE ... COMMIT medida para /metrics
+
+    Tomar el lock al inicio evita el SQLITE_BUSY de una transacción diferida
+    que intenta escribir después de leer; la espera del lock y la duración de
+    la transacción quedan en los histogramas de SQLite.
+    """
+    start = time.perf_counter()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+    except sqlite3.OperationalError as e:
+        if is_busy_error(e):
+            SQLITE_BUSY_ERRORS.inc(operation)
+        raise
+    acquired = time.perf_counter()
+    record_lock_wait(operation, acquired - start)
+    try:
+        yield conn
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        if is_busy_error(e):
+            SQLITE_BUSY_ERRORS.inc(operation)
+        raise
+    finally:
+        SQLITE_WRITE_TRANSACTION.observe(time.perf_counter() - acquired, operation)
+
+REFRESH_DERIVED_SQL = f"""
+    UPDATE pacientes
+    SET edad = {EDAD_SQL}, tiempo_dialisis_meses = {TIEMPO_DIALISIS_SQL}
+    WHERE edad IS NOT {EDAD_SQL}
+       OR tiempo_dialisis_meses IS NOT {TIEMPO_DIALISIS_SQL}
+"""
+MARK_DERIVED_SQL = """
+    INSERT OR REPLACE INTO tareas_diarias (tarea, fecha)
+    VALUES ('derivados_pacientes', date('now'))
+"""
+
+def refresh_derived_fields(conn):
+    """Recalcular edad y tiempo en diálisis; solo escribe las filas que cambian"""
+    cursor = conn.execute(REFRESH_DERIVED_SQL)
+    conn.execute(MARK_DERIVED_SQL)
+    return cursor.rowcount
+
+DERIVED_PENDING_SQL = """
+    SELECT 1 FROM tareas_diarias WHERE tarea = 'derivados_pacientes' AND fecha < date('now')
+"""
+
+# Día (UTC) en que este worker confirmó que los derivados están al día
+_derived_checked_on = None
+
+@app.before_request
+def refresh_derived_daily():
+    """Recalcular los campos derivados una vez al día, en el primer request"""
+    global _derived_checked_on
+    today = datetime.utcnow().date().isoformat()
+    if _derived_checked_on == today:
+        return
+
+    conn = get_db()
+    if conn.execute(DERIVED_PENDING_SQL).fetchone():
+        # BEGIN IMMEDIATE serializa a los workers: solo uno hace el recálculo
+        with write_transaction(conn, 'refresh_derived'):
+            if conn.execute(DERIVED_PENDING_SQL).fetchone():
+                refresh_derived_fields(conn)
+    _derived_checked_on = today
+
+def table_versions_sql(tables):
+    """Consulta de las versiones de las tablas indicadas"""
+    placeholders = ', '.join('?' for _ in tables)
+    return f"SELECT tabla, version FROM versiones_tablas WHERE tabla IN ({placeholders})"
+
+def table_versions(conn, tables):
+    """Versiones actuales de las tablas indicadas"""
+    rows = conn.execute(table_versions_sql(tables), tuple(tables))
+    return {row['tabla']: row['version'] for row in rows}
+
+def make_etag(*parts):
+    """ETag compacto a partir de sus componentes (URL, versiones, extras)"""
+    key = '|'.join(str(part) for part in parts)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:24]
+
+def version_tags(versions, tables):
+    """Componentes del ETag para las versiones de `tables`"""
+    return [f'{tabla}:{versions.get(tabla, 0)}' for tabla in tables]
+
+PATIENT_VERSION_SQL = "SELECT version FROM versiones_pacientes WHERE paciente_id = ?"
+
+def data_etag(conn, tables, *extra):
+    """ETag derivado de las versiones de las tablas y de la URL solicitada"""
+    versions = table_versions(conn, tables)
+    return make_etag(request.full_path, *version_tags(versions, tables), *extra)
+
+def patient_etag(conn, patient_id):
+    """ETag de un paciente según su versión (cambia con sus datos o laboratorios)"""
+    row = conn.execute(PATIENT_VERSION_SQL, (patient_id,)).fetchone()
+    return make_etag(request.full_path, f"paciente:{patient_id}:{row['version'] if row else 0}")
+
+def not_modified(etag):
+    """Respuesta 304 si el cliente ya tiene la versión actual, o None"""
+    if request.if_none_match.contains_weak(etag):
+        return with_etag(app.response_class(status=304), etag)
+    return None
+
+def with_etag(response, etag):
+    """Adjuntar ETag y obligar al navegador a revalidar antes de reutilizar"""
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.vary.add('Accept')
+    return response
+
+# Serialización JSON: orjson si está instalado (opcional), json estándar si no
+if orjson is not None:
+    class OrjsonProvider(DefaultJSONProvider):
+        """Proveedor JSON de Flask basado en orjson"""
+
+        def dumps(self, obj, **kwargs):
+            option = orjson.OPT_SORT_KEYS if self.sort_keys else 0
+            return orjson.dumps(obj, default=self.default, option=option).decode('utf-8')
+
+        def loads(self, s, **kwargs):
+            return orjson.loads(s)
+
+    app.json = OrjsonProvider(app)
+
+    def dumps_line(obj):
+        return orjson.dumps(obj, option=orjson.OPT_APPEND_NEWLINE)
+else:
+    def dumps_line(obj):
+        return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b'\n'
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+NDJSON_CHUNK_ROWS = 500
+
+def wants_ndjson():
+    """El cliente pidió NDJSON en el header Accept"""
+    return request.accept_mimetypes.best_match(['application/json', NDJSON_MIMETYPE]) == NDJSON_MIMETYPE
+
+def stream_ndjson(sql, params, build):
+    """Respuesta NDJSON que recorre el cursor por bloques sin armar la lista completa"""
+    def generate():
+        # El generador corre después del teardown del request: usa su propia conexión
+        conn = db_pool.acquire()
+        try:
+            cursor = conn.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(NDJSON_CHUNK_ROWS)
+                if not rows:
+                    break
+                yield b''.join(dumps_line(build(row)) for row in rows)
+        finally:
+            db_pool.release(conn)
+
+    response = app.response_class(generate(), mimetype=NDJSON_MIMETYPE)
+    response.vary.add('Accept')
+    return response
+
+# Caché de respuestas serializadas
+RESPONSE_CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', 512))
+RESPONSE_CACHE_TTL = float(os.environ.get('RESPONSE_CACHE_TTL', 60))
+CACHED_HEADERS = ('X-Next-Cursor', 'X-Total-Count', 'X-Last-Event-ID')
+
+class ResponseCache:
+    """Caché LRU con TTL de respuestas JSON ya serializadas.
+
+    Cada entrada guarda el ETag con el que se generó; como el ETag se deriva
+    de las versiones de las tablas (o del paciente) que mantienen los
+    triggers, cualquier escritura, de cualquier worker, invalida exactamente
+    las respuestas afectadas.
+    """
+
+    def __init__(self, maxsize=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key, etag):
+        """Entrada vigente para `key` generada con `etag`, o None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry['etag'] != etag:
+                del self._entries[key]
+                self.invalidations += 1
+                self.misses += 1
+                return None
+            if entry['expires'] < time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def set(self, key, etag, response):
+        """Guardar una respuesta 200 ya construida"""
+        if response.status_code != 200:
+            return
+        self.store(key, etag, response.get_data(), response.mimetype,
+                   {h: response.headers[h] for h in CACHED_HEADERS if h in response.headers})
+
+    def store(self, key, etag, body, mimetype, headers):
+        """Guardar un cuerpo ya serializado con sus headers relevantes"""
+        if self.maxsize <= 0:
+            return
+        entry = {
+            'etag': etag,
+            'expires': time.monotonic() + self.ttl,
+            'body': body,
+            'mimetype': mimetype,
+            'headers': headers,
+        }
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, prefix):
+        """Descartar las entradas cuya URL empieza por `prefix`"""
+        with self._lock:
+            keys = [key for key in self._entries if key.startswith(prefix)]
+            for key in keys:
+                del self._entries[key]
+            self.invalidations += len(keys)
+
+    def stats(self):
+        """Contadores para monitoreo"""
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+            }
+
+response_cache = ResponseCache()
+
+def cached_response(etag):
+    """Respuesta desde la caché para el request actual, o None"""
+    entry = response_cache.get(request.full_path, etag)
+    if entry is None:
+        return None
+    response = app.response_class(entry['body'], mimetype=entry['mimetype'])
+    response.headers.update(entry['headers'])
+    return with_etag(response, etag)
+
+def cache_response(etag, response):
+    """Guardar la respuesta del request actual en la caché"""
+    response_cache.set(request.full_path, etag, response)
+    return response
 
 # Rutas principales
 @app.route('/')
@@ -134,154 +1168,1478 @@ def static_files(filename):
     """Servir archivos estáticos"""
     return send_from_directory('static', filename)
 
+# Campos disponibles en el listado de pacientes: columnas SQL necesarias y
+# función que construye el valor de salida a partir de la fila
+PATIENT_FIELDS = {
+    'id': (('id',), lambda row: row['id']),
+    'documento': (('tipo_documento', 'documento'),
+                  lambda row: f"{row['tipo_documento']} {row['documento']}"),
+    'nombres': (('nombres',), lambda row: row['nombres']),
+    'apellidos': (('apellidos',), lambda row: row['apellidos']),
+    'edad': (('edad',), lambda row: row['edad'] or 0),
+    'genero': (('genero',), lambda row: row['genero']),
+    'eps': (('eps',), lambda row: row['eps']),
+    'fecha_inicio_hd': (('fecha_inicio_hd',), lambda row: row['fecha_inicio_hd']),
+    'causa_erc': (('causa_erc',), lambda row: row['causa_erc']),
+    'activo': (('activo',), lambda row: bool(row['activo'])),
+    'tiempo_dialisis_meses': (('tiempo_dialisis_meses',),
+                              lambda row: row['tiempo_dialisis_meses'] or 0),
+}
+
+# Órdenes disponibles: columnas de la clave de paginación (la última es id)
+PATIENT_ORDERINGS = {
+    'nombre': ('nombres', 'apellidos', 'id'),
+    'edad': ('edad', 'id'),
+    'tiempo_dialisis_meses': ('tiempo_dialisis_meses', 'id'),
+}
+
+# Filtros de rango sobre columnas derivadas indexadas
+PATIENT_RANGE_FILTERS = (
+    ('edad_min', 'edad', '>='),
+    ('edad_max', 'edad', '<='),
+    ('tiempo_min', 'tiempo_dialisis_meses', '>='),
+    ('tiempo_max', 'tiempo_dialisis_meses', '<='),
+)
+
+PATIENTS_PAGE_SIZE = 100
+PATIENTS_MAX_PAGE_SIZE = 500
+
+def encode_cursor(values):
+    """Codificar la clave de paginación como cursor opaco"""
+    raw = json.dumps(values, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+def decode_cursor(cursor):
+    """Decodificar un cursor de paginación; ValueError si es inválido"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except Exception:
+        raise ValueError('Cursor inválido')
+    # Solo valores escalares: cada elemento se enlaza como parámetro SQL
+    if not isinstance(values, list) or not all(
+            value is None or isinstance(value, (str, int, float)) for value in values):
+        raise ValueError('Cursor inválido')
+    return values
+
+def parse_number(args, name, kind):
+    """Parámetro numérico opcional; ValueError con un mensaje para el cliente"""
+    value = args.get(name)
+    if not value:
+        return None
+    try:
+        return kind(value)
+    except ValueError:
+        expected = 'un entero' if kind is int else 'numérico'
+        raise ValueError(f'Parámetro {name} debe ser {expected}')
+
+def build_patients_query(args, ndjson=False):
+    """Armar la consulta del listado de pacientes a partir de los parámetros.
+
+    Devuelve (sql, params, key, limit, build_patient); sin LIMIT en el SQL.
+    Lanza ValueError con el mensaje para el cliente si algún parámetro es inválido.
+    """
+    fields = list(PATIENT_FIELDS)
+    if args.get('fields'):
+        fields = [f.strip() for f in args['fields'].split(',') if f.strip()]
+        invalid = [f for f in fields if f not in PATIENT_FIELDS]
+        if invalid:
+            raise ValueError(f"Campos no válidos: {', '.join(invalid)}")
+
+    ordering = args.get('orden', 'nombre')
+    if ordering not in PATIENT_ORDERINGS:
+        raise ValueError(f'Orden no válido: {ordering}')
+    key = PATIENT_ORDERINGS[ordering]
+
+    # NDJSON es para exportar: sin límite por defecto ni tope de página
+    limit = parse_number(args, 'limit', int)
+    if ndjson:
+        limit = max(limit, 1) if limit is not None else None
+    else:
+        limit = min(max(PATIENTS_PAGE_SIZE if limit is None else limit, 1), PATIENTS_MAX_PAGE_SIZE)
+    ranges = [(column, op, parse_number(args, arg, float))
+              for arg, column, op in PATIENT_RANGE_FILTERS if args.get(arg)]
+    after = decode_cursor(args['cursor']) if args.get('cursor') else None
+    if after is not None and len(after) != len(key):
+        raise ValueError('Cursor inválido')
+
+    # Las columnas de la clave de paginación siempre se seleccionan
+    columns = list(key)
+    for field in fields:
+        for column in PATIENT_FIELDS[field][0]:
+            if column not in columns:
+                columns.append(column)
+
+    conditions = ['activo = 1']
+    params = []
+    for arg, column in (('eps', 'eps'), ('causa_erc', 'causa_erc'), ('genero', 'genero')):
+        if args.get(arg):
+            conditions.append(f'{column} = ?')
+            params.append(args[arg])
+    for column, op, value in ranges:
+        conditions.append(f'{column} {op} ?')
+        params.append(value)
+    if after is not None:
+        conditions.append(f"({', '.join(key)}) > ({', '.join('?' for _ in key)})")
+        params.extend(after)
+
+    sql = f"""
+        SELECT {', '.join(columns)}
+        FROM pacientes WHERE {' AND '.join(conditions)}
+        ORDER BY {', '.join(key)}
+    """
+    builders = [(field, PATIENT_FIELDS[field][1]) for field in fields]
+
+    def build_patient(row):
+        return {field: build(row) for field, build in builders}
+
+    return sql, params, key, limit, build_patient
+
+def patients_count_sql(sql):
+    """Total de pacientes de la consulta de build_patients_query (primera página)"""
+    return f"SELECT COUNT(*) FROM ({sql})"
+
 # API Routes
 @app.route('/api/patients', methods=['GET'])
 def get_patients():
-    """Obtener todos los pacientes"""
+    """Obtener pacientes activos paginados por cursor, con filtros y selección de campos"""
     try:
+        ndjson = wants_ndjson()
+        try:
+            sql, params, key, limit, build_patient = build_patients_query(request.args, ndjson)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        if ndjson:
+            if limit is not None:
+                sql += " LIMIT ?"
+                params.append(limit)
+            return stream_ndjson(sql, params, build_patient)
+
         conn = get_db()
-        cursor = conn.cursor()
 
-        cursor.execute("""
-            SELECT id, documento, tipo_documento, nombres, apellidos, 
-                   genero, eps, fecha_inicio_hd, causa_erc, activo,
-                   (julianday('now') - julianday(fecha_nacimiento)) / 365.25 as edad,
-                   (julianday('now') - julianday(fecha_inicio_hd)) / 30.44 as tiempo_dialisis_meses
-            FROM pacientes WHERE activo = 1
-            ORDER BY nombres, apellidos
-        """)
-
-        patients = []
-        for row in cursor.fetchall():
-            patients.append({
-                'id': row['id'],
-                'documento': f"{row['tipo_documento']} {row['documento']}",
-                'nombres': row['nombres'],
-                'apellidos': row['apellidos'],
-                'edad': int(row['edad']) if row['edad'] else 0,
-                'genero': row['genero'],
-                'eps': row['eps'],
-                'fecha_inicio_hd': row['fecha_inicio_hd'],
-                'causa_erc': row['causa_erc'],
-                'activo': bool(row['activo']),
-                'tiempo_dialisis_meses': int(row['tiempo_dialisis_meses']) if row['tiempo_dialisis_meses'] else 0
-            })
+        # El recálculo diario de edad/tiempo actualiza la versión de pacientes
+        etag = data_etag(conn, ('pacientes',))
+        cached = not_modified(etag) or cached_response(etag)
+        if cached is not None:
+            return cached
 
-        conn.close()
-        return jsonify(patients)
+        rows = conn.execute(sql + " LIMIT ?", params + [limit + 1]).fetchall()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+
+        patients = [build_patient(row) for row in rows]
+
+        response = with_etag(jsonify(patients), etag)
+        if has_more:
+            last = rows[-1]
+            response.headers['X-Next-Cursor'] = encode_cursor([last[column] for column in key])
+        if not request.args.get('cursor'):
+            response.headers['X-Total-Count'] = str(conn.execute(patients_count_sql(sql), params).fetchone()[0])
+        return cache_response(etag, response)
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# Búsqueda de pacientes por nombre, documento o EPS sobre pacientes_fts
+SEARCH_PAGE_SIZE = 20
+SEARCH_MAX_PAGE_SIZE = 100
+# Pesos bm25 por columna (nombres, apellidos, documento, eps): una coincidencia
+# en el documento o el nombre pesa más que en la EPS, que comparten muchos.
+# Se puntúan todas las coincidencias de pacientes activos antes de cortar, así
+# el orden es exacto aunque el prefijo sea muy común
+SEARCH_SQL = f"""
+    SELECT {', '.join(dict.fromkeys(f'p.{c}' for columns, _ in PATIENT_FIELDS.values() for c in columns))}
+    FROM pacientes_fts f
+    JOIN pacientes p ON p.id = f.rowid
+    WHERE pacientes_fts MATCH ? AND p.activo = 1
+    ORDER BY bm25(pacientes_fts, 2.0, 2.0, 4.0, 0.5), p.apellidos, p.nombres, p.id
+    LIMIT ?
+"""
+
+def fts_query(text):
+    """Consulta FTS5 de prefijos para el texto del usuario (None si no tiene términos)
+
+    Cada palabra se cita para que la sintaxis de FTS5 (comillas, AND, NEAR, *)
+    no se interprete, y todas deben aparecer: "gom mar" encuentra María Gómez.
+    """
+    terms = re.findall(r'\w+', text)
+    if not terms:
+        return None
+    return ' '.join(f'"{term}"*' for term in terms)
+
+@app.route('/api/patients/search', methods=['GET'])
+def search_patients():
+    """Buscar pacientes activos por nombres, apellidos, documento o EPS"""
+    try:
+        match = fts_query(request.args.get('q', ''))
+        if match is None:
+            raise ValueError('Parámetro q requerido')
+        limit = parse_number(request.args, 'limit', int)
+        limit = min(max(SEARCH_PAGE_SIZE if limit is None else limit, 1), SEARCH_MAX_PAGE_SIZE)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        conn = get_db()
+
+        etag = data_etag(conn, ('pacientes',))
+        cached = not_modified(etag) or cached_response(etag)
+        if cached is not None:
+            return cached
+
+        rows = conn.execute(SEARCH_SQL, (match, limit)).fetchall()
+        patients = [{field: build(row) for field, (_, build) in PATIENT_FIELDS.items()}
+                    for row in rows]
+        return cache_response(etag, with_etag(jsonify(patients), etag))
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+INSERT_PATIENT_SQL = """
+    INSERT INTO pacientes (documento, tipo_documento, nombres, apellidos,
+    fecha_nacimiento, genero, telefono, eps, fecha_inicio_hd, causa_erc, comorbilidades)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
 @app.route('/api/patients', methods=['POST'])
 def create_patient():
     """Crear nuevo paciente"""
     try:
-        data = request.get_json()
+        try:
+            values = validate_patient(request.get_json(silent=True))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
 
         conn = get_db()
-        cursor = conn.cursor()
-
-        cursor.execute("""
-            INSERT INTO pacientes (documento, tipo_documento, nombres, apellidos, 
-            fecha_nacimiento, genero, telefono, eps, fecha_inicio_hd, causa_erc, comorbilidades)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (
-            data['documento'], data['tipo_documento'], data['nombres'], data['apellidos'],
-            data['fecha_nacimiento'], data['genero'], data.get('telefono'),
-            data.get('eps'), data['fecha_inicio_hd'], data.get('causa_erc'),
-            data.get('comorbilidades')
-        ))
+        with write_transaction(conn, 'create_patient'):
+            cursor = conn.execute(INSERT_PATIENT_SQL, values)
 
         patient_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+        response_cache.invalidate('/api/patients?')
 
         return jsonify({'id': patient_id, 'message': 'Paciente creado exitosamente'}), 201
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# Importación masiva de pacientes
+BULK_BATCH_SIZE = 500
+BULK_MAX_ERRORS = 1000
+
+PATIENT_REQUIRED = ('documento', 'tipo_documento', 'nombres', 'apellidos',
+                    'fecha_nacimiento', 'genero', 'fecha_inicio_hd')
+PATIENT_OPTIONAL = ('telefono', 'eps', 'causa_erc', 'comorbilidades')
+
+def validate_patient(data):
+    """Validar un registro de paciente y devolver la tupla para INSERT"""
+    if not isinstance(data, dict):
+        raise ValueError('Registro inválido')
+    values = {}
+    for field in PATIENT_REQUIRED + PATIENT_OPTIONAL:
+        value = data.get(field)
+        if isinstance(value, str):
+            value = value.strip() or None
+        values[field] = value
+    missing = [field for field in PATIENT_REQUIRED if not values[field]]
+    if missing:
+        raise ValueError(f"Campos obligatorios faltantes: {', '.join(missing)}")
+    for field in ('fecha_nacimiento', 'fecha_inicio_hd'):
+        try:
+            datetime.strptime(str(values[field]), '%Y-%m-%d')
+        except ValueError:
+            raise ValueError(f'{field} debe tener formato AAAA-MM-DD')
+    values['documento'] = str(values['documento'])
+    return (
+        values['documento'], values['tipo_documento'], values['nombres'], values['apellidos'],
+        values['fecha_nacimiento'], values['genero'], values['telefono'],
+        values['eps'], values['fecha_inicio_hd'], values['causa_erc'],
+        values['comorbilidades']
+    )
+
+def iter_records(stream, content_type):
+    """Leer registros de un cuerpo CSV o NDJSON sin cargarlo completo en memoria"""
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    if 'csv' in content_type:
+        # La fila 1 es el encabezado
+        for number, row in enumerate(csv.DictReader(text), start=2):
+            yield number, row, None
+    else:
+        for number, line in enumerate(text, start=1):
+            if not line.strip():
+                continue
+            try:
+                yield number, json.loads(line), None
+            except ValueError:
+                yield number, None, 'JSON inválido'
+
+def insert_patient_batch(conn, batch, errors):
+    """Insertar un lote validado en una sola transacción; devuelve filas insertadas"""
+    documentos = [values[0] for _, values in batch]
+    placeholders = ', '.join('?' for _ in documentos)
+    # La verificación de duplicados va dentro de la transacción de escritura
+    with write_transaction(conn, 'bulk_patients'):
+        existing = {row[0] for row in conn.execute(
+            f"SELECT documento FROM pacientes WHERE documento IN ({placeholders})", documentos)}
+
+        rows = []
+        for number, values in batch:
+            if values[0] in existing:
+                errors.append({'fila': number, 'error': f'Documento {values[0]} ya existe'})
+                continue
+            existing.add(values[0])
+            rows.append(values)
+
+        conn.executemany(INSERT_PATIENT_SQL, rows)
+    return len(rows)
+
+@app.route('/api/patients/bulk', methods=['POST'])
+def bulk_create_patients():
+    """Importar pacientes en lote desde CSV o NDJSON"""
+    content_type = request.mimetype or ''
+    if content_type not in ('text/csv', 'application/x-ndjson', 'application/jsonl'):
+        return jsonify({'error': 'Content-Type debe ser text/csv o application/x-ndjson'}), 415
+
+    try:
+        conn = get_db()
+        started = time.perf_counter()
+        total = inserted = 0
+        errors = []
+        batch = []
+
+        for number, data, error in iter_records(request.stream, content_type):
+            total += 1
+            if error is None:
+                try:
+                    batch.append((number, validate_patient(data)))
+                except ValueError as e:
+                    error = str(e)
+            if error is not None:
+                errors.append({'fila': number, 'error': error})
+            if len(batch) >= BULK_BATCH_SIZE:
+                inserted += insert_patient_batch(conn, batch, errors)
+                batch = []
+
+        if batch:
+            inserted += insert_patient_batch(conn, batch, errors)
+        if inserted:
+            response_cache.invalidate('/api/patients?')
+
+        elapsed = time.perf_counter() - started
+        errors.sort(key=lambda error: error['fila'])
+        return jsonify({
+            'filas': total,
+            'insertados': inserted,
+            'rechazados': len(errors),
+            'errores': errors[:BULK_MAX_ERRORS],
+            'segundos': round(elapsed, 3),
+            'filas_por_segundo': round(total / elapsed, 1) if elapsed > 0 else total
+        })
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# Ingesta de laboratorios
+LAB_BATCH_SIZE = 5000
+LAB_FIELDS = ('hemoglobina', 'ferritina', 'tsat', 'calcio', 'fosforo', 'pth')
+LAB_DATE_FORMATS = ('%Y-%m-%d', '%Y%m%d', '%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S', '%Y%m%d%H%M')
+
+# Códigos de analitos en el formato de líneas tipo HL7
+HL7_CODES = {
+    'HGB': 'hemoglobina',
+    'FERR': 'ferritina',
+    'TSAT': 'tsat',
+    'CA': 'calcio',
+    'PHOS': 'fosforo',
+    'PTH': 'pth',
+}
+
+# Reglas de alertas sobre el último laboratorio, con el motor compartido con
+# hdm (rules.py) más la prioridad que ordena /api/alerts. Los umbrales son
+# deliberadamente distintos de los de hdm: aquí clasifican alertas por
+# urgencia (p. ej. Hb < 10 es CRITICA) y allá expresan las metas de la guía.
+# Un cambio de umbral en esta aplicación es una sola edición en esta tabla.
+LAB_ALERT_RULES = [
+    Rule('hemoglobina', 10, None, 'CRITICA', 'ANEMIA',
+         'Hemoglobina: {valor} g/dl. Considerar ajuste urgente.', 4),
+    Rule('hemoglobina', None, 12, 'MODERADA', 'ANEMIA',
+         'Hemoglobina: {valor} g/dl. Evaluar reducción de AEE.', 3),
+    Rule('ferritina', 200, None, 'MODERADA', 'ANEMIA',
+         'Ferritina: {valor} ng/ml. Evaluar suplencia de hierro IV.', 3),
+    Rule('tsat', 20, None, 'MODERADA', 'ANEMIA',
+         'TSAT: {valor}%. Evaluar suplencia de hierro.', 3),
+    Rule('fosforo', 3.5, 5.5, 'MODERADA', 'MINERAL_OSEO',
+         'Fósforo: {valor} mg/dl fuera de rango (3.5-5.5).', 3),
+    Rule('calcio', 8.4, 10.2, 'MODERADA', 'MINERAL_OSEO',
+         'Calcio: {valor} mg/dl fuera de rango (8.4-10.2).', 3),
+    Rule('pth', 150, 600, 'PREVENTIVA', 'MINERAL_OSEO',
+         'PTH: {valor} pg/ml fuera de rango (150-600).', 2),
+]
+LAB_ALERT_CATEGORIES = sorted({rule.categoria for rule in LAB_ALERT_RULES})
+
+def parse_lab_date(value):
+    """Normalizar la fecha de un laboratorio a AAAA-MM-DD"""
+    value = (value or '').strip()
+    for fmt in LAB_DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).date().isoformat()
+        except ValueError:
+            continue
+    raise ValueError(f'Fecha inválida: {value!r}')
+
+def validate_lab(data):
+    """Validar un resultado de laboratorio y devolver (documento, fecha, valores)"""
+    documento = str(data.get('documento') or '').strip()
+    if not documento:
+        raise ValueError('Documento faltante')
+    fecha = parse_lab_date(data.get('fecha'))
+    values = []
+    for field in LAB_FIELDS:
+        value = data.get(field)
+        if value is None or (isinstance(value, str) and not value.strip()):
+            values.append(None)
+            continue
+        try:
+            values.append(float(value))
+        except (TypeError, ValueError):
+            raise ValueError(f'{field} no numérico: {value!r}')
+    if all(value is None for value in values):
+        raise ValueError('Sin resultados de laboratorio')
+    return documento, fecha, tuple(values)
+
+def iter_hl7_records(lines):
+    """Leer resultados en formato de líneas tipo HL7 (PID / OBR / OBX)
+
+    PID|<documento> inicia un paciente, OBR|<fecha> inicia un panel y cada
+    OBX|<código>|<valor> agrega un analito al panel en curso.
+    """
+    current, start = None, None
+    for number, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        segment, _, rest = line.partition('|')
+        fields = rest.split('|')
+        segment = segment.upper()
+        if segment == 'PID':
+            if current and 'fecha' in current:
+                yield start, current, None
+            current, start = {'documento': fields[0]}, number
+        elif segment == 'OBR':
+            if current is None:
+                yield number, None, 'OBR sin PID previo'
+                continue
+            if 'fecha' in current:
+                yield start, current, None
+                current = {'documento': current['documento']}
+            current['fecha'], start = fields[0], number
+        elif segment == 'OBX':
+            code = fields[0].upper()
+            if current is None or 'fecha' not in current:
+                yield number, None, 'OBX sin PID/OBR previo'
+            elif code not in HL7_CODES or len(fields) < 2:
+                yield number, None, f'Segmento OBX no reconocido: {fields[0]}'
+            else:
+                current[HL7_CODES[code]] = fields[1]
+        else:
+            yield number, None, f'Segmento desconocido: {segment}'
+    if current and 'fecha' in current:
+        yield start, current, None
+
+def iter_lab_records(text, fmt):
+    """Leer registros de laboratorio en formato CSV o HL7"""
+    if fmt == 'csv':
+        for number, row in enumerate(csv.DictReader(text), start=2):
+            yield number, row, None
+    else:
+        yield from iter_hl7_records(text)
+
+def latest_labs(conn, paciente_ids):
+    """Último laboratorio de cada paciente indicado, en una sola consulta"""
+    if not paciente_ids:
+        return []
+    placeholders = ', '.join('?' for _ in paciente_ids)
+    return conn.execute(f"""
+        SELECT * FROM (
+            SELECT l.*, ROW_NUMBER() OVER (
+                PARTITION BY paciente_id ORDER BY fecha DESC, id DESC
+            ) AS orden
+            FROM laboratorios l
+            WHERE paciente_id IN ({placeholders})
+        ) WHERE orden = 1
+    """, tuple(paciente_ids)).fetchall()
+
+def evaluate_lab_rules(rules, labs):
+    """Evaluar reglas sobre los laboratorios de toda una cohorte a la vez.
+
+    Arma una columna NumPy por parámetro (NaN si falta el dato) para
+    rules.evaluate_rules. Devuelve (índice en `labs`, regla, valor) por cada
+    valor fuera de rango, en el orden de las reglas.
+    """
+    if not labs:
+        return []
+    fields = rule_parameters(rules)
+    matrix = np.array([[lab[field] for field in fields] for lab in labs], dtype=float)
+    return evaluate_rules(rules, {field: matrix[:, i] for i, field in enumerate(fields)}, len(labs))
+
+def evaluate_lab_alerts(conn, paciente_ids):
+    """Recalcular las alertas de laboratorio de los pacientes indicados
+
+    Inserta las alertas nuevas y resuelve las generadas por reglas que ya no
+    aplican; las alertas manuales (sin `regla`) solo evitan duplicar una con
+    el mismo mensaje y nunca se resuelven aquí. No hace commit para que el
+    llamador la incluya en su propia transacción.
+    """
+    paciente_ids = list(paciente_ids)
+    if not paciente_ids:
+        return {'creadas': 0, 'resueltas': 0}
+
+    desired = {}
+    labs = latest_labs(conn, paciente_ids)
+    for index, rule, valor in evaluate_lab_rules(LAB_ALERT_RULES, labs):
+        key = (labs[index]['paciente_id'], rule.categoria, rule.mensaje.format(valor=valor))
+        desired[key] = rule
+
+    placeholders = ', '.join('?' for _ in paciente_ids)
+    categories = ', '.join('?' for _ in LAB_ALERT_CATEGORIES)
+    existing = {}
+    for row in conn.execute(f"""
+        SELECT id, paciente_id, categoria, mensaje, regla FROM alertas
+        WHERE resuelta = 0 AND paciente_id IN ({placeholders})
+          AND categoria IN ({categories})
+    """, tuple(paciente_ids) + tuple(LAB_ALERT_CATEGORIES)):
+        existing[(row['paciente_id'], row['categoria'], row['mensaje'])] = (row['id'], row['regla'])
+
+    stale = [(alert_id,) for key, (alert_id, regla) in existing.items()
+             if regla is not None and key not in desired]
+    new = [(paciente_id, rule.severidad, categoria, mensaje, rule.prioridad, rule.parametro)
+           for (paciente_id, categoria, mensaje), rule in desired.items()
+           if (paciente_id, categoria, mensaje) not in existing]
+
+    conn.executemany("UPDATE alertas SET resuelta = 1 WHERE id = ?", stale)
+    conn.executemany("""
+        INSERT INTO alertas (paciente_id, tipo, categoria, mensaje, prioridad, regla)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, new)
+    return {'creadas': len(new), 'resueltas': len(stale)}
+
+PENDING_TRENDS_SQL = "(paciente_id, analito) IN (SELECT paciente_id, analito FROM tendencias_pendientes)"
+
+def refresh_lab_trends(conn):
+    """Recalcular las pendientes que marcaron los triggers; no hace commit"""
+    conn.execute(f"DELETE FROM tendencias_laboratorio WHERE {PENDING_TRENDS_SQL}")
+    conn.execute(trend_insert_sql(PENDING_TRENDS_SQL))
+    conn.execute("DELETE FROM tendencias_pendientes")
+
+def insert_lab_batch(conn, batch, errors, report):
+    """Insertar un lote de laboratorios y evaluar alertas en una sola transacción"""
+    documentos = sorted({documento for _, (documento, _, _) in batch})
+    placeholders = ', '.join('?' for _ in documentos)
+    with write_transaction(conn, 'ingest_labs'):
+        patient_ids = {row['documento']: row['id'] for row in conn.execute(
+            f"SELECT id, documento FROM pacientes WHERE documento IN ({placeholders})", documentos)}
+
+        rows = []
+        for number, (documento, fecha, values) in batch:
+            paciente_id = patient_ids.get(documento)
+            if paciente_id is None:
+                errors.append({'fila': number, 'error': f'Paciente {documento} no encontrado'})
+                continue
+            rows.append((paciente_id, fecha) + values + (paciente_id, fecha))
+
+        # NOT EXISTS sobre idx_laboratorios_paciente_fecha descarta duplicados,
+        # incluidos los repetidos dentro del mismo lote
+        cursor = conn.executemany(f"""
+            INSERT INTO laboratorios (paciente_id, fecha, {', '.join(LAB_FIELDS)})
+            SELECT ?, ?, {', '.join('?' for _ in LAB_FIELDS)}
+            WHERE NOT EXISTS (
+                SELECT 1 FROM laboratorios WHERE paciente_id = ? AND fecha = ?
+            )
+        """, rows)
+        inserted = max(cursor.rowcount, 0)
+
+        alerts = evaluate_lab_alerts(conn, {row[0] for row in rows})
+        if alerts['creadas'] or alerts['resueltas']:
+            prune_alert_events(conn)
+        refresh_lab_trends(conn)
+
+    for paciente_id in {row[0] for row in rows}:
+        response_cache.invalidate(f'/api/patients/{paciente_id}?')
+    if alerts['creadas'] or alerts['resueltas']:
+        response_cache.invalidate('/api/alerts?')
+
+    report['insertados'] += inserted
+    report['duplicados'] += len(rows) - inserted
+    report['alertas_creadas'] += alerts['creadas']
+    report['alertas_resueltas'] += alerts['resueltas']
+
+def ingest_labs(conn, records):
+    """Ingerir registros de laboratorio en lotes grandes; devuelve el reporte"""
+    started = time.perf_counter()
+    report = {'filas': 0, 'insertados': 0, 'duplicados': 0,
+              'alertas_creadas': 0, 'alertas_resueltas': 0}
+    errors = []
+    batch = []
+
+    for number, data, error in records:
+        report['filas'] += 1
+        if error is None:
+            try:
+                batch.append((number, validate_lab(data)))
+            except ValueError as e:
+                error = str(e)
+        if error is not None:
+            errors.append({'fila': number, 'error': error})
+        if len(batch) >= LAB_BATCH_SIZE:
+            insert_lab_batch(conn, batch, errors, report)
+            batch = []
+
+    if batch:
+        insert_lab_batch(conn, batch, errors, report)
+
+    elapsed = time.perf_counter() - started
+    errors.sort(key=lambda error: error['fila'])
+    report.update({
+        'rechazados': len(errors),
+        'errores': errors[:BULK_MAX_ERRORS],
+        'segundos': round(elapsed, 3),
+        'filas_por_segundo': round(report['filas'] / elapsed, 1) if elapsed > 0 else report['filas']
+    })
+    return report
+
+@app.route('/api/labs/ingest', methods=['POST'])
+def ingest_labs_endpoint():
+    """Ingerir un lote de laboratorios en CSV o formato de líneas HL7"""
+    content_type = request.mimetype or ''
+    if content_type == 'text/csv':
+        fmt = 'csv'
+    elif content_type in ('text/plain', 'application/hl7-v2', 'x-application/hl7-v2+er7'):
+        fmt = 'hl7'
+    else:
+        return jsonify({'error': 'Content-Type debe ser text/csv o text/plain (HL7)'}), 415
+
+    try:
+        text = io.TextIOWrapper(request.stream, encoding='utf-8-sig', newline='')
+        return jsonify(ingest_labs(get_db(), iter_lab_records(text, fmt)))
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+ALERTS_SQL = """
+    SELECT a.id, a.paciente_id, a.tipo, a.categoria, a.mensaje, 
+           a.fecha_creacion, a.prioridad,
+           p.nombres || ' ' || p.apellidos as paciente_nombre
+    FROM alertas a
+    JOIN pacientes p ON a.paciente_id = p.id
+    WHERE a.resuelta = 0
+    ORDER BY a.prioridad DESC, a.fecha_creacion DESC
+"""
+LAST_ALERT_EVENT_SQL = "SELECT COALESCE(MAX(id), 0) FROM eventos_alertas"
+
+def alert_to_dict(row):
+    """Serializar una fila de alerta unida con el nombre del paciente"""
+    return {
+        'id': row['id'],
+        'paciente_id': row['paciente_id'],
+        'tipo': row['tipo'],
+        'categoria': row['categoria'],
+        'mensaje': row['mensaje'],
+        'fecha_creacion': row['fecha_creacion'],
+        'paciente_nombre': row['paciente_nombre'],
+        'prioridad': row['prioridad']
+    }
+
 @app.route('/api/alerts', methods=['GET'])
 def get_alerts():
     """Obtener alertas activas"""
     try:
+        if wants_ndjson():
+            # Exportación completa de alertas pendientes, en streaming
+            sql = ALERTS_SQL
+            params = []
+            if request.args.get('limit'):
+                sql += " LIMIT ?"
+                params.append(max(request.args.get('limit', type=int) or 1, 1))
+            return stream_ndjson(sql, params, alert_to_dict)
+
         conn = get_db()
-        cursor = conn.cursor()
 
-        cursor.execute("""
-            SELECT a.id, a.paciente_id, a.tipo, a.categoria, a.mensaje, 
-                   a.fecha_creacion, a.prioridad,
-                   p.nombres || ' ' || p.apellidos as paciente_nombre
-            FROM alertas a
-            JOIN pacientes p ON a.paciente_id = p.id
-            WHERE a.resuelta = 0
-            ORDER BY a.prioridad DESC, a.fecha_creacion DESC
-            LIMIT 50
-        """)
-
-        alerts = []
-        for row in cursor.fetchall():
-            alerts.append({
-                'id': row['id'],
-                'paciente_id': row['paciente_id'],
-                'tipo': row['tipo'],
-                'categoria': row['categoria'],
-                'mensaje': row['mensaje'],
-                'fecha_creacion': row['fecha_creacion'],
-                'paciente_nombre': row['paciente_nombre'],
-                'prioridad': row['prioridad']
-            })
+        etag = data_etag(conn, ('alertas', 'pacientes'))
+        # Último evento incluido, para continuar desde ahí en /api/alerts/stream
+        last_event_id = conn.execute(LAST_ALERT_EVENT_SQL).fetchone()[0]
+        response = not_modified(etag)
+        if response is not None:
+            response.headers['X-Last-Event-ID'] = str(last_event_id)
+        else:
+            response = cached_response(etag)
+        if response is None:
+            cursor = conn.cursor()
 
-        conn.close()
-        return jsonify(alerts)
+            cursor.execute(ALERTS_SQL + " LIMIT 50")
+
+            alerts = [alert_to_dict(row) for row in cursor.fetchall()]
+
+            response = with_etag(jsonify(alerts), etag)
+            response.headers['X-Last-Event-ID'] = str(last_event_id)
+            cache_response(etag, response)
+
+        # El cliente usa el stream SSE solo si este servidor puede mantenerlo
+        response.headers['X-Alert-Stream'] = '1' if SSE_ENABLED else '0'
+        return response
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# Stream de alertas (Server-Sent Events). Cada cliente conectado ocupa un hilo
+# del worker: SSE_ENABLED=1 (apagado por defecto, con gunicorn y con
+# `python app.py`) solo con workers de hilos o asíncronos (gunicorn -k gthread
+# / gevent, o el servidor de desarrollo); apagado, el dashboard consulta
+# /api/alerts periódicamente con If-None-Match.
+SSE_ENABLED = os.environ.get('SSE_ENABLED', '0') == '1'
+SSE_POLL_INTERVAL = float(os.environ.get('SSE_POLL_INTERVAL', 1.0))
+SSE_KEEPALIVE = 15
+SSE_QUEUE_SIZE = 1000
+SSE_BACKFILL_LIMIT = 1000
+# Un cliente con más de SSE_BACKFILL_LIMIT eventos de atraso recibe 'reset' y
+# recarga /api/alerts: basta conservar ese número de eventos más uno
+SSE_EVENT_RETENTION = SSE_BACKFILL_LIMIT + 1
+
+def prune_alert_events(conn):
+    """Descartar los eventos que ya no sirven para reanudar un stream"""
+    conn.execute("""
+        DELETE FROM eventos_alertas
+        WHERE id <= (SELECT MAX(id) FROM eventos_alertas) - ?
+    """, (SSE_EVENT_RETENTION,))
+
+ALERT_EVENTS_SQL = """
+    SELECT e.id AS evento_id, e.accion,
+           a.id, a.paciente_id, a.tipo, a.categoria, a.mensaje,
+           a.fecha_creacion, a.prioridad,
+           p.nombres || ' ' || p.apellidos as paciente_nombre
+    FROM eventos_alertas e
+    JOIN alertas a ON a.id = e.alerta_id
+    JOIN pacientes p ON p.id = a.paciente_id
+    WHERE e.id > ?
+    ORDER BY e.id
+    LIMIT ?
+"""
+
+def alert_event(row):
+    """(id de evento, datos) para una fila de ALERT_EVENTS_SQL"""
+    alert = alert_to_dict(row) if row['accion'] == 'CREADA' else {'id': row['id']}
+    return row['evento_id'], {'accion': row['accion'], 'alerta': alert}
+
+def fetch_alert_events(conn, after_id, limit):
+    """Eventos de alertas posteriores a `after_id`, con los datos de la alerta"""
+    rows = conn.execute(ALERT_EVENTS_SQL, (after_id, limit)).fetchall()
+    return [alert_event(row) for row in rows]
+
+class AlertBroadcaster:
+    """Lee los eventos nuevos de alertas una vez y los reparte a todos los clientes SSE"""
+
+    def __init__(self, interval=SSE_POLL_INTERVAL, queue_size=SSE_QUEUE_SIZE):
+        self.interval = interval
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._wakeup = threading.Event()
+        self._pid = None
+        self._thread = None
+        self.last_id = 0
+
+    def _ensure_running(self):
+        # Un hilo lector por proceso; tras un fork el hijo arranca el suyo
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        conn = db_pool.acquire()
+        try:
+            self.last_id = conn.execute(LAST_ALERT_EVENT_SQL).fetchone()[0]
+        finally:
+            db_pool.release(conn)
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, name='alert-broadcaster', daemon=True)
+        self._thread.start()
+
+    def subscribe(self):
+        """Registrar un cliente; devuelve su cola y el último id de evento ya leído"""
+        subscriber = queue.Queue(maxsize=self.queue_size)
+        with self._lock:
+            self._ensure_running()
+            self._subscribers.add(subscriber)
+            last_id = self.last_id
+        self._wakeup.set()
+        return subscriber, last_id
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    @staticmethod
+    def _close(subscriber):
+        while True:
+            try:
+                subscriber.get_nowait()
+            except queue.Empty:
+                break
+        subscriber.put_nowait(None)
+
+    def _run(self):
+        while True:
+            if not self.subscriber_count():
+                self._wakeup.wait()
+                self._wakeup.clear()
+                continue
+            try:
+                conn = db_pool.acquire()
+                try:
+                    events = fetch_alert_events(conn, self.last_id, SSE_BACKFILL_LIMIT)
+                finally:
+                    db_pool.release(conn)
+            except Exception as e:
+                app.logger.warning('Error leyendo eventos de alertas: %s', e)
+                events = []
+
+            if events:
+                with self._lock:
+                    self.last_id = events[-1][0]
+                    subscribers = list(self._subscribers)
+                for subscriber in subscribers:
+                    for event in events:
+                        try:
+                            subscriber.put_nowait(event)
+                        except queue.Full:
+                            # Cliente lento: se cierra su stream y reconecta con Last-Event-ID
+                            self.unsubscribe(subscriber)
+                            self._close(subscriber)
+                            break
+            time.sleep(self.interval)
+
+alert_broadcaster = AlertBroadcaster()
+
+def format_sse(event_id, data, event='alerta'):
+    """Formatear un evento SSE"""
+    payload = json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+    return f"id: {event_id}\nevent: {event}\ndata: {payload}\n\n"
+
+@app.route('/api/alerts/stream', methods=['GET'])
+def stream_alerts():
+    """Stream SSE de altas y resoluciones de alertas"""
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    try:
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        return jsonify({'error': 'Last-Event-ID inválido'}), 400
+    if not SSE_ENABLED:
+        # 503 cierra el EventSource del navegador; el cliente pasa a consultar
+        return jsonify({'error': 'Stream de alertas deshabilitado (SSE_ENABLED=0)'}), 503
+
+    # Suscribirse antes de leer el historial para no perder eventos intermedios
+    subscriber, live_from = alert_broadcaster.subscribe()
+    backlog = []
+    reset = False
+    if last_event_id is not None and last_event_id < live_from:
+        backlog = fetch_alert_events(get_db(), last_event_id, SSE_BACKFILL_LIMIT + 1)
+        if len(backlog) > SSE_BACKFILL_LIMIT:
+            # Demasiado atraso: el cliente debe recargar /api/alerts completo
+            backlog, reset = [], True
+        else:
+            backlog = [event for event in backlog if event[0] <= live_from]
+
+    def generate():
+        try:
+            yield "retry: 3000\n\n"
+            if reset:
+                yield format_sse(live_from, {'accion': 'RECARGAR'}, event='reset')
+            sent = last_event_id or 0
+            for event_id, data in backlog:
+                yield format_sse(event_id, data)
+                sent = event_id
+            while True:
+                try:
+                    event = subscriber.get(timeout=SSE_KEEPALIVE)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                if event is None:
+                    return
+                event_id, data = event
+                if event_id > sent:
+                    yield format_sse(event_id, data)
+                    sent = event_id
+        finally:
+            alert_broadcaster.unsubscribe(subscriber)
+
+    response = app.response_class(generate(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+PATIENT_DETAIL_SQL = "SELECT * FROM pacientes WHERE id = ? AND activo = 1"
+PATIENT_LABS_SQL = """
+    SELECT * FROM laboratorios
+    WHERE paciente_id = ?
+    ORDER BY fecha DESC LIMIT 5
+"""
+
+def patient_to_dict(patient_row, lab_rows):
+    """Serializar el detalle de un paciente con sus últimos laboratorios"""
+    return {
+        'id': patient_row['id'],
+        'documento': f"{patient_row['tipo_documento']} {patient_row['documento']}",
+        'nombres': patient_row['nombres'],
+        'apellidos': patient_row['apellidos'],
+        'edad': patient_row['edad'] or 0,
+        'genero': patient_row['genero'],
+        'eps': patient_row['eps'],
+        'laboratorios': [dict(row) for row in lab_rows]
+    }
+
 @app.route('/api/patients/<int:patient_id>', methods=['GET'])
 def get_patient(patient_id):
     """Obtener paciente específico con laboratorios"""
     try:
         conn = get_db()
+
+        etag = patient_etag(conn, patient_id)
+        cached = not_modified(etag) or cached_response(etag)
+        if cached is not None:
+            return cached
+
         cursor = conn.cursor()
 
         # Datos del paciente
-        cursor.execute("""
-            SELECT *, (julianday('now') - julianday(fecha_nacimiento)) / 365.25 as edad
-            FROM pacientes WHERE id = ? AND activo = 1
-        """, (patient_id,))
+        cursor.execute(PATIENT_DETAIL_SQL, (patient_id,))
 
         patient_row = cursor.fetchone()
         if not patient_row:
             return jsonify({'error': 'Paciente no encontrado'}), 404
 
         # Laboratorios
-        cursor.execute("""
-            SELECT * FROM laboratorios 
-            WHERE paciente_id = ? 
-            ORDER BY fecha DESC LIMIT 5
-        """, (patient_id,))
-
-        labs = [dict(row) for row in cursor.fetchall()]
-
-        patient = {
-            'id': patient_row['id'],
-            'documento': f"{patient_row['tipo_documento']} {patient_row['documento']}",
-            'nombres': patient_row['nombres'],
-            'apellidos': patient_row['apellidos'],
-            'edad': int(patient_row['edad']) if patient_row['edad'] else 0,
-            'genero': patient_row['genero'],
-            'eps': patient_row['eps'],
-            'laboratorios': labs
+        cursor.execute(PATIENT_LABS_SQL, (patient_id,))
+
+        patient = patient_to_dict(patient_row, cursor.fetchall())
+
+        return cache_response(etag, with_etag(jsonify(patient), etag))
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# Series de laboratorio por mes, desde los resúmenes de laboratorios_mensuales
+SERIES_MAX_POINTS = 1000
+SERIES_SQL = """
+    SELECT analito, mes, n, suma, minimo, maximo, ultimo
+    FROM laboratorios_mensuales
+    WHERE paciente_id = ? AND analito IN ({analytes}) AND mes BETWEEN ? AND ?
+    ORDER BY analito, mes
+"""
+TRENDS_SQL = """
+    SELECT analito, pendiente, meses, mes_inicio, mes_fin
+    FROM tendencias_laboratorio WHERE paciente_id = ?
+"""
+PATIENT_TRENDS_PENDING_SQL = "SELECT 1 FROM tendencias_pendientes WHERE paciente_id = ? LIMIT 1"
+
+def parse_month(args, name):
+    """Parámetro AAAA-MM opcional; ValueError con un mensaje para el cliente"""
+    value = args.get(name)
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, '%Y-%m').strftime('%Y-%m')
+    except ValueError:
+        raise ValueError(f'Parámetro {name} debe tener formato AAAA-MM')
+
+def downsample_months(rows, points):
+    """Agrupar meses consecutivos para devolver como máximo `points` puntos
+
+    Cada punto conserva mínimo y máximo del grupo, la media ponderada por el
+    número de laboratorios y el último valor, así los picos no desaparecen.
+    """
+    size = 1 if not points or len(rows) <= points else -(-len(rows) // points)
+    series = []
+    for start in range(0, len(rows), size):
+        group = rows[start:start + size]
+        n = sum(row['n'] for row in group)
+        series.append({
+            'desde': group[0]['mes'],
+            'hasta': group[-1]['mes'],
+            'n': n,
+            'minimo': min(row['minimo'] for row in group),
+            'maximo': max(row['maximo'] for row in group),
+            'media': round(sum(row['suma'] for row in group) / n, 3),
+            'ultimo': group[-1]['ultimo'],
+        })
+    return series
+
+@app.route('/api/patients/<int:patient_id>/labs/series', methods=['GET'])
+def get_patient_lab_series(patient_id):
+    """Series mensuales de laboratorio de un paciente con su tendencia"""
+    try:
+        analytes = request.args.get('analitos')
+        analytes = [a.strip() for a in analytes.split(',') if a.strip()] if analytes else list(MONTHLY_ANALYTES)
+        unknown = [a for a in analytes if a not in MONTHLY_ANALYTES]
+        if unknown or not analytes:
+            raise ValueError(f"Analitos desconocidos: {', '.join(unknown)}" if unknown
+                             else 'Parámetro analitos vacío')
+        start = parse_month(request.args, 'desde')
+        end = parse_month(request.args, 'hasta')
+        points = parse_number(request.args, 'puntos', int)
+        if points is not None and not 1 <= points <= SERIES_MAX_POINTS:
+            raise ValueError(f'Parámetro puntos debe estar entre 1 y {SERIES_MAX_POINTS}')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        conn = get_db()
+
+        etag = patient_etag(conn, patient_id)
+        cached = not_modified(etag) or cached_response(etag)
+        if cached is not None:
+            return cached
+
+        if not conn.execute(PATIENT_DETAIL_SQL, (patient_id,)).fetchone():
+            return jsonify({'error': 'Paciente no encontrado'}), 404
+
+        rows = conn.execute(SERIES_SQL.format(analytes=', '.join('?' for _ in analytes)),
+                            (patient_id, *analytes, start or '0000-00', end or '9999-99')).fetchall()
+        # Si otro proceso escribió sin recalcular tendencias, se calculan al vuelo
+        if conn.execute(PATIENT_TRENDS_PENDING_SQL, (patient_id,)).fetchone():
+            trends = conn.execute(trend_select_sql('paciente_id = ?'), (patient_id,)).fetchall()
+        else:
+            trends = conn.execute(TRENDS_SQL, (patient_id,)).fetchall()
+        trends = {row['analito']: row for row in trends}
+
+        series = {}
+        for analyte in analytes:
+            trend = trends.get(analyte)
+            series[analyte] = {
+                'puntos': downsample_months([row for row in rows if row['analito'] == analyte], points),
+                'tendencia': {
+                    'pendiente_mensual': (round(trend['pendiente'], 4)
+                                          if trend['pendiente'] is not None else None),
+                    'meses': trend['meses'],
+                    'desde': trend['mes_inicio'],
+                    'hasta': trend['mes_fin'],
+                } if trend else None,
+            }
+
+        body = {'paciente_id': patient_id, 'desde': start, 'hasta': end, 'series': series}
+        return cache_response(etag, with_etag(jsonify(body), etag))
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# Indicadores de calidad: se leen solo de indicadores_mensuales (filas por mes,
+# EPS e indicador), así el costo no depende del número de pacientes
+KPIS_SQL = """
+    SELECT mes, eps, indicador, pacientes, en_meta
+    FROM indicadores_mensuales
+    WHERE mes BETWEEN ? AND ? AND pacientes > 0 {eps_filter}
+    ORDER BY mes, eps
+"""
+
+def kpi_summary(counts):
+    """Conteos {indicador: [pacientes, en_meta]} con su porcentaje en meta"""
+    return {
+        indicator: {
+            'pacientes': total,
+            'en_meta': in_target,
+            'porcentaje': round(100 * in_target / total, 1) if total else None,
         }
+        for indicator, (total, in_target) in counts.items()
+    }
 
-        conn.close()
-        return jsonify(patient)
+@app.route('/api/reports/kpis', methods=['GET'])
+def get_kpi_report():
+    """Porcentaje mensual de pacientes en meta por indicador, total y por EPS"""
+    try:
+        start = parse_month(request.args, 'desde')
+        end = parse_month(request.args, 'hasta')
+        eps = request.args.get('eps')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        conn = get_db()
+
+        etag = data_etag(conn, ('laboratorios', 'pacientes'))
+        cached = not_modified(etag) or cached_response(etag)
+        if cached is not None:
+            return cached
+
+        params = [start or '0000-00', end or '9999-99']
+        if eps:
+            params.append(eps)
+        rows = conn.execute(KPIS_SQL.format(eps_filter='AND eps = ?' if eps else ''), params).fetchall()
+
+        months = {}
+        by_eps = {}
+        for row in rows:
+            for counts in (months.setdefault(row['mes'], {}),
+                           by_eps.setdefault(row['eps'], {}).setdefault(row['mes'], {})):
+                totals = counts.setdefault(row['indicador'], [0, 0])
+                totals[0] += row['pacientes']
+                totals[1] += row['en_meta']
+
+        body = {
+            'metas': {target.analito: {'minimo': target.minimo, 'maximo': target.maximo}
+                      for target in KPI_TARGETS},
+            'desde': start,
+            'hasta': end,
+            'meses': [{'mes': month, 'indicadores': kpi_summary(counts)}
+                      for month, counts in months.items()],
+            'por_eps': {
+                name: [{'mes': month, 'indicadores': kpi_summary(counts)}
+                       for month, counts in eps_months.items()]
+                for name, eps_months in sorted(by_eps.items())
+            },
+        }
+        return cache_response(etag, with_etag(jsonify(body), etag))
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# Sesiones de diálisis: captura individual o en lote e historial por paciente
+SESSION_NUMERIC_FIELDS = (
+    ('peso_pre', float), ('peso_post', float), ('peso_seco', float), ('qb', int),
+    ('tiempo_sesion', int), ('uf_programada', float), ('uf_real', float), ('kt_v', float),
+    ('pru', float), ('pas_pre', int), ('pad_pre', int), ('pas_post', int), ('pad_post', int),
+)
+SESSION_TEXT_FIELDS = ('medicamentos_iv', 'complicaciones', 'observaciones')
+SESSION_COLUMNS = (('paciente_id', 'fecha', 'turno')
+                   + tuple(field for field, _ in SESSION_NUMERIC_FIELDS) + SESSION_TEXT_FIELDS)
+# Presión arterial plausible en mmHg
+BLOOD_PRESSURE_RANGE = (20, 300)
+SESSIONS_PAGE_SIZE = 50
+SESSIONS_MAX_PAGE_SIZE = 500
+
+# NOT EXISTS sobre idx_sesiones_paciente_fecha descarta la sesión ya
+# registrada ese día, así reenviar un lote no duplica filas
+INSERT_SESSION_SQL = f"""
+    INSERT INTO sesiones_dialisis ({', '.join(SESSION_COLUMNS)})
+    SELECT {', '.join('?' for _ in SESSION_COLUMNS)}
+    WHERE NOT EXISTS (
+        SELECT 1 FROM sesiones_dialisis WHERE paciente_id = ? AND fecha = ?
+    )
+"""
+SESSIONS_SQL = f"""
+    SELECT id, {', '.join(SESSION_COLUMNS)}
+    FROM sesiones_dialisis
+    WHERE paciente_id = ? AND fecha BETWEEN ? AND ? {{after}}
+    ORDER BY fecha DESC, id DESC
+    LIMIT ?
+"""
+
+def parse_session_number(field, kind, value):
+    """Valor numérico de una sesión (None si falta); ValueError si no es válido"""
+    if value is None or (isinstance(value, str) and not value.strip()):
+        return None
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'{field} no numérico: {value!r}')
+    if kind is int:
+        if not number.is_integer():
+            raise ValueError(f'{field} debe ser un entero: {value!r}')
+        return int(number)
+    return number
+
+def validate_session(data):
+    """Validar una sesión de diálisis y devolver la tupla en el orden de SESSION_COLUMNS
+
+    La presión se recibe como pas_pre/pad_pre (y _post) o, como en el esquema
+    D1, en presion_arterial_pre/_post con formato "120/80".
+    """
+    if not isinstance(data, dict):
+        raise ValueError('Registro inválido')
+    paciente_id = parse_session_number('paciente_id', int, data.get('paciente_id'))
+    if paciente_id is None:
+        raise ValueError('paciente_id faltante')
+    fecha = parse_lab_date(data.get('fecha'))
+    turno = str(data.get('turno') or '').strip().upper()
+    if turno not in SESSION_SHIFTS:
+        raise ValueError(f"turno debe ser uno de: {', '.join(SESSION_SHIFTS)}")
+
+    data = dict(data)
+    for moment in ('pre', 'post'):
+        text = data.get(f'presion_arterial_{moment}')
+        if text and data.get(f'pas_{moment}') is None and data.get(f'pad_{moment}') is None:
+            parts = str(text).split('/')
+            if len(parts) != 2:
+                raise ValueError(f'presion_arterial_{moment} debe tener formato 120/80: {text!r}')
+            data[f'pas_{moment}'], data[f'pad_{moment}'] = (part.strip() for part in parts)
+
+    values = {field: parse_session_number(field, kind, data.get(field))
+              for field, kind in SESSION_NUMERIC_FIELDS}
+    low, high = BLOOD_PRESSURE_RANGE
+    for moment in ('pre', 'post'):
+        systolic, diastolic = values[f'pas_{moment}'], values[f'pad_{moment}']
+        for field, value in ((f'pas_{moment}', systolic), (f'pad_{moment}', diastolic)):
+            if value is not None and not low <= value <= high:
+                raise ValueError(f'{field} fuera de rango ({low}-{high} mmHg): {value}')
+        if systolic is not None and diastolic is not None and systolic <= diastolic:
+            raise ValueError(f'pas_{moment} debe ser mayor que pad_{moment}')
+
+    texts = []
+    for field in SESSION_TEXT_FIELDS:
+        value = data.get(field)
+        texts.append(str(value).strip() or None if value is not None else None)
+    return (paciente_id, fecha, turno) + tuple(values.values()) + tuple(texts)
+
+def insert_session_batch(conn, batch, errors):
+    """Insertar un lote validado en una sola transacción; devuelve filas insertadas
+
+    Igual que en create_session, el paciente debe estar activo y no tener ya
+    una sesión ese día; las filas que no cumplen se reportan en `errors`.
+    """
+    paciente_ids = sorted({values[0] for _, values in batch})
+    fechas = [values[1] for _, values in batch]
+    placeholders = ', '.join('?' for _ in paciente_ids)
+    with write_transaction(conn, 'ingest_sessions'):
+        active = {row[0] for row in conn.execute(
+            f"SELECT id FROM pacientes WHERE id IN ({placeholders}) AND activo = 1", paciente_ids)}
+        taken = {tuple(row) for row in conn.execute(
+            f"""SELECT paciente_id, fecha FROM sesiones_dialisis
+                WHERE paciente_id IN ({placeholders}) AND fecha BETWEEN ? AND ?""",
+            paciente_ids + [min(fechas), max(fechas)])}
+
+        rows = []
+        for number, values in batch:
+            if values[0] not in active:
+                errors.append({'fila': number, 'error': f'Paciente {values[0]} no encontrado'})
+            elif tuple(values[:2]) in taken:
+                errors.append({'fila': number, 'error': f'El paciente ya tiene una sesión el {values[1]}'})
+            else:
+                taken.add(tuple(values[:2]))
+                rows.append(values + values[:2])
+
+        conn.executemany(INSERT_SESSION_SQL, rows)
+
+    for paciente_id in {row[0] for row in rows}:
+        response_cache.invalidate(f'/api/patients/{paciente_id}/')
+    return len(rows)
+
+@app.route('/api/sessions', methods=['POST'])
+def create_session():
+    """Registrar una sesión de diálisis"""
+    try:
+        values = validate_session(request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        conn = get_db()
+        with write_transaction(conn, 'create_session'):
+            if not conn.execute(PATIENT_DETAIL_SQL, (values[0],)).fetchone():
+                return jsonify({'error': 'Paciente no encontrado'}), 404
+            cursor = conn.execute(INSERT_SESSION_SQL, values + values[:2])
+        if not cursor.rowcount:
+            return jsonify({'error': f'El paciente ya tiene una sesión el {values[1]}'}), 409
+
+        response_cache.invalidate(f'/api/patients/{values[0]}/')
+        return jsonify({'id': cursor.lastrowid, 'message': 'Sesión registrada exitosamente'}), 201
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/sessions/bulk', methods=['POST'])
+def bulk_create_sessions():
+    """Registrar sesiones en lote desde CSV o NDJSON"""
+    content_type = request.mimetype or ''
+    if content_type not in ('text/csv', 'application/x-ndjson', 'application/jsonl'):
+        return jsonify({'error': 'Content-Type debe ser text/csv o application/x-ndjson'}), 415
+
+    try:
+        conn = get_db()
+        started = time.perf_counter()
+        total = inserted = 0
+        errors = []
+        batch = []
+
+        for number, data, error in iter_records(request.stream, content_type):
+            total += 1
+            if error is None:
+                try:
+                    batch.append((number, validate_session(data)))
+                except ValueError as e:
+                    error = str(e)
+            if error is not None:
+                errors.append({'fila': number, 'error': error})
+            if len(batch) >= BULK_BATCH_SIZE:
+                inserted += insert_session_batch(conn, batch, errors)
+                batch = []
+
+        if batch:
+            inserted += insert_session_batch(conn, batch, errors)
+
+        elapsed = time.perf_counter() - started
+        errors.sort(key=lambda error: error['fila'])
+        return jsonify({
+            'filas': total,
+            'insertados': inserted,
+            'rechazados': len(errors),
+            'errores': errors[:BULK_MAX_ERRORS],
+            'segundos': round(elapsed, 3),
+            'filas_por_segundo': round(total / elapsed, 1) if elapsed > 0 else total
+        })
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/patients/<int:patient_id>/sessions', methods=['GET'])
+def get_patient_sessions(patient_id):
+    """Historial de sesiones de un paciente, más recientes primero, paginado por cursor"""
+    try:
+        limit = parse_number(request.args, 'limit', int)
+        limit = min(max(SESSIONS_PAGE_SIZE if limit is None else limit, 1), SESSIONS_MAX_PAGE_SIZE)
+        start = parse_lab_date(request.args['desde']) if request.args.get('desde') else '0000-00-00'
+        end = parse_lab_date(request.args['hasta']) if request.args.get('hasta') else '9999-99-99'
+        after = decode_cursor(request.args['cursor']) if request.args.get('cursor') else None
+        if after is not None and len(after) != 2:
+            raise ValueError('Cursor inválido')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        conn = get_db()
+
+        etag = patient_etag(conn, patient_id)
+        cached = not_modified(etag) or cached_response(etag)
+        if cached is not None:
+            return cached
+
+        if not conn.execute(PATIENT_DETAIL_SQL, (patient_id,)).fetchone():
+            return jsonify({'error': 'Paciente no encontrado'}), 404
+
+        # La fecha del cursor acota el rango del índice: las páginas profundas no
+        # recorren las sesiones ya devueltas
+        params = [patient_id, start, min(end, str(after[0])) if after is not None else end]
+        if after is not None:
+            params.extend(after)
+        rows = conn.execute(
+            SESSIONS_SQL.format(after='AND (fecha < ? OR id < ?)' if after is not None else ''),
+            params + [limit + 1]).fetchall()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+
+        response = with_etag(jsonify([dict(row) for row in rows]), etag)
+        if has_more:
+            response.headers['X-Next-Cursor'] = encode_cursor([rows[-1]['fecha'], rows[-1]['id']])
+        return cache_response(etag, response)
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/status', methods=['GET'])
+def get_status():
+    """Estado del servicio y estadísticas del pool de conexiones"""
+    return jsonify({
+        'pool': db_pool.stats(),
+        'cache': response_cache.stats(),
+        'schema_version': SCHEMA_VERSION
+    })
+
+# Conteos del dominio para /metrics: se recalculan solo cuando cambia la
+# versión de pacientes o alertas, así un scrape frecuente cuesta una lectura
+# de versiones_tablas
+DOMAIN_METRICS_TABLES = ('pacientes', 'alertas')
+ACTIVE_PATIENTS_SQL = "SELECT COUNT(*) FROM pacientes WHERE activo = 1"
+PENDING_ALERTS_SQL = "SELECT tipo, COUNT(*) FROM alertas WHERE resuelta = 0 GROUP BY tipo"
+_domain_metrics = {'versions': None, 'gauges': ()}
+_domain_metrics_lock = threading.Lock()
+
+def domain_gauges(conn):
+    """Pacientes activos y alertas pendientes por tipo, cacheados por versión"""
+    versions = tuple(version_tags(table_versions(conn, DOMAIN_METRICS_TABLES), DOMAIN_METRICS_TABLES))
+    with _domain_metrics_lock:
+        if _domain_metrics['versions'] == versions:
+            return _domain_metrics['gauges']
+    active = conn.execute(ACTIVE_PATIENTS_SQL).fetchone()[0]
+    alerts = [((row[0],), row[1]) for row in conn.execute(PENDING_ALERTS_SQL)]
+    gauges = (
+        ('hemodialysis_active_patients', 'Pacientes activos', (), [((), active)]),
+        ('hemodialysis_pending_alerts', 'Alertas sin resolver por tipo', ('tipo',), alerts),
+    )
+    with _domain_metrics_lock:
+        _domain_metrics.update(versions=versions, gauges=gauges)
+    return gauges
+
+def pool_gauges():
+    """Estado del pool de conexiones de este proceso"""
+    stats = db_pool.stats()
+    return (
+        ('db_pool_connections', 'Conexiones del pool de este proceso por estado', ('state',),
+         [(('in_use',), stats['in_use']), (('idle',), stats['idle'])]),
+    )
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Métricas en formato de texto de Prometheus"""
+    body = metrics.render(domain_gauges(get_db()) + pool_gauges())
+    return app.response_class(body, content_type=METRICS_CONTENT_TYPE)
+
+@app.cli.command('migrate')
+def migrate_command():
+    """Aplicar migraciones pendientes sobre la base de datos configurada"""
+    conn = configure_connection(sqlite3.connect(DATABASE, isolation_level=None))
+    try:
+        version = run_migrations(conn)
+    finally:
+        conn.close()
+    print(f'Esquema en versión {version}')
+
+@app.cli.command('refresh-derived')
+def refresh_derived_command():
+    """Recalcular edad y tiempo en diálisis de todos los pacientes"""
+    conn = db_pool.acquire()
+    try:
+        with write_transaction(conn, 'refresh_derived'):
+            updated = refresh_derived_fields(conn)
+    finally:
+        db_pool.release(conn)
+    print(f'{updated} pacientes actualizados')
+
+@app.cli.command('ingest-labs')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'hl7']), default=None,
+              help='Formato del archivo; por defecto se deduce de la extensión')
+def ingest_labs_command(path, fmt):
+    """Ingerir un archivo de laboratorios (CSV o líneas HL7)"""
+    if fmt is None:
+        fmt = 'csv' if path.lower().endswith('.csv') else 'hl7'
+    conn = db_pool.acquire()
+    try:
+        with open(path, encoding='utf-8-sig', newline='') as text:
+            report = ingest_labs(conn, iter_lab_records(text, fmt))
+    finally:
+        db_pool.release(conn)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+@app.cli.command('generate-synthetic')
+@click.option('--patients', default=5000, show_default=True, help='Número de pacientes')
+@click.option('--years', default=10, show_default=True, help='Años de laboratorios mensuales')
+@click.option('--seed', default=42, show_default=True, help='Semilla (mismos datos con la misma semilla)')
+@click.option('--sessions', is_flag=True, help='Agregar tres sesiones de diálisis por semana y paciente')
+def generate_synthetic_command(patients, years, seed, sessions):
+    """Poblar una base vacía con datos sintéticos para pruebas de carga"""
+    from synthetic import generate
+
+    conn = configure_connection(sqlite3.connect(DATABASE))
+    conn.row_factory = sqlite3.Row
+    try:
+        run_migrations(conn)
+        if conn.execute("SELECT 1 FROM pacientes LIMIT 1").fetchone():
+            raise click.UsageError(f'{DATABASE} ya tiene pacientes; use una base nueva (variable DATABASE)')
+        start = time.perf_counter()
+        counts = generate(conn, patients=patients, years=years, seed=seed, sessions=sessions)
+        conn.execute("PRAGMA optimize")
+    finally:
+        conn.close()
+    counts['segundos'] = round(time.perf_counter() - start, 1)
+    print(json.dumps(counts, ensure_ascii=False))
+
 if __name__ == '__main__':
     # Inicializar base de datos
     init_db()
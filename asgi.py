@@ -0,0 +1,545 @@
+"""Modo de servicio ASGI con acceso asíncrono a SQLite.
+
+Sirve las mismas rutas /api/* que app.py con handlers asíncronos, de modo que un
+solo proceso mantiene cientos de conexiones de dashboards y streams SSE inactivos
+sin ocupar un hilo por cliente. Las rutas que no tienen versión asíncrona
+(importación masiva, ingesta de laboratorios, página y estáticos) se delegan a
+la aplicación Flask a través de un adaptador WSGI.
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5000
+"""
+import asyncio
+import os
+import sqlite3
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime
+
+import aiosqlite
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Mount, Route
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header
+
+from app import (
+    app as flask_app, init_db, response_cache, DATABASE, SQLITE_PRAGMAS, SCHEMA_VERSION,
+    make_etag, version_tags, table_versions_sql, PATIENT_VERSION_SQL,
+    DERIVED_PENDING_SQL, REFRESH_DERIVED_SQL, MARK_DERIVED_SQL,
+    build_patients_query, patients_count_sql, encode_cursor, validate_patient, INSERT_PATIENT_SQL,
+    PATIENT_DETAIL_SQL, PATIENT_LABS_SQL, patient_to_dict,
+    ALERTS_SQL, LAST_ALERT_EVENT_SQL, ALERT_EVENTS_SQL, alert_to_dict, alert_event,
+    dumps_line, format_sse, NDJSON_MIMETYPE, NDJSON_CHUNK_ROWS,
+    SSE_POLL_INTERVAL, SSE_KEEPALIVE, SSE_QUEUE_SIZE, SSE_BACKFILL_LIMIT,
+    metrics, HTTP_REQUESTS, HTTP_LATENCY, SQLITE_BUSY_ERRORS, SQLITE_WRITE_TRANSACTION,
+    is_busy_error, record_lock_wait,
+)
+
+# Conexiones de solo lectura por proceso; las escrituras usan una conexión aparte
+ASGI_READ_CONNECTIONS = int(os.environ.get('ASGI_READ_CONNECTIONS', 8))
+
+class AsyncDatabase:
+    """Capa SQLite asíncrona: lecturas concurrentes y escrituras serializadas.
+
+    Cada conexión aiosqlite corre en su propio hilo, así que las lecturas sobre
+    conexiones distintas avanzan en paralelo (WAL no bloquea lectores). Todas las
+    escrituras del proceso pasan por una única conexión protegida por un
+    asyncio.Lock: dentro del proceso nunca compiten por el lock de SQLite, y entre
+    procesos sigue actuando busy_timeout.
+    """
+
+    def __init__(self, database, readers=ASGI_READ_CONNECTIONS):
+        self.database = database
+        self.size = readers
+        self._readers = None
+        self._writer = None
+        self._write_lock = None
+        self.reads = 0
+        self.read_waits = 0
+        self.writes = 0
+        self.write_waits = 0
+
+    async def _connect(self, read_only=False):
+        # isolation_level=None: las transacciones de escritura se abren explícitamente
+        conn = await aiosqlite.connect(self.database, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        for pragma, value in SQLITE_PRAGMAS:
+            await conn.execute(f"PRAGMA {pragma} = {value}")
+        if read_only:
+            # Una escritura por una conexión de lectura falla en lugar de
+            # saltarse el lock de escritura del proceso
+            await conn.execute("PRAGMA query_only = 1")
+        return conn
+
+    async def open(self):
+        self._readers = asyncio.Queue()
+        for _ in range(self.size):
+            self._readers.put_nowait(await self._connect(read_only=True))
+        self._writer = await self._connect()
+        self._write_lock = asyncio.Lock()
+
+    async def close(self):
+        while not self._readers.empty():
+            await self._readers.get_nowait().close()
+        await self._writer.close()
+
+    @asynccontextmanager
+    async def read(self):
+        """Conexión de lectura; espera si todas están ocupadas"""
+        self.reads += 1
+        if self._readers.empty():
+            self.read_waits += 1
+        conn = await self._readers.get()
+        try:
+            yield conn
+        finally:
+            self._readers.put_nowait(conn)
+
+    @asynccontextmanager
+    async def write(self, operation):
+        """Transacción BEGIN IMMEDIATE ... COMMIT, una a la vez por proceso
+
+        Se mide igual que write_transaction de app.py; la espera del
+        asyncio.Lock no cuenta como espera del lock de SQLite.
+        """
+        self.writes += 1
+        if self._write_lock.locked():
+            self.write_waits += 1
+        async with self._write_lock:
+            start = time.perf_counter()
+            try:
+                await self._writer.execute("BEGIN IMMEDIATE")
+            except sqlite3.OperationalError as e:
+                if is_busy_error(e):
+                    SQLITE_BUSY_ERRORS.inc(operation)
+                raise
+            acquired = time.perf_counter()
+            record_lock_wait(operation, acquired - start)
+            try:
+                yield self._writer
+                await self._writer.commit()
+            except BaseException as e:
+                await self._writer.rollback()
+                if is_busy_error(e):
+                    SQLITE_BUSY_ERRORS.inc(operation)
+                raise
+            finally:
+                SQLITE_WRITE_TRANSACTION.observe(time.perf_counter() - acquired, operation)
+
+    def stats(self):
+        """Estadísticas para monitoreo"""
+        return {
+            'pid': os.getpid(),
+            'readers': self.size,
+            'idle_readers': self._readers.qsize() if self._readers else 0,
+            'reads': self.reads,
+            'read_waits': self.read_waits,
+            'writes': self.writes,
+            'write_waits': self.write_waits,
+        }
+
+db = AsyncDatabase(DATABASE)
+
+async def fetchone(conn, sql, params=()):
+    async with conn.execute(sql, params) as cursor:
+        return await cursor.fetchone()
+
+# Recálculo diario de campos derivados (equivalente a refresh_derived_daily)
+_derived_checked_on = None
+
+async def refresh_derived_daily():
+    global _derived_checked_on
+    today = datetime.utcnow().date().isoformat()
+    if _derived_checked_on == today:
+        return
+    async with db.read() as conn:
+        pending = await fetchone(conn, DERIVED_PENDING_SQL)
+    if pending:
+        async with db.write('refresh_derived') as conn:
+            if await fetchone(conn, DERIVED_PENDING_SQL):
+                await conn.execute(REFRESH_DERIVED_SQL)
+                await conn.execute(MARK_DERIVED_SQL)
+    _derived_checked_on = today
+
+class DerivedRefreshMiddleware:
+    """Ejecuta el recálculo diario antes del primer request del día"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http' and scope['path'].startswith('/api/'):
+            await refresh_derived_daily()
+        await self.app(scope, receive, send)
+
+class RequestMetricsMiddleware:
+    """Métricas de requests de las rutas asíncronas (las de Flask las cuenta app.py)"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+
+        async def send_with_metrics(message):
+            # El router deja en scope la ruta elegida; Mount es el montaje de Flask
+            route = scope.get('route')
+            if message['type'] == 'http.response.start' and isinstance(route, Route):
+                HTTP_REQUESTS.inc(scope['method'], route.path, message['status'])
+                HTTP_LATENCY.observe(time.perf_counter() - started, scope['method'], route.path)
+                metrics.flush()
+            await send(message)
+
+        await self.app(scope, receive, send_with_metrics)
+
+# Respuestas, ETags y caché compartida con las rutas Flask del mismo proceso
+def full_path(request):
+    """Misma clave que request.full_path de Flask"""
+    return f"{request.url.path}?{request.url.query}"
+
+def json_response(data, status=200, headers=None):
+    return Response(flask_app.json.dumps(data), status_code=status,
+                    media_type='application/json', headers=headers)
+
+def error_response(message, status):
+    return json_response({'error': message}, status)
+
+def etag_headers(etag):
+    return {'ETag': f'W/"{etag}"', 'Cache-Control': 'no-cache', 'Vary': 'Accept'}
+
+def not_modified(request, etag):
+    """Respuesta 304 si If-None-Match incluye el ETag (comparación débil), o None"""
+    header = request.headers.get('if-none-match')
+    if not header:
+        return None
+    for candidate in header.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate in ('*', f'"{etag}"'):
+            return Response(status_code=304, headers=etag_headers(etag))
+    return None
+
+def cached_response(request, etag):
+    entry = response_cache.get(full_path(request), etag)
+    if entry is None:
+        return None
+    return Response(entry['body'], media_type=entry['mimetype'],
+                    headers={**entry['headers'], **etag_headers(etag)})
+
+def cache_response(request, etag, body, headers):
+    response_cache.store(full_path(request), etag, body, 'application/json', headers)
+    return Response(body, media_type='application/json', headers={**headers, **etag_headers(etag)})
+
+def wants_ndjson(request):
+    """El cliente pidió NDJSON en el header Accept (misma negociación que Flask)"""
+    accept = parse_accept_header(request.headers.get('accept'), MIMEAccept)
+    return accept.best_match(['application/json', NDJSON_MIMETYPE]) == NDJSON_MIMETYPE
+
+async def data_etag(conn, request, tables):
+    async with conn.execute(table_versions_sql(tables), tuple(tables)) as cursor:
+        versions = {row['tabla']: row['version'] async for row in cursor}
+    return make_etag(full_path(request), *version_tags(versions, tables))
+
+def stream_ndjson(sql, params, build):
+    async def generate():
+        async with db.read() as conn:
+            async with conn.execute(sql, params) as cursor:
+                while True:
+                    rows = await cursor.fetchmany(NDJSON_CHUNK_ROWS)
+                    if not rows:
+                        break
+                    yield b''.join(dumps_line(build(row)) for row in rows)
+
+    return StreamingResponse(generate(), media_type=NDJSON_MIMETYPE, headers={'Vary': 'Accept'})
+
+# Rutas asíncronas
+async def get_patients(request):
+    """Obtener pacientes activos paginados por cursor, con filtros y selección de campos"""
+    try:
+        ndjson = wants_ndjson(request)
+        try:
+            sql, params, key, limit, build_patient = build_patients_query(request.query_params, ndjson)
+        except ValueError as e:
+            return error_response(str(e), 400)
+
+        if ndjson:
+            if limit is not None:
+                sql += " LIMIT ?"
+                params.append(limit)
+            return stream_ndjson(sql, params, build_patient)
+
+        async with db.read() as conn:
+            etag = await data_etag(conn, request, ('pacientes',))
+            cached = not_modified(request, etag) or cached_response(request, etag)
+            if cached is not None:
+                return cached
+            rows = await conn.execute_fetchall(sql + " LIMIT ?", params + [limit + 1])
+            if not request.query_params.get('cursor'):
+                total = (await conn.execute_fetchall(patients_count_sql(sql), params))[0][0]
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        headers = {}
+        if has_more:
+            headers['X-Next-Cursor'] = encode_cursor([rows[-1][column] for column in key])
+        if not request.query_params.get('cursor'):
+            headers['X-Total-Count'] = str(total)
+        body = flask_app.json.dumps([build_patient(row) for row in rows]).encode('utf-8')
+        return cache_response(request, etag, body, headers)
+
+    except Exception as e:
+        return error_response(str(e), 500)
+
+async def create_patient(request):
+    """Crear nuevo paciente"""
+    try:
+        try:
+            values = validate_patient(await request.json())
+        except ValueError as e:
+            return error_response(str(e), 400)
+
+        async with db.write('create_patient') as conn:
+            cursor = await conn.execute(INSERT_PATIENT_SQL, values)
+            patient_id = cursor.lastrowid
+        response_cache.invalidate('/api/patients?')
+
+        return json_response({'id': patient_id, 'message': 'Paciente creado exitosamente'}, 201)
+
+    except Exception as e:
+        return error_response(str(e), 500)
+
+async def get_patient(request):
+    """Obtener paciente específico con laboratorios"""
+    try:
+        patient_id = request.path_params['patient_id']
+        async with db.read() as conn:
+            row = await fetchone(conn, PATIENT_VERSION_SQL, (patient_id,))
+            etag = make_etag(full_path(request), f"paciente:{patient_id}:{row['version'] if row else 0}")
+            cached = not_modified(request, etag) or cached_response(request, etag)
+            if cached is not None:
+                return cached
+
+            patient_row = await fetchone(conn, PATIENT_DETAIL_SQL, (patient_id,))
+            if not patient_row:
+                return error_response('Paciente no encontrado', 404)
+            labs = await conn.execute_fetchall(PATIENT_LABS_SQL, (patient_id,))
+
+        body = flask_app.json.dumps(patient_to_dict(patient_row, labs)).encode('utf-8')
+        return cache_response(request, etag, body, {})
+
+    except Exception as e:
+        return error_response(str(e), 500)
+
+async def get_alerts(request):
+    """Obtener alertas activas"""
+    try:
+        if wants_ndjson(request):
+            sql = ALERTS_SQL
+            params = []
+            if request.query_params.get('limit'):
+                try:
+                    limit = int(request.query_params['limit'])
+                except ValueError:
+                    limit = 1
+                sql += " LIMIT ?"
+                params.append(max(limit, 1))
+            return stream_ndjson(sql, params, alert_to_dict)
+
+        async with db.read() as conn:
+            etag = await data_etag(conn, request, ('alertas', 'pacientes'))
+            last_event_id = str((await fetchone(conn, LAST_ALERT_EVENT_SQL))[0])
+            response = not_modified(request, etag)
+            if response is not None:
+                response.headers['X-Last-Event-ID'] = last_event_id
+            else:
+                response = cached_response(request, etag)
+            if response is None:
+                rows = await conn.execute_fetchall(ALERTS_SQL + " LIMIT 50")
+                body = flask_app.json.dumps([alert_to_dict(row) for row in rows]).encode('utf-8')
+                response = cache_response(request, etag, body, {'X-Last-Event-ID': last_event_id})
+
+        # En modo ASGI el stream SSE no ocupa un hilo por cliente: siempre disponible
+        response.headers['X-Alert-Stream'] = '1'
+        return response
+
+    except Exception as e:
+        return error_response(str(e), 500)
+
+class AsyncAlertBroadcaster:
+    """Versión asíncrona de AlertBroadcaster: una tarea lee los eventos nuevos y
+    los reparte a las colas de los clientes SSE, sin un hilo por cliente."""
+
+    def __init__(self, interval=SSE_POLL_INTERVAL, queue_size=SSE_QUEUE_SIZE):
+        self.interval = interval
+        self.queue_size = queue_size
+        self._subscribers = set()
+        self._wakeup = None
+        self._task = None
+        self.last_id = 0
+
+    async def start(self):
+        async with db.read() as conn:
+            self.last_id = (await fetchone(conn, LAST_ALERT_EVENT_SQL))[0]
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        for subscriber in list(self._subscribers):
+            self._close(subscriber)
+
+    def subscribe(self):
+        """Registrar un cliente; devuelve su cola y el último id de evento ya leído"""
+        subscriber = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers.add(subscriber)
+        self._wakeup.set()
+        return subscriber, self.last_id
+
+    def unsubscribe(self, subscriber):
+        self._subscribers.discard(subscriber)
+
+    def subscriber_count(self):
+        return len(self._subscribers)
+
+    @staticmethod
+    def _close(subscriber):
+        while not subscriber.empty():
+            subscriber.get_nowait()
+        subscriber.put_nowait(None)
+
+    async def _run(self):
+        while True:
+            if not self._subscribers:
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                continue
+            try:
+                async with db.read() as conn:
+                    rows = await conn.execute_fetchall(
+                        ALERT_EVENTS_SQL, (self.last_id, SSE_BACKFILL_LIMIT))
+                events = [alert_event(row) for row in rows]
+            except Exception as e:
+                flask_app.logger.warning('Error leyendo eventos de alertas: %s', e)
+                events = []
+
+            if events:
+                self.last_id = events[-1][0]
+                for subscriber in list(self._subscribers):
+                    for event in events:
+                        try:
+                            subscriber.put_nowait(event)
+                        except asyncio.QueueFull:
+                            # Cliente lento: se cierra su stream y reconecta con Last-Event-ID
+                            self.unsubscribe(subscriber)
+                            self._close(subscriber)
+                            break
+            await asyncio.sleep(self.interval)
+
+alert_broadcaster = AsyncAlertBroadcaster()
+
+async def stream_alerts(request):
+    """Stream SSE de altas y resoluciones de alertas"""
+    last_event_id = request.headers.get('last-event-id') or request.query_params.get('last_event_id')
+    try:
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        return error_response('Last-Event-ID inválido', 400)
+
+    # Suscribirse antes de leer el historial para no perder eventos intermedios
+    subscriber, live_from = alert_broadcaster.subscribe()
+    backlog = []
+    reset = False
+    if last_event_id is not None and last_event_id < live_from:
+        async with db.read() as conn:
+            rows = await conn.execute_fetchall(
+                ALERT_EVENTS_SQL, (last_event_id, SSE_BACKFILL_LIMIT + 1))
+        if len(rows) > SSE_BACKFILL_LIMIT:
+            # Demasiado atraso: el cliente debe recargar /api/alerts completo
+            reset = True
+        else:
+            backlog = [event for event in map(alert_event, rows) if event[0] <= live_from]
+
+    async def generate():
+        try:
+            yield "retry: 3000\n\n"
+            if reset:
+                yield format_sse(live_from, {'accion': 'RECARGAR'}, event='reset')
+            sent = last_event_id or 0
+            for event_id, data in backlog:
+                yield format_sse(event_id, data)
+                sent = event_id
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscriber.get(), SSE_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                if event is None:
+                    return
+                event_id, data = event
+                if event_id > sent:
+                    yield format_sse(event_id, data)
+                    sent = event_id
+        finally:
+            alert_broadcaster.unsubscribe(subscriber)
+
+    return StreamingResponse(generate(), media_type='text/event-stream',
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+async def get_status(request):
+    """Estado del servicio, de la capa asíncrona y de la caché de respuestas"""
+    return json_response({
+        'mode': 'asgi',
+        'database': db.stats(),
+        'cache': response_cache.stats(),
+        'sse_clients': alert_broadcaster.subscriber_count(),
+        'schema_version': SCHEMA_VERSION
+    })
+
+@asynccontextmanager
+async def lifespan(app):
+    # Migraciones y datos de ejemplo, igual que `python app.py`
+    await asyncio.to_thread(init_db)
+    await db.open()
+    await alert_broadcaster.start()
+    try:
+        yield
+    finally:
+        await alert_broadcaster.stop()
+        await db.close()
+
+routes = [
+    Route('/api/patients', get_patients, methods=['GET']),
+    Route('/api/patients', create_patient, methods=['POST']),
+    Route('/api/patients/{patient_id:int}', get_patient, methods=['GET']),
+    Route('/api/alerts', get_alerts, methods=['GET']),
+    Route('/api/alerts/stream', stream_alerts, methods=['GET']),
+    Route('/api/status', get_status, methods=['GET']),
+    # Resto de rutas (importación masiva, ingesta, página, estáticos): Flask vía WSGI
+    Mount('/', app=WSGIMiddleware(flask_app)),
+]
+
+app = Starlette(
+    routes=routes,
+    lifespan=lifespan,
+    middleware=[
+        Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'],
+                   expose_headers=['X-Next-Cursor', 'X-Total-Count', 'ETag', 'X-Last-Event-ID',
+                                   'X-Alert-Stream']),
+        Middleware(RequestMetricsMiddleware),
+        Middleware(DerivedRefreshMiddleware),
+    ],
+)
+
+if __name__ == '__main__':
+    import uvicorn
+
+    port = int(os.environ.get('PORT', 5000))
+    uvicorn.run(app, host='0.0.0.0', port=port)
@@ -0,0 +1,218 @@
+"""Benchmark de carga de la API de lectura.
+
+Lanza peticiones concurrentes contra /api/patients, /api/alerts,
+/api/patients/<id> y el historial de sesiones /api/patients/<id>/sessions
+(con datos de generate-synthetic --sessions) y reporta latencia p50/p95/p99 y rendimiento por endpoint.
+Sin --url usa la aplicación en el mismo proceso (cliente de pruebas de
+Flask, sin red); con --url mide un servidor en ejecución (gunicorn, uvicorn).
+
+    DATABASE=bench.db flask --app app generate-synthetic
+    DATABASE=bench.db python benchmark.py --concurrency 8 --requests 2000 --save base.json
+    DATABASE=bench.db python benchmark.py --compare base.json --tolerance 0.25
+
+Con --compare termina con código 1 si algún endpoint empeora su p95 o su
+rendimiento más allá de la tolerancia, para detectar regresiones.
+"""
+import http.client
+import json
+import os
+import random
+import sys
+import threading
+import time
+from datetime import date, timedelta
+from urllib.parse import urlsplit
+
+import click
+import numpy as np
+
+# Escenarios: nombre -> función que arma la URL de cada petición
+def patients_url(rng, ctx):
+    # Variar página, orden y filtros para no medir solo aciertos de caché
+    params = [f"limit={rng.choice((50, 100, 500))}",
+              f"orden={rng.choice(('nombre', 'edad', 'tiempo_dialisis_meses'))}"]
+    if rng.random() < 0.3:
+        params.append(f"eps={rng.choice(ctx['eps'])}".replace(' ', '%20'))
+    if rng.random() < 0.3:
+        params.append(f"edad_min={rng.randint(20, 80)}")
+    return '/api/patients?' + '&'.join(params)
+
+def alerts_url(rng, ctx):
+    return '/api/alerts'
+
+def patient_url(rng, ctx):
+    return f"/api/patients/{rng.choice(ctx['ids'])}"
+
+def sessions_url(rng, ctx):
+    # Páginas a cualquier profundidad del historial: `hasta` en los últimos 10 años
+    params = [f"limit={rng.choice((20, 50, 200))}"]
+    if rng.random() < 0.7:
+        params.append(f"hasta={ctx['today'] - timedelta(days=rng.randint(0, 3650))}")
+    return f"/api/patients/{rng.choice(ctx['ids'])}/sessions?" + '&'.join(params)
+
+SCENARIOS = {
+    'get_patients': patients_url,
+    'get_alerts': alerts_url,
+    'get_patient': patient_url,
+    'get_sessions': sessions_url,
+}
+
+class InProcessClient:
+    """Cliente sobre la aplicación Flask importada en este proceso"""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def get(self, path):
+        response = self.client.get(path)
+        response.get_data()
+        return response.status_code
+
+class HttpClient:
+    """Cliente HTTP con conexión persistente (una por hilo)"""
+
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.conn = http.client.HTTPConnection(self.host, self.port, timeout=30)
+
+    def get(self, path):
+        try:
+            self.conn.request('GET', path)
+            response = self.conn.getresponse()
+            response.read()
+            return response.status
+        except (http.client.HTTPException, OSError):
+            self.conn.close()
+            self.conn = http.client.HTTPConnection(self.host, self.port, timeout=30)
+            return 0
+
+def run_scenario(make_client, build_url, ctx, concurrency, total, seed):
+    """Ejecutar `total` peticiones repartidas en `concurrency` hilos"""
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    remaining = [total]
+
+    def worker(index):
+        client = make_client()
+        rng = random.Random(seed * 1000 + index)
+        local, failed = [], 0
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    break
+                remaining[0] -= 1
+            path = build_url(rng, ctx)
+            start = time.perf_counter()
+            status = client.get(path)
+            local.append(time.perf_counter() - start)
+            if status != 200:
+                failed += 1
+        with lock:
+            latencies.extend(local)
+            errors.append(failed)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    ms = np.array(latencies) * 1000
+    return {
+        'peticiones': len(latencies),
+        'errores': sum(errors),
+        'concurrencia': concurrency,
+        'segundos': round(elapsed, 3),
+        'rps': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(float(np.percentile(ms, 50)), 2),
+        'p95_ms': round(float(np.percentile(ms, 95)), 2),
+        'p99_ms': round(float(np.percentile(ms, 99)), 2),
+        'max_ms': round(float(ms.max()), 2),
+    }
+
+def compare(results, baseline, tolerance):
+    """Regresiones respecto a una corrida guardada: lista de mensajes"""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        if result['p95_ms'] > base['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {result['p95_ms']} ms > {base['p95_ms']} ms")
+        if result['rps'] < base['rps'] * (1 - tolerance):
+            regressions.append(f"{name}: rps {result['rps']} < {base['rps']}")
+        if result['errores'] > base['errores']:
+            regressions.append(f"{name}: {result['errores']} errores (antes {base['errores']})")
+    return regressions
+
+def load_context(database):
+    """Ids y EPS existentes para armar peticiones válidas"""
+    import sqlite3
+
+    conn = sqlite3.connect(database)
+    try:
+        ids = [row[0] for row in conn.execute("SELECT id FROM pacientes WHERE activo = 1")]
+        eps = [row[0] for row in conn.execute(
+            "SELECT DISTINCT eps FROM pacientes WHERE eps IS NOT NULL")]
+    finally:
+        conn.close()
+    if not ids:
+        raise click.UsageError(f'{database} no tiene pacientes; genere datos con generate-synthetic')
+    return {'ids': ids, 'eps': eps or ['Nueva EPS'], 'today': date.today()}
+
+@click.command()
+@click.option('--url', default=None, help='Servidor a medir; por defecto la app en este proceso')
+@click.option('--scenario', 'scenarios', multiple=True, type=click.Choice(list(SCENARIOS)),
+              help='Endpoints a medir (por defecto todos)')
+@click.option('--concurrency', default=8, show_default=True)
+@click.option('--requests', 'total', default=1000, show_default=True, help='Peticiones por endpoint')
+@click.option('--warmup', default=50, show_default=True, help='Peticiones previas no medidas')
+@click.option('--no-cache', is_flag=True, help='Desactivar la caché de respuestas (solo en proceso)')
+@click.option('--seed', default=1, show_default=True)
+@click.option('--save', type=click.Path(dir_okay=False), help='Guardar los resultados en JSON')
+@click.option('--compare', 'baseline_path', type=click.Path(exists=True, dir_okay=False),
+              help='Comparar con resultados guardados y fallar si hay regresión')
+@click.option('--tolerance', default=0.2, show_default=True, help='Empeoramiento tolerado (0.2 = 20 %)')
+def main(url, scenarios, concurrency, total, warmup, no_cache, seed, save, baseline_path, tolerance):
+    """Medir latencia y rendimiento de los endpoints de lectura"""
+    if no_cache:
+        os.environ['RESPONSE_CACHE_SIZE'] = '0'
+    os.environ.setdefault('DB_POOL_SIZE', str(max(concurrency, 8)))
+    # Importación diferida: DATABASE y la caché se leen al importar app
+    import app as api
+
+    ctx = load_context(api.DATABASE)
+    if url:
+        def make_client():
+            return HttpClient(url)
+    else:
+        def make_client():
+            return InProcessClient(api.app)
+
+    results = {}
+    for name in scenarios or SCENARIOS:
+        if warmup:
+            run_scenario(make_client, SCENARIOS[name], ctx, concurrency, warmup, seed + 1)
+        results[name] = run_scenario(make_client, SCENARIOS[name], ctx, concurrency, total, seed)
+        r = results[name]
+        click.echo(f"{name:<14} {r['rps']:>9.1f} req/s  p50 {r['p50_ms']:>8.2f} ms  "
+                   f"p95 {r['p95_ms']:>8.2f} ms  p99 {r['p99_ms']:>8.2f} ms  errores {r['errores']}")
+
+    if save:
+        with open(save, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+
+    if baseline_path:
+        with open(baseline_path, encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), tolerance)
+        for message in regressions:
+            click.echo(f'REGRESIÓN {message}', err=True)
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
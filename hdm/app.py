@@ -1,17 +1,48 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session, g
 from flask_sqlalchemy import SQLAlchemy
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime, timedelta
+import os
 import json
+import time
+import base64
+import click
 from functools import wraps
+from itertools import groupby
+import numpy as np
+# Motor de reglas compartido con app.py (rules.py en la raíz del repositorio:
+# ejecutar como `flask --app hdm.app run` o `python -m hdm.app`)
+from rules import Rule as Regla, evaluate_rules, rule_parameters as parametros_reglas
 
 app = Flask(__name__)
 app.secret_key = 'dialisis_secret_key_2023'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///dialisis.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('HDM_DATABASE_URI', 'sqlite:///dialisis.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
 db = SQLAlchemy(app)
 
+# Perfilado opcional por request (PROFILE_REQUESTS=1), con el módulo profiling
+# de la raíz del repositorio: ejecutar como `flask --app hdm.app run`
+try:
+    from profiling import PROFILE_REQUESTS, RequestProfiler, record_query
+except ImportError:
+    PROFILE_REQUESTS = False
+    if os.environ.get('PROFILE_REQUESTS') == '1':
+        app.logger.warning('Perfilado no disponible: profiling.py no está en el path')
+
+if PROFILE_REQUESTS:
+    RequestProfiler(app)
+
+    def _inicio_sentencia(conn, cursor, statement, parameters, context, executemany):
+        context._inicio_perfil = time.perf_counter()
+
+    def _fin_sentencia(conn, cursor, statement, parameters, context, executemany):
+        record_query(statement, time.perf_counter() - context._inicio_perfil)
+
+    with app.app_context():
+        db.event.listen(db.engine, 'before_cursor_execute', _inicio_sentencia)
+        db.event.listen(db.engine, 'after_cursor_execute', _fin_sentencia)
+
 # Modelos de base de datos
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -39,6 +70,23 @@ class Paciente(db.Model):
     def __repr__(self):
         return f'<Paciente {self.nombre}>'
 
+class TurnoPaciente(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    paciente_id = db.Column(db.Integer, db.ForeignKey('paciente.id'), nullable=False)
+    dia = db.Column(db.String(10), nullable=False)  # lunes ... sabado
+    turno = db.Column(db.String(10), nullable=False)  # manana, tarde, noche
+    silla = db.Column(db.Integer)  # None = sin silla libre al asignar (sobrecupo)
+
+    # Un turno por día y paciente y una silla por turno (los sobrecupos, sin
+    # silla, no chocan); las listas por turno se leen de este índice en orden
+    # de silla
+    __table_args__ = (
+        db.UniqueConstraint('paciente_id', 'dia', name='uq_turno_paciente_dia'),
+        db.UniqueConstraint('dia', 'turno', 'silla', name='uq_turno_silla'),
+    )
+
+    paciente = db.relationship('Paciente', backref=db.backref('turnos_asignados', lazy=True))
+
 class Laboratorio(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     paciente_id = db.Column(db.Integer, db.ForeignKey('paciente.id'), nullable=False)
@@ -78,6 +126,21 @@ class AccesoVascular(db.Model):
 
     paciente = db.relationship('Paciente', backref=db.backref('accesos_vascular', lazy=True))
 
+class Alerta(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    paciente_id = db.Column(db.Integer, db.ForeignKey('paciente.id'), nullable=False)
+    laboratorio_id = db.Column(db.Integer, db.ForeignKey('laboratorio.id'))
+    mensaje = db.Column(db.String(200), nullable=False)
+    categoria = db.Column(db.String(20))  # ANEMIA, MINERAL_OSEO
+    severidad = db.Column(db.String(20))  # CRITICA, MODERADA, PREVENTIVA
+    fecha = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    activa = db.Column(db.Boolean, nullable=False, default=True)
+    fecha_resolucion = db.Column(db.DateTime)
+
+    __table_args__ = (db.Index('ix_alerta_paciente_activa', 'paciente_id', 'activa'),)
+
+    paciente = db.relationship('Paciente', backref=db.backref('alertas', lazy=True))
+
 class HistorialCambios(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     tabla_afectada = db.Column(db.String(50), nullable=False)
@@ -88,6 +151,15 @@ class HistorialCambios(db.Model):
     datos_anteriores = db.Column(db.Text)
     datos_nuevos = db.Column(db.Text)
 
+    # Paginación por (fecha, id) descendente, sola o filtrando por registro o usuario
+    __table_args__ = (
+        db.Index('ix_historial_fecha', 'fecha', 'id'),
+        db.Index('ix_historial_registro', 'tabla_afectada', 'registro_id', 'fecha', 'id'),
+        db.Index('ix_historial_usuario', 'usuario', 'fecha', 'id'),
+        # Ids no reutilizados aunque se archiven las filas más recientes
+        {'sqlite_autoincrement': True},
+    )
+
 # Decorador para requerir login
 def login_required(f):
     @wraps(f)
@@ -149,17 +221,21 @@ def logout():
 @app.route('/dashboard')
 @login_required
 def dashboard():
-    # Obtener pacientes con alertas
-    pacientes = Paciente.query.filter_by(activo=True).all()
-    pacientes_con_alertas = []
+    # Las alertas se calculan al registrar laboratorios; aquí solo se leen
+    alertas = (Alerta.query
+               .join(Paciente)
+               .filter(Paciente.activo == True, Alerta.activa == True)
+               .options(db.contains_eager(Alerta.paciente))
+               .order_by(Paciente.nombre, Alerta.paciente_id, Alerta.id)
+               .all())
 
-    for paciente in pacientes:
-        alertas = obtener_alertas_paciente(paciente.id)
-        if alertas:
-            pacientes_con_alertas.append({
-                'paciente': paciente,
-                'alertas': alertas
-            })
+    pacientes_con_alertas = []
+    for paciente_id, grupo in groupby(alertas, key=lambda alerta: alerta.paciente_id):
+        grupo = list(grupo)
+        pacientes_con_alertas.append({
+            'paciente': grupo[0].paciente,
+            'alertas': [alerta.mensaje for alerta in grupo]
+        })
 
     return render_template('dashboard.html', pacientes_alertas=pacientes_con_alertas)
 
@@ -173,20 +249,17 @@ def pacientes():
 @app.route('/paciente/<int:id>')
 @login_required
 def paciente_detalle(id):
-    paciente = Paciente.query.get_or_404(id)
-    laboratorios = Laboratorio.query.filter_by(paciente_id=id).order_by(Laboratorio.fecha.desc()).all()
-    tratamientos = Tratamiento.query.filter_by(paciente_id=id).order_by(Tratamiento.fecha.desc()).all()
-    accesos = AccesoVascular.query.filter_by(paciente_id=id).order_by(AccesoVascular.fecha.desc()).all()
+    datos = cargar_datos_clinicos(id)
 
     # Obtener recomendaciones
-    recomendaciones_anemia = generar_recomendaciones_anemia(id)
-    recomendaciones_hueso = generar_recomendaciones_hueso(id)
+    recomendaciones_anemia = generar_recomendaciones_anemia(datos)
+    recomendaciones_hueso = generar_recomendaciones_hueso(datos)
 
     return render_template('paciente_detalle.html', 
-                         paciente=paciente, 
-                         laboratorios=laboratorios,
-                         tratamientos=tratamientos,
-                         accesos=accesos,
+                         paciente=datos['paciente'], 
+                         laboratorios=datos['laboratorios'],
+                         tratamientos=datos['tratamientos'],
+                         accesos=datos['accesos'],
                          recomendaciones_anemia=recomendaciones_anemia,
                          recomendaciones_hueso=recomendaciones_hueso)
 
@@ -205,10 +278,7 @@ def paciente_nuevo():
 
             # Procesar turnos
             turnos = {}
-            dias = ['lunes', 'martes', 'miercoles', 'jueves', 'viernes', 'sabado']
-            turnos_disponibles = ['manana', 'tarde', 'noche']
-
-            for dia in dias:
+            for dia in DIAS_TURNO:
                 turnos[dia] = request.form.get(f'turno_{dia}', 'no_asignado')
 
             # Crear nuevo paciente
@@ -222,12 +292,13 @@ def paciente_nuevo():
             )
 
             db.session.add(nuevo_paciente)
+            db.session.flush()
+            asignar_turnos(nuevo_paciente, turnos)
+            actualizar_alertas([nuevo_paciente.id])
+            # Historial en la misma transacción: se confirma o se descarta con el cambio
+            registro_historial(nuevo_paciente, 'INSERT', session['username'])
             db.session.commit()
 
-            # Registrar en historial
-            registro_historial('Paciente', nuevo_paciente.id, 'INSERT', session['username'], 
-                              datos_nuevos=str(nuevo_paciente.__dict__))
-
             flash('Paciente creado exitosamente', 'success')
             return redirect(url_for('pacientes'))
 
@@ -271,12 +342,11 @@ def laboratorio_nuevo(paciente_id):
         )
 
         db.session.add(nuevo_lab)
+        db.session.flush()
+        actualizar_alertas([paciente_id])
+        registro_historial(nuevo_lab, 'INSERT', session['username'])
         db.session.commit()
 
-        # Registrar en historial
-        registro_historial('Laboratorio', nuevo_lab.id, 'INSERT', session['username'], 
-                          datos_nuevos=str(nuevo_lab.__dict__))
-
         flash('Laboratorio registrado exitosamente', 'success')
 
     except Exception as e:
@@ -307,12 +377,10 @@ def tratamiento_nuevo(paciente_id):
         )
 
         db.session.add(nuevo_tratamiento)
+        db.session.flush()
+        registro_historial(nuevo_tratamiento, 'INSERT', session['username'])
         db.session.commit()
 
-        # Registrar en historial
-        registro_historial('Tratamiento', nuevo_tratamiento.id, 'INSERT', session['username'], 
-                          datos_nuevos=str(nuevo_tratamiento.__dict__))
-
         flash('Tratamiento registrado exitosamente', 'success')
 
     except Exception as e:
@@ -343,12 +411,10 @@ def acceso_nuevo(paciente_id):
         )
 
         db.session.add(nuevo_acceso)
+        db.session.flush()
+        registro_historial(nuevo_acceso, 'INSERT', session['username'])
         db.session.commit()
 
-        # Registrar en historial
-        registro_historial('AccesoVascular', nuevo_acceso.id, 'INSERT', session['username'], 
-                          datos_nuevos=str(nuevo_acceso.__dict__))
-
         flash('Acceso vascular registrado exitosamente', 'success')
 
     except Exception as e:
@@ -357,119 +423,579 @@ def acceso_nuevo(paciente_id):
 
     return redirect(url_for('paciente_detalle', id=paciente_id))
 
+# Historial de cambios: páginas por cursor (fecha, id) sobre la tabla activa y
+# los archivos mensuales. `archivar-historial` mueve los meses antiguos a una
+# base SQLite por mes (historial-AAAA-MM.db) que se sigue consultando aquí.
+HISTORIAL_POR_PAGINA = 50
+HISTORIAL_MAX_POR_PAGINA = 200
+HISTORIAL_MESES_ACTIVOS = int(os.environ.get('HDM_HISTORIAL_MESES', 12))
+HISTORIAL_ARCHIVO_DIR = os.environ.get('HDM_HISTORIAL_ARCHIVO',
+                                       os.path.join(app.instance_path, 'historial'))
+HISTORIAL_LOTE_ARCHIVO = 5000
+tabla_historial = HistorialCambios.__table__
+
+def codificar_cursor_historial(cambio):
+    valor = json.dumps([cambio.fecha.isoformat(), cambio.id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(valor.encode('utf-8')).decode('ascii')
+
+def decodificar_cursor_historial(cursor):
+    """(fecha, id) del último cambio de la página anterior"""
+    try:
+        fecha, id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        if not isinstance(id, int) or isinstance(id, bool):
+            raise ValueError
+        return datetime.fromisoformat(fecha), id
+    except (ValueError, TypeError, UnicodeError):
+        raise ValueError('Cursor inválido')
+
+def parametros_historial(args):
+    """Filtros, cursor y tamaño de página del historial; ValueError si son inválidos"""
+    filtros = {}
+    for campo, parametro in (('tabla_afectada', 'tabla'), ('usuario', 'usuario')):
+        if args.get(parametro):
+            filtros[campo] = args[parametro]
+    try:
+        if args.get('registro'):
+            filtros['registro_id'] = int(args['registro'])
+        limite = int(args.get('limite') or HISTORIAL_POR_PAGINA)
+    except ValueError:
+        raise ValueError('Registro y límite deben ser números enteros')
+    try:
+        desde = datetime.strptime(args['desde'], '%Y-%m-%d') if args.get('desde') else None
+        # `hasta` incluye el día completo
+        hasta = (datetime.strptime(args['hasta'], '%Y-%m-%d') + timedelta(days=1)
+                 if args.get('hasta') else None)
+    except ValueError:
+        raise ValueError('Las fechas deben tener formato AAAA-MM-DD')
+    cursor = decodificar_cursor_historial(args['cursor']) if args.get('cursor') else None
+    return filtros, desde, hasta, cursor, min(max(limite, 1), HISTORIAL_MAX_POR_PAGINA)
+
+def consulta_historial(filtros, desde, hasta, cursor, limite):
+    consulta = db.select(tabla_historial).filter_by(**filtros)
+    if desde is not None:
+        consulta = consulta.where(tabla_historial.c.fecha >= desde)
+    if hasta is not None:
+        consulta = consulta.where(tabla_historial.c.fecha < hasta)
+    if cursor is not None:
+        consulta = consulta.where(db.tuple_(tabla_historial.c.fecha, tabla_historial.c.id) < cursor)
+    return (consulta.order_by(tabla_historial.c.fecha.desc(), tabla_historial.c.id.desc())
+            .limit(limite))
+
+def mes_siguiente(mes):
+    return (mes.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+_motores_archivo = {}
+
+def motor_archivo(mes):
+    """Engine de la base de archivo de un mes (primer día del mes), creando su tabla"""
+    if mes not in _motores_archivo:
+        os.makedirs(HISTORIAL_ARCHIVO_DIR, exist_ok=True)
+        ruta = os.path.join(HISTORIAL_ARCHIVO_DIR, f'historial-{mes:%Y-%m}.db')
+        motor = db.create_engine(f'sqlite:///{ruta}')
+        tabla_historial.create(motor, checkfirst=True)
+        _motores_archivo[mes] = motor
+    return _motores_archivo[mes]
+
+def meses_archivados():
+    """Meses con base de archivo, del más reciente al más antiguo"""
+    if not os.path.isdir(HISTORIAL_ARCHIVO_DIR):
+        return []
+    meses = []
+    for nombre in os.listdir(HISTORIAL_ARCHIVO_DIR):
+        if nombre.startswith('historial-') and nombre.endswith('.db'):
+            try:
+                meses.append(datetime.strptime(nombre[10:-3], '%Y-%m'))
+            except ValueError:
+                continue
+    return sorted(meses, reverse=True)
+
+def consultar_historial(filtros, desde=None, hasta=None, cursor=None, limite=HISTORIAL_POR_PAGINA):
+    """Una página de cambios, del más reciente al más antiguo; devuelve (cambios, cursor siguiente)
+
+    Lee limite + 1 filas de la tabla activa y de cada mes archivado que cae en
+    el rango, deteniéndose cuando los meses restantes son más antiguos que la
+    página ya completa.
+    """
+    consulta = consulta_historial(filtros, desde, hasta, cursor, limite + 1)
+    cambios = db.session.execute(consulta).all()
+    for mes in meses_archivados():
+        fin_mes = mes_siguiente(mes)
+        if (desde is not None and fin_mes <= desde) or (hasta is not None and mes >= hasta) \
+                or (cursor is not None and mes > cursor[0]):
+            continue
+        if len(cambios) > limite and fin_mes <= cambios[limite].fecha:
+            break
+        with motor_archivo(mes).connect() as conn:
+            cambios.extend(conn.execute(consulta).all())
+        cambios.sort(key=lambda cambio: (cambio.fecha, cambio.id), reverse=True)
+        del cambios[limite + 1:]
+    siguiente = codificar_cursor_historial(cambios[limite - 1]) if len(cambios) > limite else None
+    return cambios[:limite], siguiente
+
+def archivar_historial(meses_activos=HISTORIAL_MESES_ACTIVOS, hoy=None):
+    """Mover a su base mensual los cambios anteriores a los últimos `meses_activos` meses
+
+    Cada lote se escribe primero en el archivo (INSERT OR IGNORE por id) y
+    luego se borra de la tabla activa, así que repetir el comando tras una
+    interrupción no duplica ni pierde cambios. Devuelve filas movidas por mes.
+    """
+    corte = (hoy or datetime.utcnow()).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    for _ in range(meses_activos):
+        corte = (corte - timedelta(days=1)).replace(day=1)
+
+    movidos = {}
+    while True:
+        lote = db.session.execute(
+            db.select(tabla_historial).where(tabla_historial.c.fecha < corte)
+            .order_by(tabla_historial.c.fecha, tabla_historial.c.id)
+            .limit(HISTORIAL_LOTE_ARCHIVO)).all()
+        if not lote:
+            break
+        for mes, filas in groupby(lote, key=lambda fila: fila.fecha.replace(
+                day=1, hour=0, minute=0, second=0, microsecond=0)):
+            filas = [fila._asdict() for fila in filas]
+            with motor_archivo(mes).begin() as conn:
+                conn.execute(tabla_historial.insert().prefix_with('OR IGNORE'), filas)
+            db.session.execute(tabla_historial.delete().where(
+                tabla_historial.c.id.in_([fila['id'] for fila in filas])))
+            db.session.commit()
+            movidos[f'{mes:%Y-%m}'] = movidos.get(f'{mes:%Y-%m}', 0) + len(filas)
+    return movidos
+
 @app.route('/historial')
 @login_required
 @role_required(['nefrologo'])
 def historial():
-    cambios = HistorialCambios.query.order_by(HistorialCambios.fecha.desc()).all()
-    return render_template('historial.html', cambios=cambios)
-
-# Funciones auxiliares
-def obtener_alertas_paciente(paciente_id):
-    alertas = []
-
-    # Obtener el último laboratorio
-    ultimo_lab = Laboratorio.query.filter_by(paciente_id=paciente_id).order_by(Laboratorio.fecha.desc()).first()
-
-    if not ultimo_lab:
-        return ["No hay datos de laboratorio"]
-
-    # Verificar valores fuera de rango
-    if ultimo_lab.hb and (ultimo_lab.hb < 10 or ultimo_lab.hb > 12):
-        alertas.append(f"Hemoglobina fuera de rango: {ultimo_lab.hb} g/dL")
-
-    if ultimo_lab.ferritina and ultimo_lab.ferritina < 200:
-        alertas.append(f"Ferritina baja: {ultimo_lab.ferritina} ng/mL")
-
-    if ultimo_lab.tsat and ultimo_lab.tsat < 20:
-        alertas.append(f"TSAT bajo: {ultimo_lab.tsat}%")
-
-    if ultimo_lab.fosforo and (ultimo_lab.fosforo < 3.5 or ultimo_lab.fosforo > 5.5):
-        alertas.append(f"Fósforo fuera de rango: {ultimo_lab.fosforo} mg/dL")
-
-    if ultimo_lab.calcio and (ultimo_lab.calcio < 8.4 or ultimo_lab.calcio > 10.2):
-        alertas.append(f"Calcio fuera de rango: {ultimo_lab.calcio} mg/dL")
-
-    if ultimo_lab.pth and (ultimo_lab.pth < 150 or ultimo_lab.pth > 600):
-        alertas.append(f"PTH fuera de rango: {ultimo_lab.pth} pg/mL")
-
-    return alertas
+    try:
+        filtros, desde, hasta, cursor, limite = parametros_historial(request.args)
+        cambios, siguiente = consultar_historial(filtros, desde, hasta, cursor, limite)
+    except ValueError as e:
+        flash(str(e), 'danger')
+        cambios, siguiente = [], None
+    # Enlace a la página siguiente: mismos filtros con el nuevo cursor
+    args = {clave: valor for clave, valor in request.args.items() if clave != 'cursor'}
+    siguiente_url = url_for('historial', cursor=siguiente, **args) if siguiente else None
+    return render_template('historial.html', cambios=cambios, siguiente_url=siguiente_url)
+
+# Turnos y sillas: turno_paciente es la agenda; Paciente.turnos conserva el
+# JSON del formulario y solo se lee para migrar pacientes sin filas
+DIAS_TURNO = ['lunes', 'martes', 'miercoles', 'jueves', 'viernes', 'sabado']
+TURNOS = ['manana', 'tarde', 'noche']
+SILLAS_POR_TURNO = int(os.environ.get('HDM_SILLAS_POR_TURNO', 12))
+
+def turnos_desde_json(texto):
+    """Pares (día, turno) asignados en el JSON de Paciente.turnos"""
+    try:
+        turnos = json.loads(texto or '{}')
+    except ValueError:
+        return []
+    if not isinstance(turnos, dict):
+        return []
+    return [(dia, turnos[dia]) for dia in DIAS_TURNO if turnos.get(dia) in TURNOS]
+
+def sillas_ocupadas(pares):
+    """Sillas asignadas en cada par (día, turno), en una consulta
+
+    Cuenta toda fila con silla, como la restricción uq_turno_silla: un paciente
+    inactivo conserva su silla hasta que se le quite.
+    """
+    ocupadas = {par: set() for par in pares}
+    if ocupadas:
+        filas = db.session.execute(
+            db.select(TurnoPaciente.dia, TurnoPaciente.turno, TurnoPaciente.silla)
+            .where(db.tuple_(TurnoPaciente.dia, TurnoPaciente.turno).in_(list(ocupadas)),
+                   TurnoPaciente.silla.is_not(None)))
+        for dia, turno, silla in filas:
+            ocupadas[(dia, turno)].add(silla)
+    return ocupadas
+
+def asignar_turnos(paciente, turnos, sobrecupo=False, ocupadas=None):
+    """Crear los turnos del paciente con la silla libre de menor número en cada uno
+
+    `turnos` mapea día a turno ('no_asignado' se ignora). Sin sobrecupo, un
+    turno lleno es un ValueError; con sobrecupo el turno queda sin silla.
+    `ocupadas` (de sillas_ocupadas) se actualiza con las sillas asignadas.
+    """
+    pares = turnos_desde_json(json.dumps(turnos))
+    if ocupadas is None:
+        ocupadas = sillas_ocupadas(pares)
+    for dia, turno in pares:
+        sillas = ocupadas.setdefault((dia, turno), set())
+        silla = next((silla for silla in range(1, SILLAS_POR_TURNO + 1) if silla not in sillas), None)
+        if silla is None and not sobrecupo:
+            raise ValueError(f'No hay sillas libres el {dia} en el turno {turno}')
+        sillas.add(silla)
+        db.session.add(TurnoPaciente(paciente_id=paciente.id, dia=dia, turno=turno, silla=silla))
+
+def migrar_turnos():
+    """Pasar a turno_paciente los turnos JSON de los pacientes que no tienen filas"""
+    pendientes = (Paciente.query
+                  .filter(~Paciente.turnos_asignados.any())
+                  .order_by(Paciente.activo.desc(), Paciente.id)
+                  .all())
+    ocupadas = sillas_ocupadas([(dia, turno) for dia in DIAS_TURNO for turno in TURNOS])
+    migrados = 0
+    for paciente in pendientes:
+        turnos = dict(turnos_desde_json(paciente.turnos))
+        if turnos:
+            # Los datos existentes se migran aunque el turno ya esté lleno; los
+            # inactivos conservan su turno pero no ocupan silla
+            if paciente.activo:
+                asignar_turnos(paciente, turnos, sobrecupo=True, ocupadas=ocupadas)
+            else:
+                for dia, turno in turnos.items():
+                    db.session.add(TurnoPaciente(paciente_id=paciente.id, dia=dia, turno=turno))
+            migrados += 1
+    db.session.commit()
+    return migrados
+
+def ocupacion_turnos(dia=None):
+    """Pacientes activos por día y turno con sillas ocupadas y libres
+
+    Una sola consulta recorre el índice (dia, turno, silla); los turnos sin
+    pacientes aparecen con todas sus sillas libres. Las sillas que conserva un
+    paciente inactivo no se listan pero tampoco cuentan como libres.
+    """
+    consulta = (db.select(TurnoPaciente.dia, TurnoPaciente.turno, TurnoPaciente.silla,
+                          Paciente.id, Paciente.nombre, Paciente.activo)
+                .join(Paciente)
+                .order_by(TurnoPaciente.dia, TurnoPaciente.turno, TurnoPaciente.silla))
+    if dia is not None:
+        consulta = consulta.where(TurnoPaciente.dia == dia)
+    listas, sillas = {}, {}
+    for fila in db.session.execute(consulta):
+        if fila.silla is not None:
+            sillas.setdefault((fila.dia, fila.turno), set()).add(fila.silla)
+        if fila.activo:
+            listas.setdefault((fila.dia, fila.turno), []).append(
+                {'paciente_id': fila.id, 'nombre': fila.nombre, 'silla': fila.silla})
+
+    ocupacion = []
+    for dia_turno in (DIAS_TURNO if dia is None else [dia]):
+        for turno in TURNOS:
+            pacientes = listas.get((dia_turno, turno), [])
+            ocupacion.append({
+                'dia': dia_turno,
+                'turno': turno,
+                'capacidad': SILLAS_POR_TURNO,
+                'ocupadas': len(pacientes),
+                'libres': max(SILLAS_POR_TURNO - len(sillas.get((dia_turno, turno), ())), 0),
+                'pacientes': pacientes,
+            })
+    return ocupacion
 
-def generar_recomendaciones_anemia(paciente_id):
-    recomendaciones = []
+@app.route('/api/ocupacion')
+@login_required
+def api_ocupacion():
+    dia = request.args.get('dia')
+    if dia is not None and dia not in DIAS_TURNO:
+        return jsonify({'error': f"Día no válido: {dia}"}), 400
+    return jsonify({'sillas_por_turno': SILLAS_POR_TURNO, 'turnos': ocupacion_turnos(dia)})
+
+# Motor de reglas clínicas
+# Cada regla dispara cuando el valor del parámetro es menor que `minimo` o
+# mayor que `maximo` (None = sin límite). Cambiar una guía clínica es editar
+# estas tablas; el orden de las reglas es el orden de los mensajes. El motor
+# (rules.py) es el mismo de la API de triage (app.py, LAB_ALERT_RULES), que
+# tiene sus propios umbrales de urgencia; estas tablas son las metas de la guía.
+
+REGLAS_ALERTAS = [
+    Regla('hb', 10, 12, 'MODERADA', 'ANEMIA', 'Hemoglobina fuera de rango: {valor} g/dL'),
+    Regla('ferritina', 200, None, 'MODERADA', 'ANEMIA', 'Ferritina baja: {valor} ng/mL'),
+    Regla('tsat', 20, None, 'MODERADA', 'ANEMIA', 'TSAT bajo: {valor}%'),
+    Regla('fosforo', 3.5, 5.5, 'MODERADA', 'MINERAL_OSEO', 'Fósforo fuera de rango: {valor} mg/dL'),
+    Regla('calcio', 8.4, 10.2, 'MODERADA', 'MINERAL_OSEO', 'Calcio fuera de rango: {valor} mg/dL'),
+    Regla('pth', 150, 600, 'MODERADA', 'MINERAL_OSEO', 'PTH fuera de rango: {valor} pg/mL'),
+]
+
+# Recomendaciones basadas en ACM de Fresenius
+REGLAS_ANEMIA = [
+    Regla('hb', 10, None, 'MODERADA', 'ANEMIA', 'Ajustar dosis de ESA para incrementar hemoglobina'),
+    Regla('hb', None, 12, 'MODERADA', 'ANEMIA', 'Reducir dosis de ESA para disminuir hemoglobina'),
+    Regla('ferritina', 200, None, 'MODERADA', 'ANEMIA', 'Suplementar hierro intravenoso'),
+    Regla('tsat', 20, None, 'MODERADA', 'ANEMIA', 'Evaluar suplementación adicional de hierro'),
+]
+
+# Recomendaciones basadas en KDIGO
+REGLAS_HUESO = [
+    Regla('fosforo', None, 5.5, 'MODERADA', 'MINERAL_OSEO', 'Iniciar o ajustar quelantes de fósforo'),
+    Regla('fosforo', None, 5.5, 'MODERADA', 'MINERAL_OSEO', 'Reforzar educación sobre restricción dietética de fósforo'),
+    Regla('calcio', None, 10.2, 'MODERADA', 'MINERAL_OSEO', 'Evaluar uso de calcimiméticos'),
+    Regla('calcio', None, 10.2, 'MODERADA', 'MINERAL_OSEO', 'Considerar reducir o suspender suplementos de calcio'),
+    Regla('pth', None, 600, 'MODERADA', 'MINERAL_OSEO', 'Considerar tratamiento con calcimiméticos o vitamina D activa'),
+    Regla('pth', 150, None, 'MODERADA', 'MINERAL_OSEO', 'Evaluar posible adinamia ósea'),
+    Regla('pth', 150, None, 'MODERADA', 'MINERAL_OSEO', 'Considerar ajuste de terapia con vitamina D'),
+]
+
+SIN_LABORATORIO = {'parametro': None, 'valor': None, 'severidad': 'PREVENTIVA',
+                   'categoria': None, 'mensaje': 'No hay datos de laboratorio'}
+
+def matriz_a_columnas(parametros, matriz):
+    """Convertir una matriz (pacientes x parámetros) en columnas por parámetro"""
+    matriz = np.asarray(matriz, dtype=float).reshape(-1, len(parametros))
+    # Un 0 se considera dato faltante, igual que en las validaciones originales
+    matriz[matriz == 0] = np.nan
+    return {parametro: matriz[:, i] for i, parametro in enumerate(parametros)}
+
+def evaluar_reglas(reglas, columnas, n):
+    """Evaluar reglas sobre columnas de laboratorio de toda una cohorte a la vez.
+
+    `columnas` mapea cada parámetro a un array NumPy con un valor por paciente
+    (NaN si falta). Devuelve, para cada uno de los `n` pacientes, la lista de
+    hallazgos de rules.evaluate_rules en el orden de las reglas.
+    """
+    hallazgos = [[] for _ in range(n)]
+    for i, regla, valor in evaluate_rules(reglas, columnas, n):
+        hallazgos[i].append({
+            'parametro': regla.parametro,
+            'valor': valor,
+            'severidad': regla.severidad,
+            'categoria': regla.categoria,
+            'mensaje': regla.mensaje.format(valor=valor)
+        })
+    return hallazgos
+
+def evaluar_laboratorio(reglas, laboratorio):
+    """Hallazgos de un único laboratorio ya cargado"""
+    parametros = parametros_reglas(reglas)
+    fila = [getattr(laboratorio, parametro) for parametro in parametros]
+    return evaluar_reglas(reglas, matriz_a_columnas(parametros, [fila]), 1)[0]
 
-    # Obtener el último laboratorio
-    ultimo_lab = Laboratorio.query.filter_by(paciente_id=paciente_id).order_by(Laboratorio.fecha.desc()).first()
+# Funciones auxiliares
+def subconsulta_ultimos_laboratorios(paciente_ids=None):
+    """Ids del último laboratorio por paciente (ROW_NUMBER por paciente_id).
+
+    Consulta compartida por la sincronización de alertas y los reportes de
+    cohorte: sin `paciente_ids` cubre todos los pacientes activos.
+    """
+    orden = db.func.row_number().over(
+        partition_by=Laboratorio.paciente_id,
+        order_by=(Laboratorio.fecha.desc(), Laboratorio.id.desc())
+    ).label('orden')
+
+    recientes = db.select(Laboratorio.id.label('id'), orden)
+    if paciente_ids is None:
+        recientes = recientes.join(Paciente).where(Paciente.activo == True)
+    else:
+        recientes = recientes.where(Laboratorio.paciente_id.in_(paciente_ids))
+    return recientes.subquery()
+
+def evaluar_cohorte(reglas, paciente_ids=None):
+    """Evaluar reglas sobre el último laboratorio de una cohorte completa.
+
+    Lee solo las columnas necesarias (sin construir objetos ORM) y evalúa
+    cada regla de forma vectorizada. Devuelve paciente_id ->
+    (laboratorio_id, hallazgos); los pacientes sin laboratorio no aparecen.
+    """
+    if paciente_ids is not None:
+        paciente_ids = list(paciente_ids)
+        if not paciente_ids:
+            return {}
+    parametros = parametros_reglas(reglas)
+    recientes = subconsulta_ultimos_laboratorios(paciente_ids)
+
+    filas = db.session.execute(
+        db.select(Laboratorio.paciente_id, Laboratorio.id,
+                  *[getattr(Laboratorio, parametro) for parametro in parametros])
+        .join(recientes, Laboratorio.id == recientes.c.id)
+        .where(recientes.c.orden == 1)
+    ).all()
+
+    columnas = matriz_a_columnas(parametros, [fila[2:] for fila in filas])
+    hallazgos = evaluar_reglas(reglas, columnas, len(filas))
+    return {fila[0]: (fila[1], hallazgos[i]) for i, fila in enumerate(filas)}
+
+def actualizar_alertas(paciente_ids=None):
+    """Sincronizar las alertas persistidas con el último laboratorio de cada paciente
+
+    Se llama al escribir laboratorios (uno o un lote) dentro de la misma
+    transacción; no hace commit. Las alertas vigentes no se duplican y las
+    que dejaron de aplicar quedan resueltas. Sin `paciente_ids` reevalúa
+    todos los pacientes activos (p. ej. tras un cambio de guía clínica).
+    """
+    if paciente_ids is None:
+        paciente_ids = [id for (id,) in db.session.query(Paciente.id).filter_by(activo=True)]
+        consulta_vigentes = Alerta.query.join(Paciente).filter(Paciente.activo == True)
+    else:
+        paciente_ids = list(paciente_ids)
+        consulta_vigentes = Alerta.query.filter(Alerta.paciente_id.in_(paciente_ids))
+    if not paciente_ids:
+        return
+
+    vigentes = {}
+    for alerta in consulta_vigentes.filter(Alerta.activa == True):
+        vigentes[(alerta.paciente_id, alerta.mensaje)] = alerta
+
+    cohorte = evaluar_cohorte(REGLAS_ALERTAS, paciente_ids)
+    deseadas = {}
+    nuevas = []
+    ahora = datetime.utcnow()
+    for paciente_id in paciente_ids:
+        laboratorio_id, hallazgos = cohorte.get(paciente_id, (None, [SIN_LABORATORIO]))
+        deseadas[paciente_id] = {hallazgo['mensaje'] for hallazgo in hallazgos}
+
+        for hallazgo in hallazgos:
+            if (paciente_id, hallazgo['mensaje']) not in vigentes:
+                nuevas.append({
+                    'paciente_id': paciente_id,
+                    'laboratorio_id': laboratorio_id,
+                    'mensaje': hallazgo['mensaje'],
+                    'categoria': hallazgo['categoria'],
+                    'severidad': hallazgo['severidad'],
+                    'fecha': ahora,
+                    'activa': True
+                })
+
+    resueltas = [alerta.id for (paciente_id, mensaje), alerta in vigentes.items()
+                 if mensaje not in deseadas.get(paciente_id, ())]
+
+    # Escrituras en bloque: un INSERT (executemany) y un UPDATE, sin importar la cohorte
+    if nuevas:
+        db.session.execute(db.insert(Alerta), nuevas)
+    if resueltas:
+        db.session.execute(
+            db.update(Alerta)
+            .where(Alerta.id.in_(resueltas))
+            .values(activa=False, fecha_resolucion=ahora)
+            .execution_options(synchronize_session='fetch'))
+
+def cargar_datos_clinicos(paciente_id):
+    """Paciente con laboratorios, tratamientos y accesos, cargados una vez por request.
+
+    Dos consultas: el paciente con sus laboratorios y accesos (joinedload; un
+    paciente tiene pocos accesos, así el producto laboratorios × accesos sigue
+    siendo pequeño) y los tratamientos con selectinload, para no multiplicar
+    también esas filas. Todo se ordena de lo más reciente a lo más antiguo.
+    """
+    memo = g.setdefault('datos_clinicos', {})
+    if paciente_id not in memo:
+        paciente = (Paciente.query
+                    .options(db.joinedload(Paciente.laboratorios),
+                             db.joinedload(Paciente.accesos_vascular),
+                             db.selectinload(Paciente.tratamientos))
+                    .filter_by(id=paciente_id)
+                    .first_or_404())
+
+        def recientes(registros):
+            return sorted(registros, key=lambda r: (r.fecha, r.id), reverse=True)
+
+        laboratorios = recientes(paciente.laboratorios)
+        memo[paciente_id] = {
+            'paciente': paciente,
+            'laboratorios': laboratorios,
+            'tratamientos': recientes(paciente.tratamientos),
+            'accesos': recientes(paciente.accesos_vascular),
+            'ultimo_lab': laboratorios[0] if laboratorios else None,
+        }
+    return memo[paciente_id]
+
+def generar_recomendaciones_anemia(datos):
+    # Último laboratorio ya cargado por cargar_datos_clinicos
+    ultimo_lab = datos['ultimo_lab']
 
     if not ultimo_lab:
         return ["No hay datos suficientes para generar recomendaciones"]
 
-    # Recomendaciones basadas en ACM de Fresenius
-    if ultimo_lab.hb and ultimo_lab.hb < 10:
-        recomendaciones.append("Ajustar dosis de ESA para incrementar hemoglobina")
-    elif ultimo_lab.hb and ultimo_lab.hb > 12:
-        recomendaciones.append("Reducir dosis de ESA para disminuir hemoglobina")
+    recomendaciones = [h['mensaje'] for h in evaluar_laboratorio(REGLAS_ANEMIA, ultimo_lab)]
 
-    if ultimo_lab.ferritina and ultimo_lab.ferritina < 200:
-        recomendaciones.append("Suplementar hierro intravenoso")
-
-    if ultimo_lab.tsat and ultimo_lab.tsat < 20:
-        recomendaciones.append("Evaluar suplementación adicional de hierro")
-
-    # Obtener tratamientos actuales de ESA
-    tratamientos_esa = Tratamiento.query.filter_by(
-        paciente_id=paciente_id, 
-        tipo='ESA'
-    ).order_by(Tratamiento.fecha.desc()).all()
+    # Tratamientos actuales de ESA
+    tratamientos_esa = [t for t in datos['tratamientos'] if t.tipo == 'ESA']
 
     if not tratamientos_esa:
         recomendaciones.append("Considerar iniciar terapia con ESA")
 
     return recomendaciones if recomendaciones else ["Parámetros dentro de rangos objetivos"]
 
-def generar_recomendaciones_hueso(paciente_id):
-    recomendaciones = []
-
-    # Obtener el último laboratorio
-    ultimo_lab = Laboratorio.query.filter_by(paciente_id=paciente_id).order_by(Laboratorio.fecha.desc()).first()
+def generar_recomendaciones_hueso(datos):
+    # Último laboratorio ya cargado por cargar_datos_clinicos
+    ultimo_lab = datos['ultimo_lab']
 
     if not ultimo_lab:
         return ["No hay datos suficientes para generar recomendaciones"]
 
-    # Recomendaciones basadas en KDIGO
-    if ultimo_lab.fosforo and ultimo_lab.fosforo > 5.5:
-        recomendaciones.append("Iniciar o ajustar quelantes de fósforo")
-        recomendaciones.append("Reforzar educación sobre restricción dietética de fósforo")
-
-    if ultimo_lab.calcio and ultimo_lab.calcio > 10.2:
-        recomendaciones.append("Evaluar uso de calcimiméticos")
-        recomendaciones.append("Considerar reducir o suspender suplementos de calcio")
-
-    if ultimo_lab.pth and ultimo_lab.pth > 600:
-        recomendaciones.append("Considerar tratamiento con calcimiméticos o vitamina D activa")
-
-    if ultimo_lab.pth and ultimo_lab.pth < 150:
-        recomendaciones.append("Evaluar posible adinamia ósea")
-        recomendaciones.append("Considerar ajuste de terapia con vitamina D")
+    recomendaciones = [h['mensaje'] for h in evaluar_laboratorio(REGLAS_HUESO, ultimo_lab)]
 
     return recomendaciones if recomendaciones else ["Parámetros de MBD dentro de rangos objetivos"]
 
-def registro_historial(tabla, registro_id, accion, usuario, datos_anteriores=None, datos_nuevos=None):
-    cambio = HistorialCambios(
-        tabla_afectada=tabla,
-        registro_id=registro_id,
+def valor_historial(valor):
+    """Valor de columna serializable en JSON (fechas en ISO 8601)"""
+    return valor.isoformat() if isinstance(valor, datetime) else valor
+
+def json_historial(datos):
+    """JSON compacto para las columnas de datos de HistorialCambios"""
+    if not datos:
+        return None
+    return json.dumps(datos, ensure_ascii=False, separators=(',', ':'), default=str)
+
+def diferencias_historial(objeto, accion):
+    """(datos_anteriores, datos_nuevos) de un cambio, solo con los campos relevantes
+
+    INSERT guarda los campos con valor del registro nuevo y DELETE los del
+    registro eliminado; UPDATE guarda únicamente los campos modificados, con su
+    valor anterior y el nuevo, por lo que debe llamarse antes del flush.
+    """
+    estado = db.inspect(objeto)
+    anteriores, nuevos = {}, {}
+    for columna in estado.mapper.column_attrs:
+        historia = estado.attrs[columna.key].history
+        if accion == 'UPDATE':
+            if not historia.has_changes():
+                continue
+            anteriores[columna.key] = valor_historial(historia.deleted[0] if historia.deleted else None)
+            nuevos[columna.key] = valor_historial(historia.added[0] if historia.added else None)
+        else:
+            valor = getattr(objeto, columna.key)
+            if valor is not None:
+                (anteriores if accion == 'DELETE' else nuevos)[columna.key] = valor_historial(valor)
+    return json_historial(anteriores), json_historial(nuevos)
+
+def registro_historial(objeto, accion, usuario):
+    """Agregar el cambio al historial dentro de la transacción en curso
+
+    No hace commit: el registro se confirma con el mismo commit que el cambio
+    (un solo fsync) y se descarta si la transacción se revierte. Los registros
+    de un mismo request se insertan juntos en el flush.
+    """
+    datos_anteriores, datos_nuevos = diferencias_historial(objeto, accion)
+    db.session.add(HistorialCambios(
+        tabla_afectada=type(objeto).__name__,
+        registro_id=objeto.id,
         accion=accion,
         usuario=usuario,
         datos_anteriores=datos_anteriores,
         datos_nuevos=datos_nuevos
-    )
-    db.session.add(cambio)
+    ))
+
+@app.cli.command('archivar-historial')
+@click.option('--meses', default=HISTORIAL_MESES_ACTIVOS, show_default=True,
+              help='Meses recientes que permanecen en la tabla activa')
+def archivar_historial_command(meses):
+    """Mover el historial antiguo a bases de archivo mensuales"""
+    movidos = archivar_historial(meses)
+    for mes, filas in sorted(movidos.items()):
+        print(f'{mes}: {filas} cambios archivados')
+    print(f'Archivo en {HISTORIAL_ARCHIVO_DIR}')
+
+@app.cli.command('migrar-turnos')
+def migrar_turnos_command():
+    """Crear turno_paciente desde el JSON de turnos de cada paciente"""
+    print(f'Pacientes migrados: {migrar_turnos()}')
+
+@app.cli.command('reevaluar-alertas')
+def reevaluar_alertas_command():
+    """Reevaluar las alertas de todos los pacientes activos"""
+    inicio = time.perf_counter()
+    actualizar_alertas()
     db.session.commit()
+    print(f'Alertas reevaluadas en {time.perf_counter() - inicio:.3f} s')
 
 # Inicializar base de datos con datos de ejemplo
 def init_db():
     with app.app_context():
         db.create_all()
+        # create_all no agrega índices nuevos a tablas existentes
+        for indice in HistorialCambios.__table__.indexes:
+            indice.create(db.engine, checkfirst=True)
 
         # Crear usuarios por defecto si no existen
         if not User.query.filter_by(username='nefrologo').first():
@@ -489,6 +1015,11 @@ def init_db():
 
         db.session.commit()
 
+        # Calcular alertas de bases de datos creadas antes de persistirlas
+        if not Alerta.query.first():
+            actualizar_alertas()
+            db.session.commit()
+
         # Crear pacientes de ejemplo si no existen
         if not Paciente.query.first():
             # Crear 5 pacientes de ejemplo
@@ -555,8 +1086,13 @@ def init_db():
                 lab = Laboratorio(**datos)
                 db.session.add(lab)
 
+            db.session.flush()
+            actualizar_alertas()
             db.session.commit()
 
+        # Bases anteriores a turno_paciente y pacientes de ejemplo: turnos del JSON
+        migrar_turnos()
+
 if __name__ == '__main__':
     init_db()
     app.run(debug=True)
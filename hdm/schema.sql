@@ -35,8 +35,11 @@ CREATE TABLE IF NOT EXISTS sesiones_dialisis (
     uf_real REAL,
     kt_v REAL,
     pru REAL,
-    presion_arterial_pre TEXT,
-    presion_arterial_post TEXT,
+    -- Presión arterial en mmHg, sistólica y diastólica por separado (antes texto "120/80")
+    pas_pre INTEGER,
+    pad_pre INTEGER,
+    pas_post INTEGER,
+    pad_post INTEGER,
     medicamentos_iv TEXT,
     complicaciones TEXT,
     observaciones TEXT,
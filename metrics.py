@@ -0,0 +1,185 @@
+"""Métricas en el formato de texto de Prometheus.
+
+Contadores e histogramas en memoria, sin dependencias, para el endpoint
+/metrics. Cada proceso lleva los suyos; con varios workers de gunicorn,
+METRICS_DIR apunta a un directorio compartido donde cada worker vuelca una
+instantánea periódica (y al atender /metrics), y el scrape suma las de todos
+los procesos, al estilo del modo multiproceso de prometheus_client. Vaciar el
+directorio al desplegar.
+"""
+import glob
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+
+METRICS_DIR = os.environ.get('METRICS_DIR')
+# Segundos entre volcados de la instantánea de cada worker a METRICS_DIR
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 5))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+LOCK_WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(names, values, extra=()):
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(names, values)]
+    pairs += [f'{name}="{value}"' for name, value in extra]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    """Contador monótono con etiquetas"""
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return {json.dumps(key): value for key, value in self._values.items()}
+
+    @staticmethod
+    def merge(total, value):
+        return (total or 0) + value
+
+    def lines(self, values):
+        for key, value in sorted(values.items()):
+            yield f'{self.name}{format_labels(self.labels, json.loads(key))} {format_value(value)}'
+
+class Histogram:
+    """Histograma acumulativo con etiquetas (cubetas fijas)"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def observe(self, value, *label_values):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            # [conteo por cubeta..., conteo en +Inf, suma]
+            series = self._values.get(label_values)
+            if series is None:
+                series = self._values[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def snapshot(self):
+        with self._lock:
+            return {json.dumps(key): list(series) for key, series in self._values.items()}
+
+    @staticmethod
+    def merge(total, value):
+        if total is None:
+            return list(value)
+        return [a + b for a, b in zip(total, value)]
+
+    def lines(self, values):
+        for key, series in sorted(values.items()):
+            label_values = json.loads(key)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), series):
+                cumulative += count
+                labels = format_labels(self.labels, label_values, [('le', format_value(bound))])
+                yield f'{self.name}_bucket{labels} {cumulative}'
+            labels = format_labels(self.labels, label_values)
+            yield f'{self.name}_sum{labels} {format_value(series[-1])}'
+            yield f'{self.name}_count{labels} {cumulative}'
+
+class Registry:
+    """Conjunto de métricas del proceso y su exposición en texto"""
+
+    def __init__(self, directory=METRICS_DIR, flush_interval=METRICS_FLUSH_INTERVAL):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._metrics = []
+        self._flushed_at = 0.0
+
+    def counter(self, name, documentation, labels=()):
+        metric = Counter(name, documentation, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        metric = Histogram(name, documentation, labels, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def snapshot(self):
+        return {metric.name: metric.snapshot() for metric in self._metrics}
+
+    def _snapshot_path(self):
+        return os.path.join(self.directory, f'metrics-{os.getpid()}.json')
+
+    def flush(self, force=False):
+        """Volcar la instantánea de este proceso a METRICS_DIR (si está configurado)"""
+        if not self.directory:
+            return
+        now = time.monotonic()
+        if not force and now - self._flushed_at < self.flush_interval:
+            return
+        self._flushed_at = now
+        path = self._snapshot_path()
+        tmp = f'{path}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp, path)
+
+    def collect(self):
+        """Valores de todas las métricas, sumando los procesos de METRICS_DIR"""
+        if not self.directory:
+            return self.snapshot()
+        self.flush(force=True)
+        snapshots = []
+        for path in glob.glob(os.path.join(self.directory, 'metrics-*.json')):
+            try:
+                with open(path, encoding='utf-8') as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        merged = {}
+        for metric in self._metrics:
+            values = {}
+            for snapshot in snapshots:
+                for key, value in snapshot.get(metric.name, {}).items():
+                    values[key] = metric.merge(values.get(key), value)
+            merged[metric.name] = values
+        return merged
+
+    def render(self, gauges=()):
+        """Texto de exposición; `gauges` son (nombre, ayuda, etiquetas, [(valores, valor)])"""
+        collected = self.collect()
+        lines = []
+        for metric in self._metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.lines(collected[metric.name]))
+        for name, documentation, labels, samples in gauges:
+            lines.append(f'# HELP {name} {documentation}')
+            lines.append(f'# TYPE {name} gauge')
+            for label_values, value in samples:
+                lines.append(f'{name}{format_labels(labels, label_values)} {format_value(value)}')
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,192 @@
+"""Perfilado opcional por request para las aplicaciones Flask.
+
+Con PROFILE_REQUESTS=1 cada request mide su tiempo total, las sentencias SQL
+(cantidad y tiempo acumulado) y el tiempo de render de plantillas, y los
+devuelve en el header Server-Timing (visible en las herramientas de
+desarrollo del navegador). Los requests más lentos que PROFILE_SLOW_MS se
+registran en el log, muestreados con PROFILE_SAMPLE_RATE, junto con sus
+sentencias más lentas.
+
+Las sentencias se registran con record_query(): app.py lo hace con
+ProfiledConnection (sqlite3), que también suma el tiempo de leer las filas
+(fetch* e iteración), y hdm/app.py con eventos de SQLAlchemy, que solo cubren
+la ejecución.
+"""
+import os
+import random
+import sqlite3
+import time
+
+from flask import (g, has_app_context, request, current_app,
+                   before_render_template, template_rendered)
+
+PROFILE_REQUESTS = os.environ.get('PROFILE_REQUESTS', '0') == '1'
+PROFILE_SLOW_MS = float(os.environ.get('PROFILE_SLOW_MS', 500))
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 1.0))
+# Sentencias incluidas en el log de un request lento (las más lentas)
+PROFILE_LOG_STATEMENTS = 10
+
+class RequestProfile:
+    """Mediciones acumuladas de un request"""
+
+    __slots__ = ('start', 'sql_count', 'sql_time', 'statements', 'template_time', 'template_starts')
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.statements = []
+        self.template_time = 0.0
+        self.template_starts = []
+
+def current_profile():
+    """Perfil del request en curso, o None (sin contexto o perfilado inactivo)"""
+    if not has_app_context():
+        return None
+    return g.get('_profile')
+
+def record_query(statement, seconds):
+    """Registrar una sentencia SQL ejecutada en el request actual
+
+    Devuelve la entrada [segundos, sentencia] para sumarle después el tiempo
+    de lectura de filas con record_fetch(), o None sin perfil activo.
+    """
+    profile = current_profile()
+    if profile is None:
+        return None
+    profile.sql_count += 1
+    profile.sql_time += seconds
+    entry = [seconds, statement]
+    profile.statements.append(entry)
+    return entry
+
+def record_fetch(entry, seconds):
+    """Sumar a una sentencia ya registrada el tiempo de leer sus filas"""
+    profile = current_profile()
+    if profile is None or entry is None:
+        return
+    profile.sql_time += seconds
+    entry[0] += seconds
+
+class ProfiledCursor(sqlite3.Cursor):
+    """Cursor sqlite3 que mide cada execute/executemany y la lectura de filas
+
+    sqlite3 obtiene la primera fila dentro de execute; el resto se lee en
+    fetchone/fetchmany/fetchall o al iterar el cursor, y ese tiempo se suma a
+    la última sentencia ejecutada.
+    """
+
+    _entry = None
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._entry = record_query(sql, time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._entry = record_query(sql, time.perf_counter() - start)
+
+    def fetchone(self):
+        start = time.perf_counter()
+        try:
+            return super().fetchone()
+        finally:
+            record_fetch(self._entry, time.perf_counter() - start)
+
+    def fetchmany(self, size=None):
+        start = time.perf_counter()
+        try:
+            return super().fetchmany(self.arraysize if size is None else size)
+        finally:
+            record_fetch(self._entry, time.perf_counter() - start)
+
+    def fetchall(self):
+        start = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            record_fetch(self._entry, time.perf_counter() - start)
+
+    def __next__(self):
+        start = time.perf_counter()
+        try:
+            return super().__next__()
+        finally:
+            record_fetch(self._entry, time.perf_counter() - start)
+
+class ProfiledConnection(sqlite3.Connection):
+    """Conexión sqlite3 cuyas sentencias pasan por ProfiledCursor.
+
+    Connection.execute de C no usa cursor() sobrescrito, así que también se
+    redefinen execute y executemany.
+    """
+
+    def cursor(self, factory=ProfiledCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+class RequestProfiler:
+    """Extensión Flask que mide cada request y emite Server-Timing"""
+
+    def __init__(self, app=None, slow_ms=PROFILE_SLOW_MS, sample_rate=PROFILE_SAMPLE_RATE):
+        self.slow_ms = slow_ms
+        self.sample_rate = sample_rate
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        # Primero que cualquier otro before_request, para medir también su SQL
+        app.before_request_funcs.setdefault(None, []).insert(0, self._start)
+        app.after_request(self._finish)
+        before_render_template.connect(self._template_start, app, weak=False)
+        template_rendered.connect(self._template_end, app, weak=False)
+
+    def _start(self):
+        g._profile = RequestProfile()
+
+    def _template_start(self, sender, **extra):
+        profile = current_profile()
+        if profile is not None:
+            profile.template_starts.append(time.perf_counter())
+
+    def _template_end(self, sender, **extra):
+        profile = current_profile()
+        if profile is not None and profile.template_starts:
+            profile.template_time += time.perf_counter() - profile.template_starts.pop()
+
+    def _finish(self, response):
+        profile = g.pop('_profile', None)
+        if profile is None:
+            return response
+        total_ms = (time.perf_counter() - profile.start) * 1000
+        sql_ms = profile.sql_time * 1000
+        template_ms = profile.template_time * 1000
+
+        timings = [
+            f'app;dur={total_ms:.1f}',
+            f'db;desc="SQL ({profile.sql_count})";dur={sql_ms:.1f}',
+        ]
+        if template_ms:
+            timings.append(f'tpl;desc="Plantillas";dur={template_ms:.1f}')
+        response.headers.add('Server-Timing', ', '.join(timings))
+
+        if total_ms >= self.slow_ms and random.random() < self.sample_rate:
+            slowest = sorted(profile.statements, key=lambda item: item[0], reverse=True)
+            lines = [f'  {seconds * 1000:8.1f} ms  {" ".join(statement.split())[:300]}'
+                     for seconds, statement in slowest[:PROFILE_LOG_STATEMENTS]]
+            current_app.logger.warning(
+                'Request lento: %s %s %.1f ms (SQL %d sentencias, %.1f ms; plantillas %.1f ms)\n%s',
+                request.method, request.full_path, total_ms, profile.sql_count, sql_ms,
+                template_ms, '\n'.join(lines))
+        return response
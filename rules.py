@@ -0,0 +1,39 @@
+"""Motor de reglas de laboratorio compartido por app.py y hdm/app.py.
+
+Una regla dispara cuando el valor de su parámetro es menor que `minimo` o
+mayor que `maximo` (None = sin límite). Cada aplicación mantiene sus propias
+tablas: app.py clasifica alertas por urgencia (LAB_ALERT_RULES) y hdm
+expresa las metas de la guía (REGLAS_ALERTAS, REGLAS_ANEMIA, REGLAS_HUESO);
+el formato de las reglas y su evaluación son los de este módulo.
+"""
+from collections import namedtuple
+
+import numpy as np
+
+# `prioridad` ordena /api/alerts en app.py; hdm no la usa
+Rule = namedtuple('Rule', ['parametro', 'minimo', 'maximo', 'severidad', 'categoria',
+                           'mensaje', 'prioridad'], defaults=(1,))
+
+def rule_parameters(rules):
+    """Parámetros de laboratorio usados por un conjunto de reglas, sin repetir"""
+    return list(dict.fromkeys(rule.parametro for rule in rules))
+
+def evaluate_rules(rules, columns, n):
+    """Evaluar reglas sobre columnas de laboratorio de toda una cohorte a la vez.
+
+    `columns` mapea cada parámetro a un array NumPy con un valor por fila (NaN
+    si falta) y cada regla se aplica como una máscara vectorizada. Devuelve
+    (fila, regla, valor) por cada valor fuera de rango, en el orden de las
+    reglas.
+    """
+    findings = []
+    for rule in rules:
+        values = columns[rule.parametro]
+        # Las comparaciones con NaN son falsas: un dato faltante no dispara reglas
+        out = np.zeros(n, dtype=bool)
+        if rule.minimo is not None:
+            out |= values < rule.minimo
+        if rule.maximo is not None:
+            out |= values > rule.maximo
+        findings.extend((i, rule, values[i].item()) for i in np.flatnonzero(out).tolist())
+    return findings
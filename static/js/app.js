@@ -1,8 +1,23 @@
 // Sistema de Hemodiálisis - JavaScript Principal
+
+// Igual que /api/alerts: las 50 más prioritarias, más recientes primero
+const ALERTS_LIMIT = 50;
+// Intervalo de consulta de alertas cuando el servidor no ofrece el stream SSE
+const ALERTS_POLL_MS = 30000;
+// Búsqueda de pacientes en el servidor: espera tras la última tecla y resultados
+const SEARCH_DELAY_MS = 250;
+const SEARCH_LIMIT = 100;
+// Lista de pacientes: una página por vez y solo las columnas de la tabla
+const PATIENTS_PAGE_SIZE = 100;
+const PATIENT_LIST_FIELDS = 'id,documento,nombres,apellidos,edad,genero,eps,causa_erc,tiempo_dialisis_meses';
+
 class HemodialysisApp {
     constructor() {
         this.patients = [];
+        this.totalPatients = 0;
+        this.nextCursor = null;
         this.alerts = [];
+        this.searchResults = null;
         this.isLoading = false;
         this.init();
     }
@@ -21,6 +36,15 @@ class HemodialysisApp {
             newPatientForm.addEventListener('submit', (e) => this.handleNewPatient(e));
         }
 
+        // Búsqueda de pacientes
+        const patientSearch = document.getElementById('patient-search');
+        if (patientSearch) {
+            patientSearch.addEventListener('input', () => {
+                clearTimeout(this.searchTimer);
+                this.searchTimer = setTimeout(() => this.searchPatients(patientSearch.value), SEARCH_DELAY_MS);
+            });
+        }
+
         // Mostrar tooltips de Bootstrap
         this.initializeTooltips();
     }
@@ -48,6 +72,11 @@ class HemodialysisApp {
             ]);
 
             this.updateDashboard();
+            if (this.alertStreamAvailable) {
+                this.connectAlertStream();
+            } else {
+                this.startAlertPolling();
+            }
             console.log('✅ Datos cargados exitosamente');
         } catch (error) {
             console.error('❌ Error loading data:', error);
@@ -60,22 +89,67 @@ class HemodialysisApp {
     async loadPatients() {
         try {
             console.log('👥 Cargando pacientes...');
-            const response = await fetch('/api/patients');
+            // Solo la primera página; el total viene en X-Total-Count
+            const response = await fetch(`/api/patients?limit=${PATIENTS_PAGE_SIZE}&fields=${PATIENT_LIST_FIELDS}`);
 
             if (!response.ok) {
                 throw new Error(`HTTP ${response.status}: ${response.statusText}`);
             }
 
             this.patients = await response.json();
-            console.log(`✅ ${this.patients.length} pacientes cargados`);
+            this.nextCursor = response.headers.get('X-Next-Cursor');
+            this.totalPatients = Number(response.headers.get('X-Total-Count') || this.patients.length);
+            console.log(`✅ ${this.patients.length} de ${this.totalPatients} pacientes cargados`);
 
         } catch (error) {
             console.error('❌ Error loading patients:', error);
             this.patients = [];
+            this.nextCursor = null;
+            this.totalPatients = 0;
             throw error;
         }
     }
 
+    async loadMorePatients() {
+        if (!this.nextCursor) return;
+        try {
+            const response = await fetch(`/api/patients?limit=${PATIENTS_PAGE_SIZE}&fields=${PATIENT_LIST_FIELDS}` +
+                `&cursor=${encodeURIComponent(this.nextCursor)}`);
+            if (!response.ok) {
+                throw new Error(`HTTP ${response.status}: ${response.statusText}`);
+            }
+            this.patients.push(...await response.json());
+            this.nextCursor = response.headers.get('X-Next-Cursor');
+            this.renderPatients();
+        } catch (error) {
+            console.error('❌ Error loading patients:', error);
+            this.showError('Error al cargar más pacientes');
+        }
+    }
+
+    async searchPatients(query) {
+        query = query.trim();
+        if (!query) {
+            this.searchResults = null;
+            this.renderPatients();
+            return;
+        }
+        try {
+            const response = await fetch(
+                `/api/patients/search?q=${encodeURIComponent(query)}&limit=${SEARCH_LIMIT}`);
+            if (!response.ok) {
+                throw new Error(`HTTP ${response.status}: ${response.statusText}`);
+            }
+            const results = await response.json();
+            // Descartar respuestas de búsquedas ya reemplazadas por otra tecla
+            if (document.getElementById('patient-search').value.trim() !== query) return;
+            this.searchResults = results;
+            this.renderPatients();
+        } catch (error) {
+            console.error('❌ Error searching patients:', error);
+        }
+    }
+
     async loadAlerts() {
         try {
             console.log('🚨 Cargando alertas...');
@@ -86,6 +160,8 @@ class HemodialysisApp {
             }
 
             this.alerts = await response.json();
+            this.lastAlertEventId = response.headers.get('X-Last-Event-ID');
+            this.alertStreamAvailable = response.headers.get('X-Alert-Stream') === '1';
             console.log(`✅ ${this.alerts.length} alertas cargadas`);
 
         } catch (error) {
@@ -95,11 +171,75 @@ class HemodialysisApp {
         }
     }
 
+    connectAlertStream() {
+        // Recibir altas y resoluciones de alertas en vivo en lugar de re-consultar
+        if (this.alertStream || typeof EventSource === 'undefined') return;
+
+        const url = this.lastAlertEventId
+            ? `/api/alerts/stream?last_event_id=${encodeURIComponent(this.lastAlertEventId)}`
+            : '/api/alerts/stream';
+        this.alertStream = new EventSource(url);
+
+        this.alertStream.addEventListener('alerta', async (event) => {
+            const { accion, alerta } = JSON.parse(event.data);
+            const wasFull = this.alerts.length >= ALERTS_LIMIT;
+            this.alerts = this.alerts.filter(a => a.id !== alerta.id);
+            if (accion === 'CREADA') {
+                this.alerts.push(alerta);
+            }
+            if (accion === 'RESUELTA' && wasFull) {
+                // La lista estaba truncada: la alerta que entra al top 50 solo la conoce el servidor
+                await this.loadAlerts();
+            } else {
+                this.sortAlerts();
+            }
+            this.updateDashboard();
+        });
+
+        this.alertStream.addEventListener('reset', async () => {
+            console.log('🔄 Stream de alertas desfasado, recargando...');
+            await this.loadAlerts();
+            this.updateDashboard();
+        });
+
+        this.alertStream.onerror = () => {
+            if (this.alertStream.readyState === EventSource.CLOSED) {
+                // El servidor rechazó el stream: pasar a consultas periódicas
+                console.warn('⚠️ Stream de alertas no disponible, consultando periódicamente');
+                this.alertStream = null;
+                this.startAlertPolling();
+                return;
+            }
+            console.warn('⚠️ Stream de alertas interrumpido, reconectando...');
+        };
+    }
+
+    startAlertPolling() {
+        // El navegador revalida con If-None-Match: sin cambios el servidor responde 304
+        if (this.alertPoll) return;
+        this.alertPoll = setInterval(async () => {
+            try {
+                await this.loadAlerts();
+                this.updateDashboard();
+            } catch (error) {
+                console.warn('⚠️ Error consultando alertas:', error);
+            }
+        }, ALERTS_POLL_MS);
+    }
+
+    sortAlerts() {
+        // Mismo orden y tope que el servidor: prioridad DESC, fecha_creacion DESC
+        this.alerts.sort((a, b) =>
+            (b.prioridad - a.prioridad) ||
+            String(b.fecha_creacion).localeCompare(String(a.fecha_creacion)));
+        this.alerts = this.alerts.slice(0, ALERTS_LIMIT);
+    }
+
     updateDashboard() {
         console.log('📊 Actualizando dashboard...');
 
         // Actualizar métricas principales
-        this.updateElement('total-patients', this.patients.length);
+        this.updateElement('total-patients', this.totalPatients);
 
         const criticalAlerts = this.alerts.filter(a => a.tipo === 'CRITICA').length;
         const moderateAlerts = this.alerts.filter(a => a.tipo === 'MODERADA').length;
@@ -205,7 +345,19 @@ class HemodialysisApp {
         const container = document.getElementById('patients-table');
         if (!container) return;
 
-        if (this.patients.length === 0) {
+        if (this.searchResults !== null && this.searchResults.length === 0) {
+            container.innerHTML = `
+                <div class="text-center text-muted py-5">
+                    <i class="fas fa-search fa-3x mb-3"></i>
+                    <h5>Sin resultados</h5>
+                    <p>Ningún paciente activo coincide con la búsqueda</p>
+                </div>
+            `;
+            return;
+        }
+        const patients = this.searchResults || this.patients;
+
+        if (patients.length === 0) {
             container.innerHTML = `
                 <div class="text-center text-muted py-5">
                     <i class="fas fa-users fa-3x mb-3"></i>
@@ -232,7 +384,7 @@ class HemodialysisApp {
                         </tr>
                     </thead>
                     <tbody>
-                        ${this.patients.map(patient => `
+                        ${patients.map(patient => `
                             <tr>
                                 <td><span class="badge bg-primary">${patient.id}</span></td>
                                 <td>
@@ -266,9 +418,19 @@ class HemodialysisApp {
             <div class="mt-3 text-muted text-center">
                 <small>
                     <i class="fas fa-info-circle me-1"></i>
-                    Total de pacientes activos: <strong>${this.patients.length}</strong>
+                    ${this.searchResults
+                        ? `Resultados de la búsqueda: <strong>${patients.length}</strong>`
+                        : `Mostrando <strong>${patients.length}</strong> de <strong>${this.totalPatients}</strong> pacientes activos`}
                 </small>
             </div>
+
+            ${!this.searchResults && this.nextCursor ? `
+                <div class="text-center mt-2">
+                    <button type="button" class="btn btn-outline-primary btn-sm" onclick="app.loadMorePatients()">
+                        <i class="fas fa-chevron-down me-1"></i>Cargar más
+                    </button>
+                </div>
+            ` : ''}
         `;
 
         container.innerHTML = table;
@@ -0,0 +1,222 @@
+"""Generador reproducible de datos sintéticos para pruebas de carga.
+
+Crea pacientes con datos demográficos plausibles y laboratorios mensuales con
+distribuciones realistas para hemodiálisis, y calcula sus alertas con las
+mismas reglas que la ingesta. Con la misma semilla y tamaños genera siempre
+los mismos datos:
+
+    DATABASE=bench.db flask --app app generate-synthetic --patients 5000 --years 10
+
+Con --sessions agrega tres sesiones de diálisis por semana y paciente (la tabla
+de más volumen): 10 años de 500 pacientes son unas 780.000 sesiones.
+"""
+from datetime import date, timedelta
+
+import numpy as np
+
+NOMBRES_F = ('María', 'Ana', 'Luz', 'Carmen', 'Rosa', 'Gloria', 'Martha', 'Sandra',
+             'Claudia', 'Patricia', 'Diana', 'Adriana', 'Paola', 'Natalia', 'Lucía')
+NOMBRES_M = ('José', 'Luis', 'Carlos', 'Jorge', 'Juan', 'Andrés', 'Miguel', 'Pedro',
+             'Jesús', 'Alberto', 'Fernando', 'Héctor', 'Javier', 'Óscar', 'Ramiro')
+APELLIDOS = ('Rodríguez', 'Gómez', 'González', 'Martínez', 'García', 'López', 'Hernández',
+             'Sánchez', 'Ramírez', 'Pérez', 'Díaz', 'Muñoz', 'Rojas', 'Moreno', 'Jiménez',
+             'Vargas', 'Castro', 'Ortiz', 'Álvarez', 'Suárez', 'Peña', 'Ríos', 'Quintero')
+EPS = ('Nueva EPS', 'Sanitas EPS', 'SURA EPS', 'Salud Total', 'Compensar', 'Famisanar',
+       'Coosalud', 'Mutual SER')
+EPS_PESOS = (0.24, 0.12, 0.16, 0.12, 0.1, 0.1, 0.09, 0.07)
+CAUSAS_ERC = ('Diabetes Mellitus tipo 2', 'Nefropatía hipertensiva', 'Glomerulonefritis crónica',
+              'Enfermedad renal poliquística', 'Uropatía obstructiva', 'No determinada')
+CAUSAS_PESOS = (0.42, 0.28, 0.12, 0.05, 0.04, 0.09)
+COMORBILIDADES = ('Hipertensión arterial', 'Diabetes tipo 2', 'Cardiopatía isquémica',
+                  'Insuficiencia cardiaca', 'Anemia crónica', 'EPOC')
+
+# Distribuciones de laboratorio: (media poblacional, dispersión entre pacientes,
+# variación mes a mes, mínimo, máximo). Ferritina y PTH son log-normales.
+DISTRIBUCIONES = {
+    'hemoglobina': (10.8, 0.9, 0.7, 5.0, 16.0),
+    'ferritina': (np.log(450), 0.45, 0.25, 20, 3000),
+    'tsat': (27.0, 6.0, 5.0, 5, 80),
+    'calcio': (9.0, 0.4, 0.35, 6.5, 12.0),
+    'fosforo': (5.0, 0.9, 0.7, 1.5, 11.0),
+    'pth': (np.log(380), 0.6, 0.25, 20, 3000),
+}
+LOGNORMALES = ('ferritina', 'pth')
+# Persistencia mensual de la desviación de cada paciente (AR(1))
+AUTOCORRELACION = 0.6
+LOTE = 5000
+
+# Sesiones: días de la semana (lunes = 0) de cada esquema y turnos posibles
+ESQUEMAS_SESION = {'LMV': (0, 2, 4), 'MJS': (1, 3, 5)}
+FRANJAS_SESION = ('MAÑANA', 'TARDE', 'NOCHE')
+
+def generate_patients(rng, n, today, years):
+    """Filas para INSERT en pacientes (mismo orden de columnas que INSERT_PATIENT_SQL)"""
+    genero = rng.choice(('F', 'M'), size=n, p=(0.42, 0.58))
+    edad_dias = (rng.normal(61, 13, size=n).clip(20, 92) * 365.25).astype(int)
+    # Inicio de diálisis antes de la ventana, para que cada paciente tenga
+    # `years` años completos de laboratorios (la escala objetivo del benchmark)
+    vintage_dias = (years * 365.25 + rng.exponential(2 * 365.25, size=n)).astype(int)
+    eps = rng.choice(len(EPS), size=n, p=EPS_PESOS)
+    causas = rng.choice(len(CAUSAS_ERC), size=n, p=CAUSAS_PESOS)
+
+    filas = []
+    for i in range(n):
+        nombres = NOMBRES_F if genero[i] == 'F' else NOMBRES_M
+        nombre = ' '.join(rng.choice(nombres, size=rng.integers(1, 3), replace=False))
+        apellido = ' '.join(rng.choice(APELLIDOS, size=2))
+        comorbilidades = ', '.join(rng.choice(COMORBILIDADES, size=rng.integers(0, 4), replace=False))
+        filas.append((
+            str(10000000 + i * 7 + int(rng.integers(0, 7))), 'CC', nombre, apellido,
+            (today - timedelta(days=int(edad_dias[i]))).isoformat(), str(genero[i]),
+            f'3{int(rng.integers(100000000, 999999999))}', EPS[eps[i]],
+            (today - timedelta(days=int(vintage_dias[i]))).isoformat(), CAUSAS_ERC[causas[i]],
+            comorbilidades or None,
+        ))
+    return filas
+
+def generate_labs(rng, patients, fields, today, years):
+    """Laboratorios mensuales por paciente desde su ingreso (o el inicio de la ventana) hasta hoy
+
+    `patients` son pares (paciente_id, fecha_inicio_hd) y `fields` el orden de
+    las columnas de laboratorio. Cada analito sigue la media del paciente más
+    una desviación AR(1) mes a mes; alrededor del 3 % de los valores faltan,
+    como en paneles incompletos.
+    """
+    inicio_ventana = today.replace(day=15) - timedelta(days=int(years * 365.25))
+    for paciente_id, inicio_hd in patients:
+        inicio = max(date.fromisoformat(inicio_hd), inicio_ventana)
+        meses = (today.year - inicio.year) * 12 + today.month - inicio.month + 1
+        if meses <= 0:
+            continue
+        fechas = [fecha.isoformat() for fecha in
+                  (add_months(inicio.replace(day=min(inicio.day, 28)), m) for m in range(meses))
+                  if fecha <= today]
+        meses = len(fechas)
+
+        columnas = []
+        for campo in fields:
+            media, entre, mensual, minimo, maximo = DISTRIBUCIONES[campo]
+            base = rng.normal(media, entre)
+            ruido = rng.normal(0, mensual, size=meses)
+            desvio = np.empty(meses)
+            desvio[0] = ruido[0]
+            for m in range(1, meses):
+                desvio[m] = AUTOCORRELACION * desvio[m - 1] + ruido[m]
+            valores = base + desvio
+            if campo in LOGNORMALES:
+                valores = np.exp(valores)
+            valores = np.round(valores.clip(minimo, maximo), 1)
+            faltantes = rng.random(meses) < 0.03
+            columnas.append([None if f else float(v) for v, f in zip(valores, faltantes)])
+
+        for m, fecha in enumerate(fechas):
+            yield (paciente_id, fecha) + tuple(columna[m] for columna in columnas)
+
+def generate_sessions(rng, patients, today, years):
+    """Sesiones de diálisis de cada paciente, tres por semana, desde su ingreso
+    (o el inicio de la ventana) hasta hoy
+
+    Filas en el orden de SESSION_COLUMNS. Cada paciente tiene un esquema y un
+    turno fijos, su peso seco y su presión habitual; la ganancia de peso entre
+    sesiones, la ultrafiltración y la presión varían sesión a sesión.
+    """
+    inicio_ventana = today - timedelta(days=int(years * 365.25))
+    for paciente_id, inicio_hd in patients:
+        esquema = ('LMV', 'MJS')[int(rng.integers(0, 2))]
+        turno = f"{esquema}_{FRANJAS_SESION[int(rng.integers(0, 3))]}"
+        inicio = max(date.fromisoformat(inicio_hd), inicio_ventana)
+        fechas = [inicio + timedelta(days=d) for d in range((today - inicio).days + 1)]
+        fechas = [fecha.isoformat() for fecha in fechas if fecha.weekday() in ESQUEMAS_SESION[esquema]]
+        n = len(fechas)
+        if not n:
+            continue
+
+        peso_seco = round(float(rng.normal(68, 12)), 1)
+        ganancia = rng.normal(2.2, 0.8, size=n).clip(0.2, 6)
+        residuo = rng.normal(0.2, 0.3, size=n).clip(-0.5, 1.5)
+        peso_pre = np.round(peso_seco + ganancia, 1)
+        peso_post = np.round(peso_seco + residuo, 1)
+        uf_real = np.round(peso_pre - peso_post, 1)
+        uf_programada = np.round(uf_real + rng.normal(0, 0.2, size=n), 1)
+        qb = int(rng.choice((300, 350, 400, 450)))
+        kt_v = np.round(rng.normal(1.4, 0.2, size=n).clip(0.6, 2.4), 2)
+        pru = np.round(rng.normal(70, 5, size=n).clip(40, 90), 1)
+        pas_base, pad_base = rng.normal(145, 15), rng.normal(80, 8)
+        pas_pre = rng.normal(pas_base, 12, size=n).clip(80, 230).astype(int)
+        pad_pre = np.minimum(rng.normal(pad_base, 8, size=n).clip(40, 130), pas_pre - 20).astype(int)
+        pas_post = (pas_pre - rng.normal(10, 10, size=n)).clip(70, 230).astype(int)
+        pad_post = np.minimum((pad_pre - rng.normal(4, 5, size=n)).clip(35, 130), pas_post - 20).astype(int)
+        complicaciones = rng.random(n) < 0.05
+
+        for i, fecha in enumerate(fechas):
+            yield (paciente_id, fecha, turno, float(peso_pre[i]), float(peso_post[i]), peso_seco, qb,
+                   240, float(uf_programada[i]), float(uf_real[i]), float(kt_v[i]), float(pru[i]),
+                   int(pas_pre[i]), int(pad_pre[i]), int(pas_post[i]), int(pad_post[i]), None,
+                   'Hipotensión intradialítica' if complicaciones[i] else None, None)
+
+def add_months(fecha, meses):
+    """Misma fecha `meses` meses después (el día debe existir en todos los meses)"""
+    total = fecha.month - 1 + meses
+    return fecha.replace(year=fecha.year + total // 12, month=total % 12 + 1)
+
+def generate(conn, patients=5000, years=10, seed=42, today=None, sessions=False):
+    """Poblar una base vacía; devuelve el número de filas creadas por tabla"""
+    # Importación diferida: app registra el comando que llama a esta función
+    from app import (INSERT_PATIENT_SQL, LAB_FIELDS, SESSION_COLUMNS, evaluate_lab_alerts,
+                     prune_alert_events, refresh_lab_trends)
+
+    rng = np.random.default_rng(seed)
+    hoy = today or date.today()
+
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.executemany(INSERT_PATIENT_SQL, generate_patients(rng, patients, hoy, years))
+        pacientes = conn.execute("SELECT id, fecha_inicio_hd FROM pacientes ORDER BY id").fetchall()
+
+        insert_lab = f"""
+            INSERT INTO laboratorios (paciente_id, fecha, {', '.join(LAB_FIELDS)})
+            VALUES (?, ?, {', '.join('?' for _ in LAB_FIELDS)})
+        """
+        laboratorios = 0
+        lote = []
+        for fila in generate_labs(rng, [tuple(p) for p in pacientes], LAB_FIELDS, hoy, years):
+            lote.append(fila)
+            if len(lote) >= LOTE:
+                conn.executemany(insert_lab, lote)
+                laboratorios += len(lote)
+                lote = []
+        if lote:
+            conn.executemany(insert_lab, lote)
+            laboratorios += len(lote)
+
+        sesiones = 0
+        if sessions:
+            insert_session = f"""
+                INSERT INTO sesiones_dialisis ({', '.join(SESSION_COLUMNS)})
+                VALUES ({', '.join('?' for _ in SESSION_COLUMNS)})
+            """
+            lote = []
+            for fila in generate_sessions(rng, [tuple(p) for p in pacientes], hoy, years):
+                lote.append(fila)
+                if len(lote) >= LOTE:
+                    conn.executemany(insert_session, lote)
+                    sesiones += len(lote)
+                    lote = []
+            if lote:
+                conn.executemany(insert_session, lote)
+                sesiones += len(lote)
+
+        ids = [p[0] for p in pacientes]
+        alertas = 0
+        for i in range(0, len(ids), 500):
+            alertas += evaluate_lab_alerts(conn, ids[i:i + 500])['creadas']
+        prune_alert_events(conn)
+        refresh_lab_trends(conn)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    counts = {'pacientes': len(pacientes), 'laboratorios': laboratorios, 'alertas': alertas}
+    if sessions:
+        counts['sesiones'] = sesiones
+    return counts
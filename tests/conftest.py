@@ -0,0 +1,147 @@
+import os
+import random
+import sqlite3
+from contextlib import contextmanager
+
+import pytest
+
+# hdm lee la URI al importarse: base en memoria para todas las pruebas
+os.environ.setdefault('HDM_DATABASE_URI', 'sqlite://')
+
+
+@pytest.fixture
+def app_db():
+    import hdm.app as hdm
+
+    with hdm.app.app_context():
+        hdm.db.create_all()
+        yield hdm.db
+        hdm.db.session.remove()
+        hdm.db.drop_all()
+
+
+@pytest.fixture
+def contar_consultas():
+    """Context manager que registra las sentencias que hdm envía a la base"""
+    from sqlalchemy import event
+
+    import hdm.app as hdm
+
+    @contextmanager
+    def contar():
+        consultas = []
+
+        def registrar(conn, cursor, statement, parameters, context, executemany):
+            consultas.append(statement)
+
+        event.listen(hdm.db.engine, 'before_cursor_execute', registrar)
+        try:
+            yield consultas
+        finally:
+            event.remove(hdm.db.engine, 'before_cursor_execute', registrar)
+
+    return contar
+
+
+@pytest.fixture
+def api_conn():
+    """Base en memoria del API (app.py) con todas las migraciones"""
+    import app as api
+
+    conn = sqlite3.connect(':memory:', check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    api.run_migrations(conn)
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def api_client(api_conn, monkeypatch):
+    """Cliente de pruebas del API sobre api_conn, con la caché de respuestas vacía"""
+    import app as api
+
+    monkeypatch.setattr(api, 'get_db', lambda: api_conn)
+    api.response_cache.invalidate('')
+    with api.app.test_client() as client:
+        yield client
+    api.response_cache.invalidate('')
+
+
+@pytest.fixture
+def api_archivo(tmp_path, monkeypatch):
+    """Base del API en un archivo temporal, con los datos de ejemplo
+
+    Para rutas que abren sus propias conexiones desde el pool (hilos del
+    stream SSE, modo ASGI); devuelve la ruta de la base.
+    """
+    import app as api
+
+    database = str(tmp_path / 'api.db')
+    monkeypatch.setattr(api, 'DATABASE', database)
+    monkeypatch.setattr(api, 'db_pool', api.ConnectionPool(database))
+    api.init_db()
+    api.response_cache.invalidate('')
+    yield database
+    api.response_cache.invalidate('')
+
+
+@pytest.fixture
+def crear_pacientes(api_conn):
+    """Crear `n` pacientes activos y devolver sus ids
+
+    Cada campo se puede fijar con un valor o con una función del índice del
+    paciente, p. ej. eps=lambda i: EPS[i % 3].
+    """
+    import app as api
+
+    columnas = ('documento', 'tipo_documento', 'nombres', 'apellidos', 'fecha_nacimiento',
+                'genero', 'telefono', 'eps', 'fecha_inicio_hd', 'causa_erc', 'comorbilidades')
+    creados = [0]
+
+    def crear(n=1, **campos):
+        ids = []
+        for i in range(n):
+            fila = {'documento': str(1000 + creados[0]), 'tipo_documento': 'CC', 'nombres': 'Nombre',
+                    'apellidos': 'Apellido', 'fecha_nacimiento': '1960-01-01', 'genero': 'F',
+                    'telefono': None, 'eps': 'Nueva EPS', 'fecha_inicio_hd': '2020-01-01',
+                    'causa_erc': None, 'comorbilidades': None}
+            fila.update({campo: valor(i) if callable(valor) else valor for campo, valor in campos.items()})
+            ids.append(api_conn.execute(api.INSERT_PATIENT_SQL, [fila[c] for c in columnas]).lastrowid)
+            creados[0] += 1
+        api_conn.commit()
+        return ids
+
+    return crear
+
+
+@pytest.fixture
+def incremental_igual_a_completo():
+    """Verificar que lo mantenido por triggers coincide con recalcularlo desde cero
+
+    Aplica inserciones, cambios y borrados de laboratorios al azar (más las
+    operaciones `extras`, funciones (conn, rng)), toma `resumen(conn)`, llama a
+    `recalcular(conn)` y exige el mismo resumen.
+    """
+    def verificar(conn, pacientes, insertar, resumen, recalcular, extras=(), operaciones=600, semilla=7):
+        rng = random.Random(semilla)
+        for _ in range(operaciones):
+            operacion = rng.random()
+            fecha = f'20{rng.randint(22, 23)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}'
+            if operacion < 0.65:
+                insertar(conn, rng, rng.choice(pacientes), fecha)
+            elif operacion < 0.8:
+                conn.execute("""UPDATE laboratorios SET hemoglobina = ?, fecha = ?
+                                WHERE id = (SELECT id FROM laboratorios ORDER BY random() LIMIT 1)""",
+                             (round(rng.uniform(7, 14), 1), fecha))
+            elif operacion < 0.93 or not extras:
+                conn.execute("""DELETE FROM laboratorios
+                                WHERE id = (SELECT id FROM laboratorios ORDER BY random() LIMIT 1)""")
+            else:
+                rng.choice(extras)(conn, rng)
+        incremental = resumen(conn)
+        recalcular(conn)
+        assert resumen(conn) == incremental
+        assert incremental and all(incremental)
+
+    return verificar
+
@@ -0,0 +1,45 @@
+"""Stream SSE de alertas en Flask: apagado por defecto, y encendido reanuda
+desde Last-Event-ID y entrega las alertas nuevas."""
+import json
+import sqlite3
+
+import app as api
+
+
+def eventos(chunks, n):
+    """Los siguientes `n` eventos SSE (id, tipo, datos) del stream"""
+    leidos = []
+    for chunk in chunks:
+        campos = dict(linea.split(': ', 1) for linea in chunk.decode().strip().split('\n')
+                      if not linea.startswith((':', 'retry')))
+        if campos:
+            leidos.append((int(campos['id']), campos['event'], json.loads(campos['data'])))
+        if len(leidos) == n:
+            return leidos
+
+
+def test_apagado_por_defecto(api_client):
+    assert api.SSE_ENABLED is False
+    assert api_client.get('/api/alerts').headers['X-Alert-Stream'] == '0'
+    assert api_client.get('/api/alerts/stream').status_code == 503
+    assert api_client.get('/api/alerts/stream?last_event_id=x').status_code == 400
+
+
+def test_reanuda_y_entrega_alertas_nuevas(api_archivo, monkeypatch):
+    monkeypatch.setattr(api, 'SSE_ENABLED', True)
+    monkeypatch.setattr(api, 'alert_broadcaster', api.AlertBroadcaster(interval=0.01))
+    client = api.app.test_client()
+    assert client.get('/api/alerts').headers['X-Alert-Stream'] == '1'
+
+    response = client.get('/api/alerts/stream', headers={'Last-Event-ID': '1'}, buffered=False)
+    assert response.mimetype == 'text/event-stream'
+    chunks = iter(response.response)
+    # Las tres alertas de ejemplo generaron los eventos 1 a 3
+    assert [(id, tipo) for id, tipo, _ in eventos(chunks, 2)] == [(2, 'alerta'), (3, 'alerta')]
+
+    conn = sqlite3.connect(api_archivo)
+    conn.execute("UPDATE alertas SET resuelta = 1 WHERE id = 2")
+    conn.commit()
+    conn.close()
+    assert eventos(chunks, 1) == [(4, 'alerta', {'accion': 'RESUELTA', 'alerta': {'id': 2}})]
+    response.close()
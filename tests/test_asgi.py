@@ -0,0 +1,50 @@
+"""Modo ASGI: mismas respuestas y validaciones que Flask sobre la misma base,
+y lecturas por conexiones que no pueden escribir."""
+import sqlite3
+
+import pytest
+
+import app as api
+
+asgi = pytest.importorskip('asgi')
+testclient = pytest.importorskip('starlette.testclient')
+
+
+@pytest.fixture
+def clientes(api_archivo, monkeypatch):
+    """Clientes (Flask, ASGI) sobre una misma base en archivo con los datos de ejemplo"""
+    monkeypatch.setattr(asgi, 'db', asgi.AsyncDatabase(api_archivo, readers=2))
+    with testclient.TestClient(asgi.app) as asgi_client, api.app.test_client() as flask_client:
+        yield flask_client, asgi_client
+
+
+def test_mismas_respuestas(clientes):
+    flask_client, asgi_client = clientes
+    flask_error = flask_client.post('/api/patients', json={'nombres': 'Ana'})
+    asgi_error = asgi_client.post('/api/patients', json={'nombres': 'Ana'})
+    assert flask_error.status_code == asgi_error.status_code == 400
+    assert flask_error.get_json() == asgi_error.json()
+    assert flask_client.post('/api/patients', data='x', content_type='application/json').status_code == 400
+
+    nuevo = {'documento': '555', 'tipo_documento': 'CC', 'nombres': 'Ana', 'apellidos': 'Ríos',
+             'fecha_nacimiento': '1970-05-01', 'genero': 'F', 'fecha_inicio_hd': '2021-01-01'}
+    assert asgi_client.post('/api/patients', json=nuevo).status_code == 201
+
+    flask_lista = flask_client.get('/api/patients?limit=2&fields=id,nombres,edad')
+    asgi_lista = asgi_client.get('/api/patients?limit=2&fields=id,nombres,edad')
+    assert flask_lista.get_json() == asgi_lista.json()
+    for header in ('X-Next-Cursor', 'X-Total-Count'):
+        assert flask_lista.headers[header] == asgi_lista.headers[header]
+    assert asgi_lista.headers['X-Total-Count'] == '4'
+
+
+def test_lectores_solo_lectura(clientes):
+    _, asgi_client = clientes
+
+    async def borrar_alertas():
+        async with asgi.db.read() as conn:
+            await conn.execute("DELETE FROM alertas")
+
+    with pytest.raises(sqlite3.OperationalError, match='readonly'):
+        asgi_client.portal.call(borrar_alertas)
+    assert len(asgi_client.get('/api/alerts').json()) == 3
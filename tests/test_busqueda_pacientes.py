@@ -0,0 +1,49 @@
+"""Búsqueda de pacientes con FTS5: prefijos sin tildes, índice sincronizado
+por triggers, solo pacientes activos y orden por relevancia."""
+import pytest
+
+
+@pytest.fixture
+def pacientes(crear_pacientes):
+    return crear_pacientes(3, documento=lambda i: ('1001', '1002', '2003')[i],
+                           nombres=lambda i: ('María José', 'Mario', 'Ana')[i],
+                           apellidos=lambda i: ('Gómez Peña', 'Ramírez', 'Gomes')[i],
+                           eps=lambda i: ('Nueva EPS', 'SURA EPS', 'Nueva EPS')[i])
+
+
+def buscar(client, q, **params):
+    response = client.get('/api/patients/search', query_string={'q': q, **params})
+    assert response.status_code == 200
+    return [paciente['id'] for paciente in response.get_json()]
+
+
+def test_prefijos_sin_tildes(api_client, pacientes):
+    assert buscar(api_client, 'gomez') == [1]
+    assert sorted(buscar(api_client, 'mar')) == [1, 2]
+    assert buscar(api_client, 'MAR ram') == [2]
+    assert sorted(buscar(api_client, '100')) == [1, 2]
+    assert buscar(api_client, 'peña "OR* NEAR(') == []
+    assert api_client.get('/api/patients/search?q=%20*').status_code == 400
+
+
+def test_triggers_mantienen_el_indice(api_conn, api_client, pacientes):
+    api_conn.execute("UPDATE pacientes SET apellidos = 'Gómez Ortiz' WHERE id = 3")
+    api_conn.execute("UPDATE pacientes SET activo = 0 WHERE id = 2")
+    api_conn.execute("DELETE FROM pacientes WHERE id = 1")
+    api_conn.commit()
+    assert buscar(api_client, 'gomez') == [3]
+    assert buscar(api_client, 'mario') == []
+    api_conn.execute("INSERT INTO pacientes_fts (pacientes_fts) VALUES ('integrity-check')")
+
+
+def test_ordena_todas_las_coincidencias(api_conn, api_client, crear_pacientes):
+    # 600 pacientes coinciden solo por la EPS y los primeros están inactivos;
+    # el mejor resultado (apellido) se creó al final
+    crear_pacientes(600, eps='Gómez Salud')
+    api_conn.execute("UPDATE pacientes SET activo = 0 WHERE id <= 300")
+    mejor, = crear_pacientes(apellidos='Gómez', eps='SURA EPS')
+    api_conn.commit()
+
+    encontrados = buscar(api_client, 'gomez', limit=5)
+    assert encontrados[0] == mejor
+    assert len(encontrados) == 5 and min(encontrados) > 300
@@ -0,0 +1,63 @@
+"""Caché de respuestas: LRU con TTL, validada por el ETag de las tablas, así
+que una escritura desde cualquier conexión se ve en la siguiente lectura."""
+import app as api
+
+
+def guardar(cache, key, etag='e1'):
+    cache.store(key, etag, key.encode(), 'application/json', {})
+
+
+def test_lru_ttl_e_invalidacion(monkeypatch):
+    ahora = [100.0]
+    monkeypatch.setattr(api.time, 'monotonic', lambda: ahora[0])
+    cache = api.ResponseCache(maxsize=2, ttl=30)
+
+    guardar(cache, '/api/patients?')
+    guardar(cache, '/api/alerts?')
+    assert cache.get('/api/patients?', 'e1')['body'] == b'/api/patients?'
+    guardar(cache, '/api/patients/1?')                     # desaloja la menos usada
+    assert cache.get('/api/alerts?', 'e1') is None
+    assert cache.get('/api/patients?', 'e2') is None       # ETag distinto: la entrada se descarta
+    assert cache.get('/api/patients?', 'e1') is None
+
+    guardar(cache, '/api/patients?')
+    ahora[0] += 31
+    assert cache.get('/api/patients/1?', 'e1') is None
+    cache.invalidate('/api/patients?')
+    assert cache.stats() == {'size': 0, 'maxsize': 2, 'ttl': 30, 'hits': 1, 'misses': 4,
+                             'evictions': 1, 'expirations': 1, 'invalidations': 2}
+
+    apagada = api.ResponseCache(maxsize=0)
+    guardar(apagada, '/api/patients?')
+    assert apagada.stats()['size'] == 0
+
+
+def test_escrituras_invalidan_la_cache(api_conn, api_client, crear_pacientes):
+    crear_pacientes(3)
+    url = '/api/patients?limit=2&fields=id,nombres'
+
+    def estado():
+        return api_client.get('/api/status').get_json()['cache']
+
+    primera = api_client.get(url)
+    antes = estado()
+    segunda = api_client.get(url)
+    assert estado()['hits'] == antes['hits'] + 1
+    assert segunda.get_data() == primera.get_data()
+    assert segunda.headers['X-Next-Cursor'] == primera.headers['X-Next-Cursor']
+    assert segunda.headers['X-Total-Count'] == '3'
+
+    # Escritura fuera del API: la detecta el ETag, no una invalidación explícita
+    api_conn.execute("UPDATE pacientes SET nombres = 'Cambiado' WHERE id = 1")
+    api_conn.commit()
+    antes = estado()
+    assert api_client.get(url).get_json()[0]['nombres'] == 'Cambiado'
+    assert estado()['misses'] == antes['misses'] + 1
+
+    # Escritura por el API: descarta las listas de pacientes
+    api_client.get(url)
+    assert api_client.post('/api/patients', json={
+        'documento': '9', 'tipo_documento': 'CC', 'nombres': 'Nuevo', 'apellidos': 'Paciente',
+        'fecha_nacimiento': '1980-01-01', 'genero': 'M', 'eps': 'Nueva EPS',
+        'fecha_inicio_hd': '2022-01-01'}).status_code == 201
+    assert api_client.get(url).headers['X-Total-Count'] == '4'
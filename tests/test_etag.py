@@ -0,0 +1,52 @@
+"""GET condicional: If-None-Match responde 304 mientras no cambie la tabla (o el
+paciente) y cualquier escritura, por cualquier conexión, cambia el ETag."""
+
+
+def etag_de(client, url):
+    response = client.get(url)
+    assert response.status_code == 200
+    return response.headers['ETag']
+
+
+def condicional(client, url, etag):
+    return client.get(url, headers={'If-None-Match': etag}).status_code
+
+
+def test_listas_304_hasta_una_escritura(api_conn, api_client, crear_pacientes):
+    paciente_id, = crear_pacientes()
+    pacientes = etag_de(api_client, '/api/patients')
+    alertas = etag_de(api_client, '/api/alerts')
+    assert condicional(api_client, '/api/patients', pacientes) == 304
+    assert condicional(api_client, '/api/alerts', alertas) == 304
+    # Cada URL tiene su propio ETag
+    assert etag_de(api_client, '/api/patients?limit=1') != pacientes
+
+    respuesta = api_client.post('/api/patients', json={
+        'documento': '77', 'tipo_documento': 'CC', 'nombres': 'Luz', 'apellidos': 'Mora',
+        'fecha_nacimiento': '1980-01-01', 'genero': 'F', 'fecha_inicio_hd': '2022-01-01'})
+    assert respuesta.status_code == 201
+    assert condicional(api_client, '/api/patients', pacientes) == 200
+    # Las alertas muestran el nombre del paciente: también dependen de pacientes
+    assert condicional(api_client, '/api/alerts', alertas) == 200
+    pacientes = etag_de(api_client, '/api/patients')
+    alertas = etag_de(api_client, '/api/alerts')
+
+    # Escrituras hechas fuera del API (otro worker) también cambian el ETag,
+    # solo de las respuestas que leen esa tabla
+    api_conn.execute("""INSERT INTO alertas (paciente_id, tipo, categoria, mensaje)
+                        VALUES (?, 'PREVENTIVA', 'ANEMIA', 'Control')""", (paciente_id,))
+    api_conn.commit()
+    assert condicional(api_client, '/api/alerts', alertas) == 200
+    assert condicional(api_client, '/api/patients', pacientes) == 304
+
+
+def test_detalle_por_paciente(api_conn, api_client, crear_pacientes):
+    uno, dos = crear_pacientes(2)
+    etags = {id: etag_de(api_client, f'/api/patients/{id}') for id in (uno, dos)}
+
+    api_conn.execute("INSERT INTO laboratorios (paciente_id, fecha, hemoglobina) VALUES (?, '2024-01-01', 11)",
+                     (uno,))
+    api_conn.commit()
+    assert condicional(api_client, f'/api/patients/{uno}', etags[uno]) == 200
+    # Los datos de otro paciente no cambian su ETag
+    assert condicional(api_client, f'/api/patients/{dos}', etags[dos]) == 304
@@ -0,0 +1,71 @@
+"""El número de consultas del dashboard y de la sincronización de alertas de
+hdm no debe crecer con el número de pacientes (regresión N+1)."""
+from datetime import datetime, timedelta
+
+import hdm.app as hdm
+
+
+def crear_pacientes(inicio, n):
+    ids = []
+    for i in range(inicio, inicio + n):
+        paciente = hdm.Paciente(identificacion=str(1000 + i), nombre=f'Paciente {i}', edad=60,
+                                sexo='Femenino', fecha_ingreso=datetime(2022, 1, 1), turnos='{}')
+        hdm.db.session.add(paciente)
+        hdm.db.session.flush()
+        for mes in range(3):
+            hdm.db.session.add(hdm.Laboratorio(
+                paciente_id=paciente.id, fecha=datetime(2023, 1, 1) + timedelta(days=30 * mes),
+                hb=9.0 + mes, ferritina=150, tsat=18, fosforo=6.0, calcio=9.0, pth=700,
+                usuario_registro='prueba'))
+        ids.append(paciente.id)
+    hdm.db.session.commit()
+    return ids
+
+
+def consultas_sincronizacion(contar_consultas, ids):
+    with contar_consultas() as consultas:
+        hdm.actualizar_alertas(ids)
+        hdm.db.session.flush()
+    hdm.db.session.commit()
+    return len(consultas)
+
+
+def consultas_dashboard(contar_consultas, client, monkeypatch):
+    monkeypatch.setattr(hdm, 'render_template', lambda plantilla, **contexto: plantilla)
+    with client.session_transaction() as sesion:
+        sesion['user_id'] = 1
+    with contar_consultas() as consultas:
+        assert client.get('/dashboard').status_code == 200
+    return len(consultas)
+
+
+def test_consultas_constantes(app_db, contar_consultas, monkeypatch):
+    client = hdm.app.test_client()
+
+    ids = crear_pacientes(0, 5)
+    sincronizacion_pocos = consultas_sincronizacion(contar_consultas, ids)
+    dashboard_pocos = consultas_dashboard(contar_consultas, client, monkeypatch)
+
+    ids += crear_pacientes(5, 45)
+    assert consultas_sincronizacion(contar_consultas, ids) == sincronizacion_pocos
+    assert consultas_dashboard(contar_consultas, client, monkeypatch) == dashboard_pocos
+
+
+def test_datos_clinicos_en_dos_consultas(app_db, contar_consultas):
+    paciente_id, = crear_pacientes(0, 1)
+    for i in range(2):
+        hdm.db.session.add(hdm.Tratamiento(paciente_id=paciente_id, fecha=datetime(2023, 1, 1 + i),
+                                           tipo='ESA', dosis=4000, frecuencia='Semanal',
+                                           usuario_registro='prueba'))
+        hdm.db.session.add(hdm.AccesoVascular(paciente_id=paciente_id, fecha=datetime(2022, 1, 1 + i),
+                                              tipo='FAV', localizacion='Radiocefálica',
+                                              estado='Funcionando', usuario_registro='prueba'))
+    hdm.db.session.commit()
+    hdm.db.session.expunge_all()
+
+    with hdm.app.test_request_context(), contar_consultas() as consultas:
+        datos = hdm.cargar_datos_clinicos(paciente_id)
+        assert hdm.cargar_datos_clinicos(paciente_id) is datos
+        assert (len(datos['laboratorios']), len(datos['tratamientos']), len(datos['accesos'])) == (3, 2, 2)
+        assert datos['ultimo_lab'].hb == 11.0
+    assert len(consultas) == 2
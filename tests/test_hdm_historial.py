@@ -0,0 +1,126 @@
+"""El historial de cambios se escribe en la misma transacción que el cambio,
+como JSON compacto con solo los campos relevantes."""
+import json
+from datetime import datetime
+
+import hdm.app as hdm
+
+
+def iniciar_sesion(client):
+    usuario = hdm.User(username='nefrologo', name='Dr. Nefrólogo', role='nefrologo')
+    usuario.set_password('x')
+    hdm.db.session.add(usuario)
+    hdm.db.session.commit()
+    with client.session_transaction() as sesion:
+        sesion['user_id'] = usuario.id
+        sesion['username'] = usuario.username
+
+
+def crear_paciente():
+    paciente = hdm.Paciente(identificacion='1', nombre='Paciente', edad=60, sexo='Femenino',
+                            fecha_ingreso=datetime(2022, 1, 1), turnos='{}')
+    hdm.db.session.add(paciente)
+    hdm.db.session.commit()
+    return paciente.id
+
+
+def test_laboratorio_con_historial(app_db):
+    client = hdm.app.test_client()
+    iniciar_sesion(client)
+    paciente_id = crear_paciente()
+
+    formulario = dict.fromkeys(('hb', 'hto', 'ferritina', 'tsat', 'fosforo', 'calcio', 'pth',
+                                'albumin', 'kt_v'), '')
+    formulario.update(fecha='2024-03-01', hb='9.5')
+    client.post(f'/laboratorio/nuevo/{paciente_id}', data=formulario)
+
+    cambio = hdm.HistorialCambios.query.one()
+    laboratorio = hdm.Laboratorio.query.one()
+    assert (cambio.tabla_afectada, cambio.registro_id, cambio.accion, cambio.usuario) == \
+        ('Laboratorio', laboratorio.id, 'INSERT', 'nefrologo')
+    assert json.loads(cambio.datos_nuevos) == {
+        'id': laboratorio.id, 'paciente_id': paciente_id, 'fecha': '2024-03-01T00:00:00',
+        'hb': 9.5, 'usuario_registro': 'nefrologo'}
+    assert cambio.datos_anteriores is None
+
+
+def test_rollback_descarta_historial(app_db):
+    paciente_id = crear_paciente()
+    tratamiento = hdm.Tratamiento(paciente_id=paciente_id, tipo='ESA', dosis=4000,
+                                  frecuencia='semanal', usuario_registro='nefrologo')
+    hdm.db.session.add(tratamiento)
+    hdm.db.session.flush()
+    hdm.registro_historial(tratamiento, 'INSERT', 'nefrologo')
+    hdm.db.session.rollback()
+
+    assert hdm.HistorialCambios.query.count() == 0
+    assert hdm.Tratamiento.query.count() == 0
+
+
+def test_update_guarda_solo_diferencias(app_db):
+    paciente = hdm.db.session.get(hdm.Paciente, crear_paciente())
+    paciente.edad = 61
+    hdm.registro_historial(paciente, 'UPDATE', 'enfermeria')
+    hdm.db.session.commit()
+
+    cambio = hdm.HistorialCambios.query.one()
+    assert json.loads(cambio.datos_anteriores) == {'edad': 60}
+    assert json.loads(cambio.datos_nuevos) == {'edad': 61}
+
+
+def crear_cambios(inicio, meses, por_mes):
+    filas = []
+    for mes in range(meses):
+        for i in range(por_mes):
+            filas.append({
+                'tabla_afectada': 'Laboratorio' if i % 2 else 'Paciente', 'registro_id': i,
+                'accion': 'INSERT', 'usuario': 'nefrologo' if i % 3 else 'enfermeria',
+                'fecha': datetime(inicio.year + (inicio.month - 1 + mes) // 12,
+                                  (inicio.month - 1 + mes) % 12 + 1, 1 + i % 27, 8, i)})
+    hdm.db.session.execute(hdm.db.insert(hdm.HistorialCambios), filas)
+    hdm.db.session.commit()
+
+
+def recorrer(filtros, limite, **rango):
+    cambios, cursor = [], None
+    while True:
+        pagina, cursor = hdm.consultar_historial(filtros, cursor=cursor and
+                                                 hdm.decodificar_cursor_historial(cursor),
+                                                 limite=limite, **rango)
+        cambios += pagina
+        if cursor is None:
+            return cambios
+
+
+def test_paginas_con_archivo(app_db, tmp_path, monkeypatch):
+    monkeypatch.setattr(hdm, 'HISTORIAL_ARCHIVO_DIR', str(tmp_path))
+    monkeypatch.setattr(hdm, '_motores_archivo', {})
+    crear_cambios(datetime(2023, 1, 1), 18, 10)
+    antes = recorrer({}, 7)
+    assert len(antes) == 180
+    assert antes == sorted(antes, key=lambda c: (c.fecha, c.id), reverse=True)
+    antes = [tuple(c) for c in antes]
+
+    movidos = hdm.archivar_historial(meses_activos=6, hoy=datetime(2024, 6, 15))
+    assert sum(movidos.values()) == 110 and '2023-11' in movidos and '2023-12' not in movidos
+    assert hdm.HistorialCambios.query.count() == 70
+
+    # Las páginas cruzan de la tabla activa a los archivos sin saltos ni repetidos
+    assert [tuple(c) for c in recorrer({}, 7)] == antes
+    filtrados = recorrer({'tabla_afectada': 'Paciente', 'usuario': 'enfermeria'}, 4,
+                         desde=datetime(2023, 3, 1), hasta=datetime(2024, 2, 1))
+    esperados = [c for c in antes if c[1] == 'Paciente' and c[4] == 'enfermeria'
+                 and datetime(2023, 3, 1) <= c[5] < datetime(2024, 2, 1)]
+    assert [tuple(c) for c in filtrados] == esperados and esperados
+
+    # Repetir el archivado no mueve ni duplica nada
+    assert hdm.archivar_historial(meses_activos=6, hoy=datetime(2024, 6, 15)) == {}
+
+
+def test_parametros_invalidos():
+    for args in ({'cursor': 'WzFd'}, {'registro': 'x'}, {'desde': '2024-13-01'}):
+        try:
+            hdm.parametros_historial(args)
+        except ValueError:
+            continue
+        raise AssertionError(args)
@@ -0,0 +1,80 @@
+"""Turnos y sillas de hdm: migración desde el JSON de Paciente.turnos, una
+silla por turno y ocupación por turno en una sola consulta."""
+import json
+from datetime import datetime
+
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+import hdm.app as hdm
+
+
+def crear_paciente(i, turnos, activo=True):
+    paciente = hdm.Paciente(identificacion=str(i), nombre=f'Paciente {i}', edad=60, sexo='Femenino',
+                            fecha_ingreso=datetime(2022, 1, 1), turnos=json.dumps(turnos),
+                            activo=activo)
+    hdm.db.session.add(paciente)
+    hdm.db.session.commit()
+    return paciente
+
+
+def test_migracion_desde_json(app_db, monkeypatch):
+    monkeypatch.setattr(hdm, 'SILLAS_POR_TURNO', 2)
+    for i in range(3):
+        crear_paciente(i, {'lunes': 'manana', 'martes': 'no_asignado', 'miercoles': 'tarde'})
+    crear_paciente(3, {'lunes': 'otro'})
+
+    assert hdm.migrar_turnos() == 3
+    assert hdm.migrar_turnos() == 0
+    sillas = [turno.silla for turno in hdm.TurnoPaciente.query
+              .filter_by(dia='lunes', turno='manana').order_by(hdm.TurnoPaciente.paciente_id)]
+    # El tercero queda en sobrecupo: se migra sin silla
+    assert sillas == [1, 2, None]
+
+
+def test_silla_unica_por_turno(app_db):
+    uno, dos = crear_paciente(1, {}), crear_paciente(2, {})
+    hdm.asignar_turnos(uno, {'lunes': 'manana'})
+    hdm.db.session.add(hdm.TurnoPaciente(paciente_id=dos.id, dia='lunes', turno='manana', silla=1))
+    with pytest.raises(IntegrityError):
+        hdm.db.session.commit()
+    hdm.db.session.rollback()
+
+    # Los sobrecupos no tienen silla y no chocan entre sí
+    for paciente in (uno, dos):
+        hdm.db.session.add(hdm.TurnoPaciente(paciente_id=paciente.id, dia='martes', turno='tarde'))
+    hdm.db.session.commit()
+
+
+def test_ocupacion(app_db, contar_consultas, monkeypatch):
+    monkeypatch.setattr(hdm, 'SILLAS_POR_TURNO', 3)
+    for i in range(3):
+        paciente = crear_paciente(i, {})
+        hdm.asignar_turnos(paciente, {'lunes': 'manana', 'jueves': 'noche' if i else 'tarde'})
+    baja = crear_paciente(3, {})
+    hdm.asignar_turnos(baja, {'jueves': 'noche'})
+    baja.activo = False
+    hdm.db.session.commit()
+
+    # Un paciente inactivo conserva su silla: el turno sigue lleno
+    nuevo = crear_paciente(9, {})
+    with pytest.raises(ValueError):
+        hdm.asignar_turnos(nuevo, {'jueves': 'noche'})
+    hdm.asignar_turnos(nuevo, {'jueves': 'noche'}, sobrecupo=True)
+    hdm.db.session.commit()
+    assert [t.silla for t in nuevo.turnos_asignados] == [None]
+
+    client = hdm.app.test_client()
+    with client.session_transaction() as sesion:
+        sesion['user_id'] = 1
+    with contar_consultas() as consultas:
+        cuerpo = client.get('/api/ocupacion?dia=lunes').get_json()
+    assert len(consultas) == 1
+
+    manana = cuerpo['turnos'][0]
+    assert (manana['turno'], manana['ocupadas'], manana['libres']) == ('manana', 3, 0)
+    assert [p['silla'] for p in manana['pacientes']] == [1, 2, 3]
+    assert [t['libres'] for t in cuerpo['turnos'][1:]] == [3, 3]
+    noche = client.get('/api/ocupacion?dia=jueves').get_json()['turnos'][2]
+    assert (noche['ocupadas'], noche['libres'], len(noche['pacientes'])) == (3, 0, 3)
+    assert client.get('/api/ocupacion?dia=domingo').status_code == 400
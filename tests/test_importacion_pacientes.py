@@ -0,0 +1,51 @@
+"""Importación masiva de pacientes: CSV y NDJSON por lotes, con reporte de
+errores por fila y duplicados detectados dentro y entre lotes."""
+import json
+
+import app as api
+
+CAMPOS = ('documento', 'tipo_documento', 'nombres', 'apellidos', 'fecha_nacimiento', 'genero',
+          'eps', 'fecha_inicio_hd')
+
+
+def fila(documento, **cambios):
+    return {'documento': documento, 'tipo_documento': 'CC', 'nombres': 'Ana', 'apellidos': 'Ríos',
+            'fecha_nacimiento': '1970-01-01', 'genero': 'F', 'eps': 'Nueva EPS',
+            'fecha_inicio_hd': '2021-01-01', **cambios}
+
+
+def test_csv_por_lotes(api_client, crear_pacientes, monkeypatch):
+    monkeypatch.setattr(api, 'BULK_BATCH_SIZE', 4)
+    crear_pacientes(documento='existe')
+    assert api_client.get('/api/patients').headers['X-Total-Count'] == '1'
+
+    filas = [fila(str(i)) for i in range(10)]
+    filas[2] = fila('1')                                   # repetido en el mismo lote
+    filas[6] = fila('0')                                   # repetido de un lote anterior
+    filas[7] = fila('existe')                              # ya estaba en la base
+    filas[8] = fila('8', fecha_nacimiento='01/02/1970')
+    filas[9] = fila('9', nombres=' ')
+    cuerpo = ','.join(CAMPOS) + '\n' + ''.join(','.join(f[c] for c in CAMPOS) + '\n' for f in filas)
+
+    reporte = api_client.post('/api/patients/bulk', data=cuerpo.encode('utf-8'), content_type='text/csv').get_json()
+    assert (reporte['filas'], reporte['insertados'], reporte['rechazados']) == (10, 5, 5)
+    # La fila 1 del CSV es el encabezado
+    assert reporte['errores'] == [
+        {'fila': 4, 'error': 'Documento 1 ya existe'},
+        {'fila': 8, 'error': 'Documento 0 ya existe'},
+        {'fila': 9, 'error': 'Documento existe ya existe'},
+        {'fila': 10, 'error': 'fecha_nacimiento debe tener formato AAAA-MM-DD'},
+        {'fila': 11, 'error': 'Campos obligatorios faltantes: nombres'},
+    ]
+    assert reporte['filas_por_segundo'] > 0
+    # La lista cacheada se invalida con la importación
+    assert api_client.get('/api/patients').headers['X-Total-Count'] == '6'
+    assert api_client.get('/api/patients/search?q=rios').get_json()[0]['apellidos'] == 'Ríos'
+
+
+def test_ndjson(api_client):
+    cuerpo = '\n'.join([json.dumps(fila('1')), '', '{"documento": ', json.dumps(fila('2')), '[]'])
+    reporte = api_client.post('/api/patients/bulk', data=cuerpo, content_type='application/x-ndjson').get_json()
+    assert (reporte['filas'], reporte['insertados']) == (4, 2)
+    assert reporte['errores'] == [{'fila': 3, 'error': 'JSON inválido'}, {'fila': 5, 'error': 'Registro inválido'}]
+    assert api_client.post('/api/patients/bulk', data='x', content_type='application/json').status_code == 415
@@ -0,0 +1,51 @@
+"""Los indicadores de calidad mantenidos por triggers coinciden con
+recalcularlos desde cero, y el reporte suma las EPS por mes."""
+import app as api
+
+EPS = ('Nueva EPS', 'SURA EPS', None)
+
+
+def insertar(conn, rng, paciente_id, fecha):
+    conn.execute("""INSERT INTO laboratorios (paciente_id, fecha, hemoglobina, ferritina, fosforo)
+                    VALUES (?, ?, ?, ?, ?)""",
+                 (paciente_id, fecha, rng.choice((None, round(rng.uniform(8, 14), 1))),
+                  round(rng.uniform(100, 400)), round(rng.uniform(2, 7), 1)))
+
+
+def indicadores(conn):
+    return [tuple(row) for row in conn.execute(
+        "SELECT * FROM indicadores_mensuales WHERE pacientes > 0 ORDER BY 1, 2, 3")]
+
+
+def recalcular(conn):
+    conn.execute("DELETE FROM indicadores_mensuales")
+    conn.execute(api.KPI_ROLLUP_SQL)
+
+
+def test_incremental_igual_a_completo(api_conn, crear_pacientes, incremental_igual_a_completo):
+    pacientes = crear_pacientes(6, eps=lambda i: EPS[i % 3])
+
+    def cambiar_eps(conn, rng):
+        conn.execute("UPDATE pacientes SET eps = ? WHERE id = ?", (rng.choice(EPS), rng.choice(pacientes)))
+
+    incremental_igual_a_completo(api_conn, pacientes, insertar, indicadores, recalcular,
+                                 extras=[cambiar_eps], operaciones=800, semilla=11)
+
+
+def test_reporte_por_mes_y_eps(api_conn, api_client, crear_pacientes):
+    crear_pacientes(6, eps=lambda i: EPS[i % 3])
+    api_conn.executemany("INSERT INTO laboratorios (paciente_id, fecha, hemoglobina) VALUES (?, ?, ?)", [
+        (1, '2024-01-05', 11.0),   # Nueva EPS, en meta
+        (1, '2024-01-20', 9.0),    # último del mes fuera de meta
+        (2, '2024-01-10', 10.5),   # SURA EPS, en meta
+        (4, '2024-01-11', 12.0),   # Nueva EPS, en meta
+    ])
+    api_conn.commit()
+
+    body = api_client.get('/api/reports/kpis?desde=2024-01&hasta=2024-01').get_json()
+    assert api_client.get('/api/reports/kpis?desde=2024-13').status_code == 400
+
+    hemoglobina = body['meses'][0]['indicadores']['hemoglobina']
+    assert hemoglobina == {'pacientes': 3, 'en_meta': 2, 'porcentaje': 66.7}
+    assert body['por_eps']['Nueva EPS'][0]['indicadores']['hemoglobina']['en_meta'] == 1
+    assert body['por_eps']['SURA EPS'][0]['indicadores']['hemoglobina']['porcentaje'] == 100.0
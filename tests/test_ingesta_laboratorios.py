@@ -0,0 +1,46 @@
+"""Ingesta de laboratorios: duplicados descartados, documentos desconocidos
+reportados y alertas recalculadas sin tocar las registradas a mano."""
+CABECERA = 'documento,fecha,hemoglobina,ferritina,tsat,calcio,fosforo,pth\n'
+
+
+def ingerir(client, *filas):
+    response = client.post('/api/labs/ingest', data=CABECERA + ''.join(f'{fila}\n' for fila in filas),
+                           content_type='text/csv')
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def pendientes(conn):
+    return [(row['mensaje'], row['regla']) for row in conn.execute(
+        "SELECT mensaje, regla FROM alertas WHERE resuelta = 0 ORDER BY id")]
+
+
+def test_duplicados_y_documentos_desconocidos(api_conn, api_client, crear_pacientes):
+    crear_pacientes(1, documento='1001')
+    filas = ('1001,2024-01-15,11.0,300,25,9.0,4.5,300',
+             '1001,20240115,11.2,300,25,9.0,4.5,300',
+             '9999,2024-01-15,11.0,300,25,9.0,4.5,300')
+
+    reporte = ingerir(api_client, *filas)
+    assert (reporte['filas'], reporte['insertados'], reporte['duplicados'], reporte['rechazados']) == (3, 1, 1, 1)
+    assert reporte['errores'] == [{'fila': 4, 'error': 'Paciente 9999 no encontrado'}]
+    assert ingerir(api_client, *filas)['duplicados'] == 2
+    assert api_conn.execute("SELECT COUNT(*) FROM laboratorios").fetchone()[0] == 1
+
+
+def test_solo_se_resuelven_alertas_de_reglas(api_conn, api_client, crear_pacientes):
+    paciente_id, = crear_pacientes(1, documento='1001')
+    manual = 'Hemoglobina: 10.2 g/dl. Evaluar incremento de AEE.'
+    api_conn.execute("""INSERT INTO alertas (paciente_id, tipo, categoria, mensaje, prioridad)
+                        VALUES (?, 'MODERADA', 'ANEMIA', ?, 3)""", (paciente_id, manual))
+    api_conn.commit()
+
+    reporte = ingerir(api_client, '1001,2024-01-15,9.0,300,25,9.0,4.5,300')
+    assert (reporte['alertas_creadas'], reporte['alertas_resueltas']) == (1, 0)
+    assert pendientes(api_conn) == [(manual, None),
+                                    ('Hemoglobina: 9.0 g/dl. Considerar ajuste urgente.', 'hemoglobina')]
+
+    # Con un laboratorio en rango se resuelve la alerta de la regla, no la manual
+    reporte = ingerir(api_client, '1001,2024-02-15,11.0,300,25,9.0,4.5,300')
+    assert (reporte['alertas_creadas'], reporte['alertas_resueltas']) == (0, 1)
+    assert pendientes(api_conn) == [(manual, None)]
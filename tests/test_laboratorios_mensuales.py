@@ -0,0 +1,42 @@
+"""Los resúmenes mensuales y las tendencias mantenidos por triggers coinciden
+con recalcularlos desde cero, tras inserciones, cambios y borrados."""
+import app as api
+
+
+def insertar(conn, rng, paciente_id, fecha):
+    conn.execute("INSERT INTO laboratorios (paciente_id, fecha, hemoglobina, pth) VALUES (?, ?, ?, ?)",
+                 (paciente_id, fecha, rng.choice((None, round(rng.uniform(7, 13), 1))),
+                  round(rng.uniform(100, 900))))
+
+
+def resumen(conn):
+    api.refresh_lab_trends(conn)
+    mensuales = [tuple(round(v, 6) if isinstance(v, float) else v for v in row)
+                 for row in conn.execute("SELECT * FROM laboratorios_mensuales ORDER BY 1, 2, 3")]
+    tendencias = [tuple(round(v, 6) if isinstance(v, float) else v for v in row)
+                  for row in conn.execute("SELECT * FROM tendencias_laboratorio ORDER BY 1, 2")]
+    return mensuales, tendencias
+
+
+def recalcular(conn):
+    conn.execute("DELETE FROM laboratorios_mensuales")
+    for analito in api.MONTHLY_ANALYTES:
+        conn.execute(api.monthly_rollup_sql(analito, '1'))
+    conn.execute("DELETE FROM tendencias_laboratorio")
+    conn.execute(api.trend_insert_sql('1'))
+
+
+def test_incremental_igual_a_completo(api_conn, crear_pacientes, incremental_igual_a_completo):
+    # Las tendencias se recalculan también a mitad de la secuencia, como entre lotes
+    incremental_igual_a_completo(api_conn, crear_pacientes(3), insertar, resumen, recalcular,
+                                 extras=[lambda conn, rng: api.refresh_lab_trends(conn)])
+
+
+def test_reducir_puntos_conserva_extremos():
+    filas = [{'mes': f'2023-{m:02d}', 'n': 2, 'suma': 2.0 * m, 'minimo': m - 1.0,
+              'maximo': m + 1.0, 'ultimo': float(m)} for m in range(1, 13)]
+    puntos = api.downsample_months(filas, 5)
+    assert len(puntos) == 4
+    assert puntos[0] == {'desde': '2023-01', 'hasta': '2023-03', 'n': 6, 'minimo': 0.0,
+                         'maximo': 4.0, 'media': 2.0, 'ultimo': 3.0}
+    assert len(api.downsample_months(filas, None)) == 12
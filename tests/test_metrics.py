@@ -0,0 +1,72 @@
+"""Formato de exposición de Prometheus, suma de instantáneas entre workers y
+conteo de esperas del lock de escritura de SQLite."""
+import sqlite3
+import threading
+import time
+
+import app as api
+from metrics import Registry
+
+
+def test_histograma_acumulativo():
+    registry = Registry(directory=None)
+    latencia = registry.histogram('latencia_seconds', 'Latencia', ('route',), buckets=(0.1, 1))
+    for valor in (0.05, 0.1, 0.5, 3):
+        latencia.observe(valor, '/api/x')
+
+    lineas = registry.render().splitlines()
+    assert 'latencia_seconds_bucket{route="/api/x",le="0.1"} 2' in lineas
+    assert 'latencia_seconds_bucket{route="/api/x",le="1"} 3' in lineas
+    assert 'latencia_seconds_bucket{route="/api/x",le="+Inf"} 4' in lineas
+    assert 'latencia_seconds_count{route="/api/x"} 4' in lineas
+
+
+def test_suma_de_workers(tmp_path):
+    registros = [Registry(directory=str(tmp_path)) for _ in range(2)]
+    for numero, registry in enumerate(registros):
+        contador = registry.counter('requests_total', 'Requests', ('status',))
+        contador.inc('200', amount=numero + 1)
+        # Cada proceso real escribe su propio archivo (metrics-<pid>.json)
+        registry._snapshot_path = lambda numero=numero: str(tmp_path / f'metrics-{numero}.json')
+        registry.flush(force=True)
+
+    assert 'requests_total{status="200"} 3' in registros[0].render().splitlines()
+
+
+def test_etiquetas_escapadas():
+    registry = Registry(directory=None)
+    registry.counter('c_total', 'C', ('tipo',)).inc('a"b\\c')
+    assert 'c_total{tipo="a\\"b\\\\c"} 1' in registry.render()
+
+
+def test_esperas_del_lock_de_escritura(tmp_path):
+    def esperas():
+        for linea in api.metrics.render().splitlines():
+            if linea.startswith('sqlite_lock_waits_total{operation="prueba_lock"}'):
+                return float(linea.split()[-1])
+        return 0
+
+    database = str(tmp_path / 'lock.db')
+    conexiones = [api.configure_connection(sqlite3.connect(database, check_same_thread=False))
+                  for _ in range(2)]
+    conexiones[0].execute("CREATE TABLE t (x)")
+    conexiones[0].commit()
+
+    with api.write_transaction(conexiones[0], 'prueba_lock'):
+        pass
+    assert esperas() == 0
+
+    tomado = threading.Event()
+
+    def retener_lock():
+        with api.write_transaction(conexiones[0], 'otra'):
+            tomado.set()
+            time.sleep(0.05)
+
+    hilo = threading.Thread(target=retener_lock)
+    hilo.start()
+    tomado.wait()
+    with api.write_transaction(conexiones[1], 'prueba_lock') as conn:
+        conn.execute("INSERT INTO t VALUES (1)")
+    hilo.join()
+    assert esperas() == 1
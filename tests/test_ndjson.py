@@ -0,0 +1,48 @@
+"""Exportación NDJSON con Accept: application/x-ndjson: una línea por fila,
+las mismas filas y campos que el JSON, y sin el límite de paginación."""
+import json
+import sqlite3
+
+import pytest
+
+import app as api
+
+NDJSON = {'Accept': 'application/x-ndjson'}
+
+
+@pytest.fixture
+def client(api_archivo, monkeypatch):
+    # Bloques chicos para recorrer varios fetchmany
+    monkeypatch.setattr(api, 'NDJSON_CHUNK_ROWS', 2)
+    with sqlite3.connect(api_archivo) as conn:
+        for i in range(5):
+            conn.execute("""INSERT INTO pacientes (documento, tipo_documento, nombres, apellidos,
+                            fecha_nacimiento, genero, eps, fecha_inicio_hd)
+                            VALUES (?, 'CC', 'Nombre', 'Apellido', '1970-01-01', 'F', 'Nueva EPS', '2021-01-01')""",
+                         (f'ndjson-{i}',))
+    with api.app.test_client() as client:
+        yield client
+
+
+def lineas(response):
+    assert response.mimetype == 'application/x-ndjson'
+    assert 'Accept' in response.headers['Vary']
+    return [json.loads(linea) for linea in response.get_data(as_text=True).splitlines()]
+
+
+def test_pacientes(client):
+    completo = client.get('/api/patients?limit=500').get_json()
+    assert len(completo) == 8
+    assert lineas(client.get('/api/patients', headers=NDJSON)) == completo
+
+    url = '/api/patients?fields=id,documento&eps=Nueva EPS'
+    assert lineas(client.get(url + '&limit=3', headers=NDJSON)) == client.get(url + '&limit=3').get_json()
+    assert client.get('/api/patients?fields=clave', headers=NDJSON).status_code == 400
+
+
+def test_alertas(client):
+    alertas = client.get('/api/alerts').get_json()
+    assert lineas(client.get('/api/alerts', headers=NDJSON)) == alertas
+    assert lineas(client.get('/api/alerts?limit=1', headers=NDJSON)) == alertas[:1]
+    # JSON sigue siendo la respuesta por defecto
+    assert client.get('/api/alerts', headers={'Accept': '*/*'}).mimetype == 'application/json'
@@ -0,0 +1,35 @@
+"""Lista de pacientes paginada por cursor: las páginas se encadenan sin huecos
+ni repetidos, solo con los campos pedidos y con el total en la primera."""
+
+
+def recorrer(client, **params):
+    paginas, cursor = [], None
+    while True:
+        response = client.get('/api/patients', query_string={**params, **({'cursor': cursor} if cursor else {})})
+        assert response.status_code == 200
+        paginas.append(response)
+        cursor = response.headers.get('X-Next-Cursor')
+        if not cursor:
+            return paginas
+
+
+def test_cursor_recorre_todas_las_paginas(api_conn, api_client, crear_pacientes):
+    crear_pacientes(25, fecha_nacimiento=lambda i: f'19{50 + i % 7}-01-01',
+                    eps=lambda i: 'SURA EPS' if i % 4 == 0 else 'Nueva EPS')
+    api_conn.execute("UPDATE pacientes SET activo = 0 WHERE id = 3")
+    api_conn.commit()
+
+    paginas = recorrer(api_client, limit=7, orden='edad', fields='id,nombres')
+    pacientes = [p for pagina in paginas for p in pagina.get_json()]
+    assert [len(pagina.get_json()) for pagina in paginas] == [7, 7, 7, 3]
+    assert sorted(p['id'] for p in pacientes) == [i for i in range(1, 26) if i != 3]
+    assert all(set(p) == {'id', 'nombres'} for p in pacientes)
+    assert paginas[0].headers['X-Total-Count'] == '24'
+    assert all('X-Total-Count' not in pagina.headers for pagina in paginas[1:])
+
+    sura = recorrer(api_client, limit=2, eps='SURA EPS')
+    assert sura[0].headers['X-Total-Count'] == '7'
+    assert sum(len(pagina.get_json()) for pagina in sura) == 7
+
+    assert api_client.get('/api/patients?cursor=abc').status_code == 400
+    assert api_client.get('/api/patients?fields=id,clave').status_code == 400
@@ -0,0 +1,52 @@
+"""Pool de conexiones SQLite: PRAGMAs, reutilización, devolución al terminar
+cada request (también en errores), tope de conexiones y reinicio tras fork."""
+import os
+
+import pytest
+
+import app as api
+
+
+def test_reutiliza_conexiones_configuradas(tmp_path):
+    pool = api.ConnectionPool(str(tmp_path / 'pool.db'), size=1, timeout=0.01)
+    conn = pool.acquire()
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == 'wal'
+    assert conn.execute("PRAGMA busy_timeout").fetchone()[0] == 5000
+    conn.execute("CREATE TABLE t (x)")
+    conn.execute("INSERT INTO t VALUES (1)")
+    assert conn.in_transaction
+
+    # Sin cupo, la espera termina en error en lugar de abrir otra conexión
+    with pytest.raises(RuntimeError):
+        pool.acquire()
+
+    # Al devolverla se descarta la transacción abierta
+    pool.release(conn)
+    assert pool.acquire() is conn
+    assert not conn.in_transaction
+    assert conn.execute("SELECT COUNT(*) FROM t").fetchone()[0] == 0
+    stats = pool.stats()
+    assert (stats['created'], stats['reused'], stats['waits'], stats['timeouts']) == (1, 1, 1, 1)
+
+
+def test_reinicio_tras_fork(tmp_path, monkeypatch):
+    pool = api.ConnectionPool(str(tmp_path / 'pool.db'), size=1)
+    heredada = pool.acquire()
+    pool.release(heredada)
+    monkeypatch.setattr(os, 'getpid', lambda: -1)
+
+    # El "hijo" abre sus propias conexiones y no reutiliza las del padre
+    nueva = pool.acquire()
+    assert nueva is not heredada
+    stats = pool.stats()
+    assert (stats['pid'], stats['created'], stats['reused']) == (-1, 1, 0)
+
+
+def test_cada_request_devuelve_su_conexion(api_archivo):
+    client = api.app.test_client()
+    for _ in range(3):
+        assert client.get('/api/patients').status_code == 200
+        assert client.get('/api/patients/999').status_code == 404
+    stats = api.db_pool.stats()
+    assert stats['in_use'] == 0
+    assert stats['created'] == 1 and stats['reused'] == 5
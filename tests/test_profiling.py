@@ -0,0 +1,27 @@
+"""El perfilado de app.py mide también la lectura de filas, no solo execute."""
+import sqlite3
+import time
+
+from flask import Flask, g
+
+from profiling import ProfiledConnection, RequestProfile
+
+
+def test_lectura_de_filas_cuenta_como_sql():
+    conn = sqlite3.connect(':memory:', factory=ProfiledConnection)
+    # Cada fila tarda ~2 ms en producirse; sqlite3 lee la primera dentro de execute
+    conn.create_function('lento', 1, lambda x: time.sleep(0.002) or x)
+    conn.execute("CREATE TABLE t (x)")
+    conn.executemany("INSERT INTO t VALUES (?)", [(i,) for i in range(10)])
+
+    with Flask(__name__).app_context():
+        g._profile = perfil = RequestProfile()
+        conn.execute("SELECT lento(x) FROM t").fetchall()
+        list(conn.execute("SELECT lento(x) FROM t"))
+        cursor = conn.execute("SELECT lento(x) FROM t")
+        cursor.fetchone()
+        cursor.fetchmany(9)
+
+    assert perfil.sql_count == 3
+    assert all(segundos >= 0.018 for segundos, _ in perfil.statements)
+    assert abs(perfil.sql_time - sum(segundos for segundos, _ in perfil.statements)) < 1e-9
@@ -0,0 +1,33 @@
+"""El motor de reglas de rules.py es el mismo para la API (app.py) y para hdm:
+con la misma tabla de reglas ambos producen los mismos hallazgos."""
+import app as api
+import hdm.app as hdm
+from rules import Rule
+
+REGLAS = [
+    Rule('hb', 10, None, 'CRITICA', 'ANEMIA', 'Hb baja: {valor}', 4),
+    Rule('hb', None, 12, 'MODERADA', 'ANEMIA', 'Hb alta: {valor}', 3),
+    Rule('pth', 150, 600, 'PREVENTIVA', 'MINERAL_OSEO', 'PTH: {valor}'),
+]
+LABORATORIOS = [
+    {'hb': 9.5, 'pth': 700.0},
+    {'hb': 10.0, 'pth': 150.0},   # en el límite no dispara
+    {'hb': None, 'pth': 90.0},    # un dato faltante no dispara
+    {'hb': 12.4, 'pth': None},
+]
+
+
+def test_mismos_hallazgos_en_ambas_aplicaciones():
+    api_hallazgos = [(i, regla.mensaje.format(valor=valor))
+                     for i, regla, valor in api.evaluate_lab_rules(REGLAS, LABORATORIOS)]
+
+    parametros = hdm.parametros_reglas(REGLAS)
+    columnas = hdm.matriz_a_columnas(parametros, [[lab[p] for p in parametros] for lab in LABORATORIOS])
+    hdm_hallazgos = sorted((i, hallazgo['mensaje'])
+                           for i, hallazgos in enumerate(hdm.evaluar_reglas(REGLAS, columnas, len(LABORATORIOS)))
+                           for hallazgo in hallazgos)
+
+    assert sorted(api_hallazgos) == hdm_hallazgos == [
+        (0, 'Hb baja: 9.5'), (0, 'PTH: 700.0'), (2, 'PTH: 90.0'), (3, 'Hb alta: 12.4')]
+    assert hdm.Regla is Rule and REGLAS[2].prioridad == 1
+    assert all(isinstance(regla, Rule) for regla in api.LAB_ALERT_RULES + hdm.REGLAS_ALERTAS)
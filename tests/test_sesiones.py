@@ -0,0 +1,61 @@
+"""Captura de sesiones de diálisis: presión arterial numérica, lotes con las
+mismas reglas que el registro individual e historial paginado por cursor."""
+import json
+
+import pytest
+
+
+@pytest.fixture
+def client(api_conn, api_client, crear_pacientes):
+    crear_pacientes(2)
+    api_conn.execute("UPDATE pacientes SET activo = 0 WHERE id = 2")
+    api_conn.commit()
+    return api_client
+
+
+def test_presion_numerica(client):
+    response = client.post('/api/sessions', json={
+        'paciente_id': 1, 'fecha': '2024-03-01', 'turno': 'lmv_mañana',
+        'presion_arterial_pre': '150/90', 'pas_post': '130', 'pad_post': 80, 'qb': '400'})
+    assert response.status_code == 201
+    sesion = client.get('/api/patients/1/sessions').get_json()[0]
+    assert (sesion['turno'], sesion['pas_pre'], sesion['pad_pre'], sesion['pas_post'], sesion['qb']) == \
+        ('LMV_MAÑANA', 150, 90, 130, 400)
+
+    assert client.post('/api/sessions', json={'paciente_id': 1, 'fecha': '2024-03-01',
+                                              'turno': 'LMV_TARDE'}).status_code == 409
+    for invalida in ({'presion_arterial_pre': '80/120'}, {'pas_pre': 400}, {'qb': 'x'},
+                     {'presion_arterial_post': '120'}, {'turno': 'DOMINGO'}):
+        datos = {'paciente_id': 1, 'fecha': '2024-03-02', 'turno': 'LMV_TARDE', **invalida}
+        assert client.post('/api/sessions', json=datos).status_code == 400
+
+
+def test_lote_e_historial(client):
+    filas = [{'paciente_id': 1, 'fecha': f'2024-01-{dia:02d}', 'turno': 'MJS_TARDE', 'kt_v': 1.3}
+             for dia in range(1, 31)]
+    filas += [{'paciente_id': 1, 'fecha': '2024-01-05', 'turno': 'LMV_TARDE'},
+              {'paciente_id': 2, 'fecha': '2024-01-01', 'turno': 'MJS_TARDE'},
+              {'paciente_id': 3, 'fecha': '2024-01-01', 'turno': 'MJS_TARDE'}, {'fecha': 'x'}]
+    cuerpo = '\n'.join(json.dumps(fila) for fila in filas)
+
+    reporte = client.post('/api/sessions/bulk', data=cuerpo, content_type='application/x-ndjson').get_json()
+    assert (reporte['insertados'], reporte['rechazados']) == (30, 4)
+    assert [error['fila'] for error in reporte['errores']] == [31, 32, 33, 34]
+    assert reporte['errores'][0]['error'] == 'El paciente ya tiene una sesión el 2024-01-05'
+    # El paciente inactivo también se rechaza en el registro individual
+    assert client.post('/api/sessions', json=filas[31]).status_code == 404
+
+    reporte = client.post('/api/sessions/bulk', data=cuerpo, content_type='application/x-ndjson').get_json()
+    assert (reporte['insertados'], reporte['rechazados']) == (0, 34)
+
+    fechas, cursor = [], None
+    while True:
+        response = client.get('/api/patients/1/sessions', query_string={
+            'limit': 7, 'hasta': '2024-01-25', **({'cursor': cursor} if cursor else {})})
+        fechas += [sesion['fecha'] for sesion in response.get_json()]
+        cursor = response.headers.get('X-Next-Cursor')
+        if not cursor:
+            break
+    assert fechas == [f'2024-01-{dia:02d}' for dia in range(25, 0, -1)]
+    assert client.get('/api/patients/1/sessions?cursor=abc').status_code == 400
+    assert client.get('/api/patients/9/sessions').status_code == 404